@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from pathlib import Path
+from typing import Literal
 
 from pydantic import SecretStr
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -34,8 +35,50 @@ class Settings(BaseSettings):
     openai_model: str = "gpt-4o-mini"
     # Summary model (used to summarize recent messages before crafting)
     openai_summary_model: str = "gpt-4o-mini"
+    # Optional cheap/fast model for a first reply pass (model cascade, see app/model_cascade.py):
+    # short contexts and low-priority chats are answered by it, and escalated to OPENAI_MODEL
+    # when its self-reported confidence is below cascade_min_confidence. Unset disables the cascade.
+    openai_cheap_model: str | None = None
+    cascade_max_messages: int = 12
+    cascade_max_chars: int = 1500
+    cascade_min_confidence: float = 0.7
     openai_timeout_seconds: float = 30.0
     openai_max_retries: int = 2
+    # Where completions go: "openai" (api.openai.com), "compatible" (any OpenAI-compatible
+    # LLM_BASE_URL, e.g. a self-hosted server or scripts/fake_openai_server.py) or "fake"
+    # (in-process FakeLLM from app/fake_llm.py: no network, no key).
+    llm_provider: Literal["openai", "compatible", "fake"] = "openai"
+    llm_base_url: str | None = None
+    # FakeLLM latency in ms (fixed:300 | uniform:200:1500 | lognormal:800:0.5) and injected errors
+    # as kind:probability pairs (e.g. "429:0.05,500:0.02,timeout:0.01").
+    fake_llm_latency: str = "lognormal:800:0.5"
+    fake_llm_errors: str = ""
+    fake_llm_seed: int = 0
+    # Jittered exponential backoff between attempts (a server Retry-After takes precedence).
+    openai_retry_base_seconds: float = 1.0
+    openai_retry_max_seconds: float = 8.0
+    # Bound for the model calls of one chat per pipeline stage (summary, reply; incl. retries),
+    # counted from when a stage worker starts on the chat; 0 disables.
+    llm_chat_deadline_seconds: float = 90.0
+    # Shared HTTP connection pool for all OpenAI calls (HTTP/2 needs the optional `h2` package).
+    openai_http_max_connections: int = 20
+    openai_http_max_keepalive: int = 10
+    openai_http_keepalive_expiry_seconds: float = 60.0
+    openai_http2: bool = False
+    # Connections opened at startup so the first suggestions skip the TCP/TLS handshake (0 disables).
+    openai_http_warm_connections: int = 2
+    # Strict JSON-schema structured outputs (falls back to plain JSON mode if a model rejects them).
+    openai_structured_outputs: bool = True
+    # Cache of LLM responses keyed on model + prompts + schema (in-memory LRU + SQLite table).
+    llm_cache_enabled: bool = True
+    llm_cache_memory_entries: int = 256
+    llm_cache_ttl_hours: float = 24.0
+    llm_cache_max_rows: int = 5000
+    # Per-call token / latency log (llm_calls table, shown on /usage); older rows are dropped.
+    llm_usage_retention_days: int = 30
+    # USD per 1M tokens per model, [input, output] or [input, output, cached input]; JSON in env,
+    # e.g. LLM_PRICES='{"gpt-4o-mini": [0.15, 0.6, 0.075]}'. Models without a price show no cost.
+    llm_prices: dict[str, list[float]] = {}
 
     # App
     log_level: str = "INFO"
@@ -50,6 +93,52 @@ class Settings(BaseSettings):
 
     # Telegram sync / UI
     telegram_dialogs_limit: int = 1000
+    # Requests/second per Telethon method class (dialogs, history, send, resolve); JSON in env,
+    # e.g. TELEGRAM_RATE_LIMITS='{"history": 2}'. Unset classes use the defaults in app/telegram_rate_limit.py.
+    telegram_rate_limits: dict[str, float] = {}
+    # FloodWaits up to this long are waited out and retried once; longer ones fail the call.
+    telegram_flood_retry_max_seconds: float = 60.0
+    # Outbound queue: transient send failures are retried with backoff up to this many attempts.
+    send_max_attempts: int = 5
+
+    # Suggestion generation
+    # Max number of chats fetched from Telegram concurrently within one suggestion cycle.
+    suggestion_concurrency: int = 4
+    # Worker counts of the summary / reply pipeline stages (size them to each model's rate limits).
+    summary_workers: int = 4
+    reply_workers: int = 4
+    # "two_stage" (summary model, then reply model), "single" (one combined call to the reply model),
+    # or "auto": single call when the context is short (both thresholds below), two stages otherwise.
+    generation_mode: Literal["auto", "two_stage", "single"] = "auto"
+    single_call_max_messages: int = 30
+    single_call_max_chars: int = 4000
+    # Context token budget per chat (messages_json; 0 disables). Longer messages are cut to
+    # context_max_message_tokens first, then the oldest messages are dropped. Counts use tiktoken if
+    # installed, otherwise a chars/4 estimate.
+    context_token_budget: int = 3000
+    context_max_message_tokens: int = 400
+    # Local "needs reply" gate (app/reply_gate.py): chats whose unanswered messages score below this
+    # (0..1; questions and mentions score high, "ok" / "lol" / emoji low) skip the LLM calls; 0 disables.
+    reply_gate_threshold: float = 0.35
+    # N-best: extra candidate replies requested in the same reply call (0 disables); the
+    # suggestions page (/) lets you cycle through them and send the one you like.
+    reply_alternatives: int = 2
+    # Offline batch generation for chats marked low priority: "off", "openai" (Batch API) or
+    # "local" (file-based stand-in under openai_batch_local_dir, answered by a stub responder).
+    openai_batch_backend: Literal["off", "openai", "local"] = "off"
+    openai_batch_local_dir: Path = Path("data/batches")
+    openai_batch_local_delay_seconds: float = 60.0
+    # How often submitted batches are polled for results (independent of chat schedules).
+    openai_batch_poll_seconds: float = 60.0
+    # Push-based ingestion: react to Telethon NewMessage events instead of polling every N minutes.
+    telegram_push_ingestion: bool = False
+    telegram_push_debounce_seconds: float = 2.0
+    # Each chat is due every N minutes +/- this fraction, so polling is spread out instead of bursting.
+    scheduler_jitter_ratio: float = 0.2
+    # Activity-adaptive polling: busy chats are polled more often, quiet chats back off.
+    adaptive_polling: bool = True
+    adaptive_min_interval_minutes: float = 1.0
+    adaptive_max_interval_minutes: float = 120.0
 
 
 def get_settings() -> Settings:
@@ -1,9 +1,12 @@
 from __future__ import annotations
 
+import asyncio
 import logging
+import weakref
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Sequence
+from typing import Any, AsyncIterator, Sequence
 
 import aiosqlite
 
@@ -14,6 +17,48 @@ def utcnow_iso() -> str:
     return datetime.now(timezone.utc).replace(microsecond=0).isoformat()
 
 
+class _WriteLock:
+    """Per-connection write lock, re-entrant within the task that holds it."""
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.owner: asyncio.Task[Any] | None = None
+
+
+_write_locks: "weakref.WeakKeyDictionary[aiosqlite.Connection, _WriteLock]" = weakref.WeakKeyDictionary()
+
+
+@asynccontextmanager
+async def transaction(conn: aiosqlite.Connection) -> AsyncIterator[None]:
+    """
+    Groups writes on the shared connection into one transaction: commits on exit, rolls back on error.
+
+    All writers (services, LLM cache, usage recorder, sender, routes) go through this, so one
+    task's statements are never committed or rolled back by another task's commit. A nested
+    `transaction` in the same task joins the outer one.
+    """
+
+    state = _write_locks.get(conn)
+    if state is None:
+        state = _write_locks[conn] = _WriteLock()
+    task = asyncio.current_task()
+    if state.owner is not None and state.owner is task:
+        yield
+        return
+
+    async with state.lock:
+        state.owner = task
+        try:
+            yield
+        except BaseException:
+            await conn.rollback()
+            raise
+        else:
+            await conn.commit()
+        finally:
+            state.owner = None
+
+
 async def connect(db_path: Path) -> aiosqlite.Connection:
     db_path.parent.mkdir(parents=True, exist_ok=True)
     conn = await aiosqlite.connect(db_path.as_posix())
@@ -33,6 +78,11 @@ async def init_db(conn: aiosqlite.Connection) -> None:
             language_hint TEXT NULL,
             is_selected INTEGER NOT NULL DEFAULT 0,
             last_seen_message_id INTEGER NULL,
+            -- EWMA of incoming messages per hour, used for activity-adaptive polling.
+            activity_rate REAL NULL,
+            activity_checked_at TEXT NULL,
+            -- Low-priority chats are generated through the offline batch backend (if enabled).
+            is_low_priority INTEGER NOT NULL DEFAULT 0,
             created_at TEXT NOT NULL,
             updated_at TEXT NOT NULL
         );
@@ -48,7 +98,16 @@ async def init_db(conn: aiosqlite.Connection) -> None:
             ru_translation TEXT NOT NULL,
             reply_to_message_id INTEGER NULL,
             status TEXT NOT NULL,
+            -- Outbound queue (status = 'sending'): chosen reply target, attempts, next attempt time.
+            send_reply_to_message_id INTEGER NULL,
+            send_attempts INTEGER NOT NULL DEFAULT 0,
+            send_after TEXT NULL,
             error TEXT NULL,
+            -- Context size in (estimated) tokens before / after token-budget truncation.
+            context_tokens_raw INTEGER NULL,
+            context_tokens INTEGER NULL,
+            -- N-best alternatives from the same call: JSON list of {suggested_text, ru_translation}.
+            alternates_json TEXT NULL,
             updated_at TEXT NOT NULL,
             FOREIGN KEY(chat_id) REFERENCES chats(id) ON DELETE CASCADE
         );
@@ -58,6 +117,98 @@ async def init_db(conn: aiosqlite.Connection) -> None:
         CREATE INDEX IF NOT EXISTS idx_suggestions_chat_status
             ON suggestions(chat_id, status);
 
+        -- Rolling window of recent messages per chat (local store for incremental fetches).
+        CREATE TABLE IF NOT EXISTS messages (
+            chat_id INTEGER NOT NULL,
+            id INTEGER NOT NULL,
+            date_iso TEXT NOT NULL,
+            from_me INTEGER NOT NULL,
+            sender_name TEXT NULL,
+            text TEXT NOT NULL,
+            PRIMARY KEY (chat_id, id),
+            FOREIGN KEY(chat_id) REFERENCES chats(id) ON DELETE CASCADE
+        );
+
+        -- Last context summary per chat and the message id it covers (for incremental summaries).
+        CREATE TABLE IF NOT EXISTS chat_summaries (
+            chat_id INTEGER PRIMARY KEY,
+            summary_json TEXT NOT NULL,
+            covers_message_id INTEGER NOT NULL,
+            incremental_updates INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY(chat_id) REFERENCES chats(id) ON DELETE CASCADE
+        );
+
+        -- Offline batch generation (see app/openai_batch.py): one row per submitted batch, one item per chat.
+        CREATE TABLE IF NOT EXISTS llm_batches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            backend TEXT NOT NULL,
+            remote_id TEXT NOT NULL,
+            model TEXT NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT NULL,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_llm_batches_status ON llm_batches(status);
+
+        CREATE TABLE IF NOT EXISTS llm_batch_items (
+            batch_id INTEGER NOT NULL,
+            custom_id TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            messages_json TEXT NOT NULL,
+            latest_id INTEGER NOT NULL,
+            covers_message_id INTEGER NOT NULL,
+            incoming_ids TEXT NOT NULL,
+            -- ContextBudgetStats of the request, copied onto the suggestion.
+            context_stats_json TEXT NULL,
+            status TEXT NOT NULL,
+            PRIMARY KEY (batch_id, custom_id),
+            FOREIGN KEY(batch_id) REFERENCES llm_batches(id) ON DELETE CASCADE
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_llm_batch_items_chat_status ON llm_batch_items(chat_id, status);
+
+        -- One row per LLM call (see app/llm_usage.py), for token / latency accounting.
+        CREATE TABLE IF NOT EXISTS llm_calls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT NOT NULL,
+            chat_id INTEGER NULL,
+            stage TEXT NOT NULL,
+            model TEXT NOT NULL,
+            prompt_tokens INTEGER NOT NULL DEFAULT 0,
+            completion_tokens INTEGER NOT NULL DEFAULT 0,
+            cached_tokens INTEGER NOT NULL DEFAULT 0,
+            latency_ms INTEGER NULL,
+            attempts INTEGER NOT NULL DEFAULT 1,
+            outcome TEXT NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_llm_calls_created ON llm_calls(created_at);
+
+        -- LLM response cache (see app/llm_cache.py), keyed on a hash of model + prompts + schema.
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            last_used_at TEXT NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache(last_used_at);
+
+        -- Persistent input peer cache (chat id -> peer type/id/access hash), so Telegram calls
+        -- can skip entity resolution after restarts.
+        CREATE TABLE IF NOT EXISTS peer_cache (
+            chat_id INTEGER PRIMARY KEY,
+            peer_type TEXT NOT NULL,
+            peer_id INTEGER NOT NULL,
+            access_hash INTEGER NULL,
+            updated_at TEXT NOT NULL
+        );
+
         CREATE TABLE IF NOT EXISTS settings (
             id INTEGER PRIMARY KEY CHECK (id = 1),
             k_messages INTEGER NOT NULL,
@@ -69,16 +220,31 @@ async def init_db(conn: aiosqlite.Connection) -> None:
         """
     )
 
-    # Best-effort schema migration for older DBs (add reply_to_message_id if missing).
-    try:
-        cols = await fetch_all(conn, "PRAGMA table_info(suggestions);")
-        names = {str(c["name"]) for c in cols}
-        if "reply_to_message_id" not in names:
-            await conn.execute("ALTER TABLE suggestions ADD COLUMN reply_to_message_id INTEGER NULL;")
-            await conn.commit()
-            logger.info("Migrated DB: added suggestions.reply_to_message_id")
-    except Exception:
-        logger.exception("DB migration failed (reply_to_message_id)")
+    # Best-effort schema migrations for older DBs.
+    await _add_missing_columns(
+        conn,
+        "suggestions",
+        {
+            "reply_to_message_id": "INTEGER NULL",
+            "send_reply_to_message_id": "INTEGER NULL",
+            "send_attempts": "INTEGER NOT NULL DEFAULT 0",
+            "send_after": "TEXT NULL",
+            "context_tokens_raw": "INTEGER NULL",
+            "context_tokens": "INTEGER NULL",
+            "alternates_json": "TEXT NULL",
+        },
+    )
+    await _add_missing_columns(
+        conn,
+        "chats",
+        {
+            "activity_rate": "REAL NULL",
+            "activity_checked_at": "TEXT NULL",
+            "is_low_priority": "INTEGER NOT NULL DEFAULT 0",
+        },
+    )
+
+    await _add_missing_columns(conn, "llm_batch_items", {"context_stats_json": "TEXT NULL"})
 
     # Ensure a singleton settings row exists.
     now = utcnow_iso()
@@ -95,6 +261,20 @@ async def init_db(conn: aiosqlite.Connection) -> None:
     logger.info("SQLite initialized at %s", _db_path_for_log(conn))
 
 
+async def _add_missing_columns(conn: aiosqlite.Connection, table: str, columns: dict[str, str]) -> None:
+    try:
+        cols = await fetch_all(conn, f"PRAGMA table_info({table});")
+        names = {str(c["name"]) for c in cols}
+        for name, ddl in columns.items():
+            if name in names:
+                continue
+            await conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {ddl};")
+            await conn.commit()
+            logger.info("Migrated DB: added %s.%s", table, name)
+    except Exception:
+        logger.exception("DB migration failed (%s)", table)
+
+
 def _db_path_for_log(conn: aiosqlite.Connection) -> str:
     # aiosqlite does not expose a nice path, but conn._conn is sqlite3.Connection.
     try:
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+import httpx
+
+from app.openai_batch import stub_batch_response
+from app.tokens import count_tokens
+
+_CHAT_COMPLETIONS_PATH = "/chat/completions"
+# Error kinds accepted in the error spec besides HTTP status codes.
+_TIMEOUT = "timeout"
+
+
+def parse_latency_spec(spec: str) -> Callable[[random.Random], float]:
+    """
+    Latency distribution from a spec string, in milliseconds; returns a sampler giving seconds.
+
+    - `fixed:300`
+    - `uniform:200:1500` (min, max)
+    - `lognormal:800:0.5` (median, sigma): a long right tail, like real model latency
+    """
+
+    kind, _, rest = spec.strip().partition(":")
+    try:
+        args = [float(x) for x in rest.split(":") if x]
+    except ValueError as e:
+        raise ValueError(f"Invalid fake LLM latency spec: {spec!r}") from e
+    if kind == "fixed" and len(args) == 1:
+        return lambda rng: args[0] / 1000
+    if kind == "uniform" and len(args) == 2:
+        return lambda rng: rng.uniform(args[0], args[1]) / 1000
+    if kind == "lognormal" and len(args) == 2:
+        return lambda rng: rng.lognormvariate(math.log(max(args[0], 1e-3)), args[1]) / 1000
+    raise ValueError(f"Invalid fake LLM latency spec: {spec!r}")
+
+
+def parse_error_spec(spec: str) -> list[tuple[str, float]]:
+    """`429:0.05,500:0.02,timeout:0.01` -> [(kind, probability)]; kinds are HTTP statuses or "timeout"."""
+
+    out: list[tuple[str, float]] = []
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        kind, _, prob = part.strip().partition(":")
+        if kind != _TIMEOUT and not kind.isdigit():
+            raise ValueError(f"Invalid fake LLM error kind: {kind!r}")
+        out.append((kind, float(prob)))
+    if sum(p for _, p in out) > 1:
+        raise ValueError(f"Fake LLM error probabilities add up to more than 1: {spec!r}")
+    return out
+
+
+def fake_value_for_schema(schema: dict[str, Any], *, defs: dict[str, Any] | None = None, name: str = "value") -> Any:
+    """A deterministic instance of a (strict) JSON schema: nullable fields are null, strings are placeholders."""
+
+    defs = defs if defs is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return fake_value_for_schema(defs[schema["$ref"].rsplit("/", 1)[-1]], defs=defs, name=name)
+    if "enum" in schema:
+        return schema["enum"][0]
+    if "anyOf" in schema:
+        options = schema["anyOf"]
+        if any(o.get("type") == "null" for o in options):
+            return None
+        return fake_value_for_schema(options[0], defs=defs, name=name)
+    kind = schema.get("type")
+    if kind == "object":
+        return {
+            prop: fake_value_for_schema(sub, defs=defs, name=prop) for prop, sub in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        return []
+    if kind == "string":
+        return f"fake {name}"
+    if kind == "integer":
+        return 0
+    if kind == "number":
+        return 0.5
+    if kind == "boolean":
+        return False
+    return None
+
+
+@dataclass(frozen=True)
+class FakeReply:
+    status_code: int
+    body: dict[str, Any]
+    headers: dict[str, str] = field(default_factory=dict)
+    # Injected timeout: the caller should never get an answer.
+    hang: bool = False
+
+
+class FakeLLM:
+    """
+    Deterministic stand-in for the chat completions endpoint, for offline load tests.
+
+    Each call sleeps for a latency drawn from `latency` and then, per `errors`, either fails
+    (HTTP status or timeout) or answers with JSON that fits the request's `json_schema` response
+    format (or the batch stub keys in json_object mode), plus a token `usage` block. Draws come
+    from one RNG seeded with `seed`, so a sequential run is reproducible.
+    """
+
+    def __init__(self, *, latency: str = "fixed:200", errors: str = "", seed: int = 0):
+        self._latency = parse_latency_spec(latency)
+        self._errors = parse_error_spec(errors)
+        self._rng = random.Random(seed)
+        self.calls = 0
+
+    async def complete(self, body: dict[str, Any]) -> FakeReply:
+        self.calls += 1
+        delay = self._latency(self._rng)
+        error = self._draw_error()
+        await asyncio.sleep(delay)
+
+        if error == _TIMEOUT:
+            return FakeReply(status_code=504, body={}, hang=True)
+        if error is not None:
+            status = int(error)
+            headers = {"retry-after-ms": "500"} if status == 429 else {}
+            return FakeReply(
+                status_code=status,
+                body={"error": {"message": f"Injected fake error {status}", "type": "fake_error", "code": None}},
+                headers=headers,
+            )
+
+        content = self._content(body)
+        model = str(body.get("model") or "fake")
+        prompt_text = "".join(str(m.get("content", "")) for m in body.get("messages", []))
+        prompt_tokens = count_tokens(prompt_text, model=model)
+        completion_tokens = count_tokens(content, model=model)
+        return FakeReply(
+            status_code=200,
+            body={
+                "id": f"chatcmpl-fake-{uuid.uuid4().hex[:12]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": content, "refusal": None},
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                    "prompt_tokens_details": {"cached_tokens": 0},
+                },
+            },
+        )
+
+    def transport(self) -> httpx.AsyncBaseTransport:
+        """An in-process httpx transport serving `POST .../chat/completions`."""
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            if request.method != "POST" or not request.url.path.endswith(_CHAT_COMPLETIONS_PATH):
+                return httpx.Response(404, json={"error": {"message": "Not found"}})
+            reply = await self.complete(json.loads(request.content or b"{}"))
+            if reply.hang:
+                raise httpx.ReadTimeout("Injected fake timeout", request=request)
+            return httpx.Response(reply.status_code, json=reply.body, headers=reply.headers)
+
+        return httpx.MockTransport(handler)
+
+    def _draw_error(self) -> str | None:
+        roll = self._rng.random()
+        for kind, prob in self._errors:
+            if roll < prob:
+                return kind
+            roll -= prob
+        return None
+
+    @staticmethod
+    def _content(body: dict[str, Any]) -> str:
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            schema = response_format["json_schema"]["schema"]
+            return json.dumps(fake_value_for_schema(schema), ensure_ascii=False)
+        return stub_batch_response(body)
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import aiosqlite
+
+from app.db import fetch_one, transaction, utcnow_iso
+
+logger = logging.getLogger(__name__)
+
+# The table is trimmed once per this many writes rather than on every one.
+_EVICT_EVERY_PUTS = 50
+
+
+class LLMResponseCache:
+    """
+    Content-addressed cache of validated LLM responses.
+
+    Keyed on a hash of (model, system prompt, user prompt, response schema), so an unchanged chat
+    context re-submitted after a retry, "Run now" or a decline does not hit the API again.
+    Two tiers: an in-memory LRU in front of the SQLite `llm_cache` table. SQLite entries expire
+    after `ttl_seconds` and the table is trimmed to the `max_rows` most recently used entries
+    every `_EVICT_EVERY_PUTS` writes, so it may briefly run that many rows over the limit.
+    """
+
+    def __init__(
+        self,
+        *,
+        conn: aiosqlite.Connection,
+        memory_entries: int = 256,
+        ttl_seconds: float = 24 * 3600,
+        max_rows: int = 5000,
+    ):
+        self._conn = conn
+        self._memory: OrderedDict[str, tuple[str, datetime]] = OrderedDict()
+        self._memory_entries = max(0, int(memory_entries))
+        self._ttl = timedelta(seconds=max(0.0, float(ttl_seconds)))
+        self._max_rows = max(1, int(max_rows))
+        # Starts due so the first write after a restart trims whatever was left behind.
+        self._puts_since_evict = _EVICT_EVERY_PUTS
+
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(*, model: str, system_prompt: str, user_prompt: str, schema: dict) -> str:
+        payload = json.dumps(
+            {"model": model, "system": system_prompt, "user": user_prompt, "schema": schema},
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> str | None:
+        now = datetime.now(timezone.utc)
+
+        cached = self._memory.get(key)
+        if cached is not None:
+            content, created_at = cached
+            if now - created_at <= self._ttl:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return content
+            del self._memory[key]
+
+        row = await fetch_one(self._conn, "SELECT content, created_at FROM llm_cache WHERE key = ?;", (key,))
+        if row is not None:
+            created_at = datetime.fromisoformat(str(row["created_at"]))
+            if now - created_at <= self._ttl:
+                async with transaction(self._conn):
+                    await self._conn.execute(
+                        "UPDATE llm_cache SET last_used_at = ?, hits = hits + 1 WHERE key = ?;", (utcnow_iso(), key)
+                    )
+                self._remember(key, str(row["content"]), created_at)
+                self.db_hits += 1
+                return str(row["content"])
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, *, model: str, content: str) -> None:
+        now = utcnow_iso()
+        self._remember(key, content, datetime.fromisoformat(now))
+        async with transaction(self._conn):
+            await self._conn.execute(
+                """
+                INSERT INTO llm_cache (key, model, content, created_at, last_used_at, hits)
+                VALUES (?, ?, ?, ?, ?, 0)
+                ON CONFLICT(key) DO UPDATE SET
+                    model = excluded.model,
+                    content = excluded.content,
+                    created_at = excluded.created_at,
+                    last_used_at = excluded.last_used_at;
+                """,
+                (key, model, content, now, now),
+            )
+            self._puts_since_evict += 1
+            if self._puts_since_evict >= _EVICT_EVERY_PUTS:
+                await self._evict()
+                self._puts_since_evict = 0
+
+    async def invalidate(self, key: str) -> None:
+        self._memory.pop(key, None)
+        async with transaction(self._conn):
+            await self._conn.execute("DELETE FROM llm_cache WHERE key = ?;", (key,))
+
+    def stats(self) -> dict[str, float]:
+        hits = self.memory_hits + self.db_hits
+        total = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": (hits / total) if total else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+    def _remember(self, key: str, content: str, created_at: datetime) -> None:
+        if self._memory_entries <= 0:
+            return
+        self._memory[key] = (content, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._memory_entries:
+            self._memory.popitem(last=False)
+
+    async def _evict(self) -> None:
+        cutoff = (datetime.now(timezone.utc) - self._ttl).replace(microsecond=0).isoformat()
+        await self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?;", (cutoff,))
+        await self._conn.execute(
+            """
+            DELETE FROM llm_cache
+            WHERE key NOT IN (
+                SELECT key FROM llm_cache ORDER BY last_used_at DESC LIMIT ?
+            );
+            """,
+            (self._max_rows,),
+        )
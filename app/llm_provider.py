@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import logging
+from typing import Protocol
+
+import httpx
+from openai import AsyncOpenAI
+
+from app.fake_llm import FakeLLM
+from app.openai_http import OPENAI_BASE_URL
+
+logger = logging.getLogger(__name__)
+
+
+class LLMProvider(Protocol):
+    """
+    Where OpenAIClient sends its chat completions: builds the SDK client for one endpoint.
+
+    `create_client` returns None when the provider is not usable (e.g. no API key), which leaves
+    the OpenAIClient disabled. `base_url` is None for providers without a network endpoint.
+    """
+
+    name: str
+    base_url: str | None
+
+    def create_client(self, *, timeout_seconds: float, http_client: httpx.AsyncClient | None) -> AsyncOpenAI | None: ...
+
+
+class OpenAIProvider:
+    name = "openai"
+    base_url = OPENAI_BASE_URL
+
+    def __init__(self, api_key: str | None):
+        self._api_key = api_key.strip() if api_key else None
+
+    def create_client(self, *, timeout_seconds: float, http_client: httpx.AsyncClient | None) -> AsyncOpenAI | None:
+        if not self._api_key:
+            return None
+        # Retries are handled by request_json (and paced by the rate limiter), not blindly by the SDK.
+        return AsyncOpenAI(api_key=self._api_key, timeout=timeout_seconds, max_retries=0, http_client=http_client)
+
+
+class CompatibleProvider:
+    """Any OpenAI-compatible chat completions endpoint (vLLM, llama.cpp server, a gateway, ...)."""
+
+    name = "compatible"
+
+    def __init__(self, base_url: str | None, api_key: str | None = None):
+        if not base_url:
+            raise ValueError("LLM_PROVIDER=compatible requires LLM_BASE_URL")
+        self.base_url = base_url.rstrip("/")
+        # Self-hosted servers often ignore the key, but the SDK insists on one.
+        self._api_key = (api_key or "").strip() or "unused"
+
+    def create_client(self, *, timeout_seconds: float, http_client: httpx.AsyncClient | None) -> AsyncOpenAI | None:
+        return AsyncOpenAI(
+            api_key=self._api_key,
+            base_url=self.base_url,
+            timeout=timeout_seconds,
+            max_retries=0,
+            http_client=http_client,
+        )
+
+
+class FakeProvider:
+    """
+    In-process FakeLLM (see app/fake_llm.py): no network, no key, configurable latency and errors.
+
+    A shared `http_client` must be built on `fake.transport()` (see `build_openai_http_client`).
+    """
+
+    name = "fake"
+    base_url = None
+
+    def __init__(self, fake: FakeLLM):
+        self.fake = fake
+
+    def create_client(self, *, timeout_seconds: float, http_client: httpx.AsyncClient | None) -> AsyncOpenAI | None:
+        if http_client is None:
+            # No shared pool (e.g. a standalone OpenAIClient): talk to the fake over a private client.
+            http_client = httpx.AsyncClient(transport=self.fake.transport(), timeout=timeout_seconds)
+        return AsyncOpenAI(
+            api_key="fake",
+            base_url="http://fake-llm.invalid/v1",
+            timeout=timeout_seconds,
+            max_retries=0,
+            http_client=http_client,
+        )
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+import aiosqlite
+
+from app.db import transaction, utcnow_iso
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CallUsage:
+    """Token usage of one logical LLM call, summed over its attempts."""
+
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+
+    def add(self, usage: Any) -> None:
+        """Adds an OpenAI `usage` object (or Batch API usage dict); missing fields count as 0."""
+
+        if usage is None:
+            return
+        get = usage.get if isinstance(usage, dict) else (lambda name: getattr(usage, name, None))
+        self.prompt_tokens += int(get("prompt_tokens") or 0)
+        self.completion_tokens += int(get("completion_tokens") or 0)
+        details = get("prompt_tokens_details")
+        if details is not None:
+            cached = details.get("cached_tokens") if isinstance(details, dict) else getattr(details, "cached_tokens", None)
+            self.cached_tokens += int(cached or 0)
+
+
+@dataclass(frozen=True)
+class LLMCallRecord:
+    chat_id: int | None
+    stage: str
+    model: str
+    usage: CallUsage
+    # None for calls without a meaningful latency (offline batches).
+    latency_ms: int | None
+    attempts: int
+    # "ok", "cached", or the exception class name of the final failure.
+    outcome: str
+    created_at: str = field(default_factory=utcnow_iso)
+
+
+class LLMUsageRecorder:
+    """
+    Buffers one row per LLM call and writes them to the `llm_calls` table in batches.
+
+    `record` only appends to memory, so the request path never waits on SQLite; a background
+    task flushes every `flush_interval_seconds` (sooner once `flush_size` rows are buffered)
+    and drops rows older than `retention_days`.
+    """
+
+    def __init__(
+        self,
+        *,
+        conn: aiosqlite.Connection,
+        flush_interval_seconds: float = 10.0,
+        flush_size: int = 50,
+        retention_days: int = 30,
+    ):
+        self._conn = conn
+        self._flush_interval = max(0.5, float(flush_interval_seconds))
+        self._flush_size = max(1, int(flush_size))
+        self._retention = timedelta(days=max(1, int(retention_days)))
+        self._buffer: list[LLMCallRecord] = []
+
+        self._task: asyncio.Task[None] | None = None
+        self._wakeup = asyncio.Event()
+
+    def record(self, record: LLMCallRecord) -> None:
+        self._buffer.append(record)
+        if len(self._buffer) >= self._flush_size:
+            self._wakeup.set()
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run_loop(), name="llm-usage-recorder")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            finally:
+                self._task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        if not self._buffer:
+            return
+        rows, self._buffer = self._buffer, []
+        try:
+            async with transaction(self._conn):
+                await self._conn.executemany(
+                    """
+                    INSERT INTO llm_calls (
+                        created_at, chat_id, stage, model, prompt_tokens, completion_tokens, cached_tokens,
+                        latency_ms, attempts, outcome
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+                    """,
+                    [
+                        (
+                            r.created_at,
+                            r.chat_id,
+                            r.stage,
+                            r.model,
+                            r.usage.prompt_tokens,
+                            r.usage.completion_tokens,
+                            r.usage.cached_tokens,
+                            r.latency_ms,
+                            r.attempts,
+                            r.outcome,
+                        )
+                        for r in rows
+                    ],
+                )
+                cutoff = (datetime.now(timezone.utc) - self._retention).replace(microsecond=0).isoformat()
+                await self._conn.execute("DELETE FROM llm_calls WHERE created_at < ?;", (cutoff,))
+        except Exception:
+            logger.exception("Failed to write %s LLM usage rows", len(rows))
+
+    async def _run_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
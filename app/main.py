@@ -12,12 +12,25 @@ from starlette.responses import Response
 
 from app.config import get_settings
 from app.db import connect, init_db
+from app.fake_llm import FakeLLM
+from app.llm_cache import LLMResponseCache
+from app.llm_provider import CompatibleProvider, FakeProvider, LLMProvider, OpenAIProvider
+from app.llm_usage import LLMUsageRecorder
 from app.logging_config import configure_logging
+from app.model_cascade import CascadeOptions
+from app.openai_batch import BatchBackend, LocalBatchBackend, OpenAIBatchBackend
 from app.openai_client import OpenAIClient
+from app.openai_http import build_openai_http_client, warm_up_http_client
+from app.openai_rate_limit import OpenAIRateLimiter
 from app.prompts import PromptStore
-from app.routes import chats_router, prompts_router, settings_router, suggestions_router
+from app.retry_policy import RetryPolicy
+from app.routes import chats_router, prompts_router, settings_router, suggestions_router, usage_router
 from app.scheduler import SuggestionScheduler
+from app.sender import OutboundSender
+from app.services.peers_service import load_input_peers
+from app.services.suggestions_service import CycleOptions
 from app.telegram_client import TelegramClientManager
+from app.telegram_rate_limit import TelegramRateLimiter
 
 logger = logging.getLogger(__name__)
 
@@ -43,44 +56,177 @@ async def lifespan(app: FastAPI):
         api_id=settings.telegram_api_id,
         api_hash=settings.telegram_api_hash.get_secret_value(),
         session_name=settings.telegram_session_name,
+        rate_limiter=TelegramRateLimiter(
+            settings.telegram_rate_limits,
+            flood_retry_max_seconds=settings.telegram_flood_retry_max_seconds,
+        ),
     )
     await tg.start()
+    tg.prime_input_peers(await load_input_peers(conn))
+
+    llm_cache = (
+        LLMResponseCache(
+            conn=conn,
+            memory_entries=settings.llm_cache_memory_entries,
+            ttl_seconds=settings.llm_cache_ttl_hours * 3600,
+            max_rows=settings.llm_cache_max_rows,
+        )
+        if settings.llm_cache_enabled
+        else None
+    )
+
+    llm_usage = LLMUsageRecorder(conn=conn, retention_days=settings.llm_usage_retention_days)
+    await llm_usage.start()
+
+    # One limiter for both clients: they share the API key and therefore the account's limits.
+    openai_rate_limiter = OpenAIRateLimiter()
+    retry_policy = RetryPolicy(
+        max_attempts=settings.openai_max_retries + 1,
+        base_seconds=settings.openai_retry_base_seconds,
+        max_seconds=settings.openai_retry_max_seconds,
+    )
+
+    fake_llm = (
+        FakeLLM(latency=settings.fake_llm_latency, errors=settings.fake_llm_errors, seed=settings.fake_llm_seed)
+        if settings.llm_provider == "fake"
+        else None
+    )
+    openai_http = build_openai_http_client(
+        timeout_seconds=settings.openai_timeout_seconds,
+        max_connections=settings.openai_http_max_connections,
+        max_keepalive_connections=settings.openai_http_max_keepalive,
+        keepalive_expiry_seconds=settings.openai_http_keepalive_expiry_seconds,
+        http2=settings.openai_http2,
+        transport=fake_llm.transport() if fake_llm is not None else None,
+    )
+
+    openai_key = settings.openai_api_key.get_secret_value() if settings.openai_api_key else None
+    llm_provider: LLMProvider
+    if fake_llm is not None:
+        llm_provider = FakeProvider(fake_llm)
+    elif settings.llm_provider == "compatible":
+        llm_provider = CompatibleProvider(settings.llm_base_url, api_key=openai_key)
+    else:
+        llm_provider = OpenAIProvider(openai_key)
+    logger.info("LLM provider: %s", llm_provider.name)
 
     openai_client = OpenAIClient(
-        api_key=(settings.openai_api_key.get_secret_value() if settings.openai_api_key else None),
+        provider=llm_provider,
         model=settings.openai_model,
         timeout_seconds=settings.openai_timeout_seconds,
         max_retries=settings.openai_max_retries,
+        cache=llm_cache,
+        structured_outputs=settings.openai_structured_outputs,
+        rate_limiter=openai_rate_limiter,
+        retry_policy=retry_policy,
+        http_client=openai_http,
+        usage_recorder=llm_usage,
     )
 
     openai_summary_client = OpenAIClient(
-        api_key=(settings.openai_api_key.get_secret_value() if settings.openai_api_key else None),
+        provider=llm_provider,
         model=settings.openai_summary_model,
         timeout_seconds=settings.openai_timeout_seconds,
         max_retries=settings.openai_max_retries,
+        cache=llm_cache,
+        structured_outputs=settings.openai_structured_outputs,
+        rate_limiter=openai_rate_limiter,
+        retry_policy=retry_policy,
+        http_client=openai_http,
+        usage_recorder=llm_usage,
+    )
+
+    openai_cheap_client = (
+        OpenAIClient(
+            provider=llm_provider,
+            model=settings.openai_cheap_model,
+            timeout_seconds=settings.openai_timeout_seconds,
+            max_retries=settings.openai_max_retries,
+            cache=llm_cache,
+            structured_outputs=settings.openai_structured_outputs,
+            rate_limiter=openai_rate_limiter,
+            retry_policy=retry_policy,
+            http_client=openai_http,
+            usage_recorder=llm_usage,
+        )
+        if settings.openai_cheap_model
+        else None
     )
 
+    if openai_client.enabled and llm_provider.base_url and settings.openai_http_warm_connections > 0:
+        await warm_up_http_client(
+            openai_http, base_url=llm_provider.base_url, connections=settings.openai_http_warm_connections
+        )
+
+    batch_backend: BatchBackend | None = None
+    if settings.openai_batch_backend == "local":
+        batch_backend = LocalBatchBackend(
+            settings.openai_batch_local_dir, delay_seconds=settings.openai_batch_local_delay_seconds
+        )
+    elif settings.openai_batch_backend == "openai" and openai_client.raw_client is not None:
+        batch_backend = OpenAIBatchBackend(openai_client.raw_client)
+
     scheduler = SuggestionScheduler(
         conn=conn,
         tg=tg,
         openai_summary=openai_summary_client,
         openai_reply=openai_client,
         prompts=prompt_store,
+        options=CycleOptions(
+            fetch_concurrency=settings.suggestion_concurrency,
+            summary_workers=settings.summary_workers,
+            reply_workers=settings.reply_workers,
+            generation_mode=settings.generation_mode,
+            single_call_max_messages=settings.single_call_max_messages,
+            single_call_max_chars=settings.single_call_max_chars,
+            context_token_budget=settings.context_token_budget,
+            context_max_message_tokens=settings.context_max_message_tokens,
+            chat_deadline_seconds=settings.llm_chat_deadline_seconds,
+            reply_gate_threshold=settings.reply_gate_threshold,
+            reply_alternatives=settings.reply_alternatives,
+            cascade=CascadeOptions(
+                max_messages=settings.cascade_max_messages,
+                max_chars=settings.cascade_max_chars,
+                min_confidence=settings.cascade_min_confidence,
+            ),
+        ),
+        push=settings.telegram_push_ingestion,
+        push_debounce_seconds=settings.telegram_push_debounce_seconds,
+        jitter_ratio=settings.scheduler_jitter_ratio,
+        adaptive=settings.adaptive_polling,
+        min_interval_seconds=settings.adaptive_min_interval_minutes * 60,
+        max_interval_seconds=settings.adaptive_max_interval_minutes * 60,
+        batch=batch_backend,
+        batch_poll_seconds=settings.openai_batch_poll_seconds,
+        openai_cheap=openai_cheap_client,
     )
     await scheduler.start()
 
+    sender = OutboundSender(
+        conn=conn, tg=tg, max_attempts=settings.send_max_attempts, on_settled=scheduler.recheck_chat
+    )
+    await sender.start()
+
     app.state.settings = settings
     app.state.db = conn
     app.state.prompt_store = prompt_store
     app.state.tg = tg
     app.state.openai = openai_client
     app.state.openai_summary = openai_summary_client
+    app.state.openai_cheap = openai_cheap_client
+    app.state.llm_cache = llm_cache
+    app.state.llm_usage = llm_usage
+    app.state.openai_rate_limiter = openai_rate_limiter
     app.state.scheduler = scheduler
+    app.state.sender = sender
 
     yield
 
     await scheduler.stop()
+    await sender.stop()
     await tg.stop()
+    await llm_usage.stop()
+    await openai_http.aclose()
     await conn.close()
 
 
@@ -135,5 +281,6 @@ app.include_router(suggestions_router)
 app.include_router(chats_router)
 app.include_router(settings_router)
 app.include_router(prompts_router)
+app.include_router(usage_router)
 
 
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import logging
+import time
+from dataclasses import dataclass
+from typing import TypeVar
+
+from pydantic import BaseModel, ValidationError
+
+from app.models import SourceMessage
+from app.openai_client import OpenAIClient
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T", bound=BaseModel)
+
+
+@dataclass(frozen=True)
+class CascadeOptions:
+    """
+    When the cheap model gets the first pass at a reply, and when its answer is kept.
+
+    Short contexts (both limits) and low-priority chats go to the cheap model first; its reply is
+    kept if its self-reported confidence reaches `min_confidence`, otherwise the request is
+    escalated to the reply model.
+    """
+
+    max_messages: int = 12
+    max_chars: int = 1500
+    min_confidence: float = 0.7
+
+
+def use_cheap_first(source: list[SourceMessage], *, is_low_priority: bool, options: CascadeOptions) -> bool:
+    if is_low_priority:
+        return True
+    return len(source) <= options.max_messages and sum(len(m.text) for m in source) <= options.max_chars
+
+
+async def request_with_cascade(
+    *,
+    cheap: OpenAIClient,
+    strong: OpenAIClient,
+    system_prompt: str,
+    user_prompt: str,
+    confidence_prompt: str,
+    schema_model: type[T],
+    cascade_schema: type[BaseModel],
+    options: CascadeOptions,
+    deadline: float | None,
+    chat_id: int,
+    stage: str,
+) -> T:
+    """
+    Asks `cheap` for `cascade_schema` (= `schema_model` + `confidence`), escalating to `strong`
+    with the plain prompt when confidence is low or the cheap call fails. An answer without
+    `confidence` (possible in json_object mode) fails validation and is logged as such; it is
+    never read as 0. Returns `schema_model`.
+    """
+
+    try:
+        first = await cheap.request_json(
+            system_prompt=system_prompt,
+            user_prompt=f"{user_prompt}\n\n{confidence_prompt}",
+            schema_model=cascade_schema,
+            deadline=deadline,
+            chat_id=chat_id,
+            stage=stage,
+        )
+    except Exception as e:
+        if deadline is not None and time.monotonic() >= deadline:
+            raise
+        if isinstance(e, ValidationError):
+            missing = [".".join(str(x) for x in err["loc"]) for err in e.errors() if err["type"] == "missing"]
+            logger.warning(
+                "Cascade: cheap model %s returned an unparseable answer for chat_id=%s (missing: %s); escalating",
+                cheap.model,
+                chat_id,
+                ", ".join(missing) or "none",
+            )
+        else:
+            logger.warning("Cascade: cheap model %s failed for chat_id=%s (%s); escalating", cheap.model, chat_id, e)
+    else:
+        confidence = min(1.0, max(0.0, float(first.confidence)))  # type: ignore[attr-defined]
+        if confidence >= options.min_confidence:
+            logger.info("Cascade: chat_id=%s answered by %s (confidence=%.2f)", chat_id, cheap.model, confidence)
+            # exclude_unset keeps "key missing" distinguishable from "empty" (e.g. alternatives).
+            return schema_model.model_validate(first.model_dump(exclude={"confidence"}, exclude_unset=True))
+        logger.info(
+            "Cascade: chat_id=%s escalating %s -> %s (confidence=%.2f < %.2f)",
+            chat_id,
+            cheap.model,
+            strong.model,
+            confidence,
+            options.min_confidence,
+        )
+
+    return await strong.request_json(
+        system_prompt=system_prompt,
+        user_prompt=user_prompt,
+        schema_model=schema_model,
+        deadline=deadline,
+        chat_id=chat_id,
+        stage=stage,
+    )
@@ -9,6 +9,8 @@ from pydantic import BaseModel, Field
 
 class SuggestionStatus(str, Enum):
     pending = "pending"
+    # Queued for the background sender (see app/sender.py).
+    sending = "sending"
     sent = "sent"
     declined = "declined"
     failed = "failed"
@@ -20,6 +22,10 @@ class ChatRecord(BaseModel):
     language_hint: str | None = None
     is_selected: bool = False
     last_seen_message_id: int | None = None
+    # Observed incoming messages per hour (EWMA); None until observed twice.
+    activity_rate: float | None = None
+    activity_checked_at: datetime | None = None
+    is_low_priority: bool = False
     created_at: datetime | None = None
     updated_at: datetime | None = None
 
@@ -32,11 +38,20 @@ class SourceMessage(BaseModel):
     text: str
 
 
+class ReplyCandidate(BaseModel):
+    """An alternative reply returned next to the main one (empty ones are dropped when stored)."""
+
+    suggested_text: str
+    ru_translation: str
+
+
 class ReplySuggestion(BaseModel):
     suggested_text: str = Field(min_length=1)
     ru_translation: str = Field(min_length=1)
     # When sending as "reply", reply to this Telegram message id (must exist in provided source messages).
     reply_to_message_id: int | None = None
+    # N-best: other candidates from the same call (see the reply_alternatives prompt).
+    alternatives: list[ReplyCandidate] = Field(default_factory=list)
 
 
 class ChatContextSummary(BaseModel):
@@ -50,6 +65,31 @@ class ChatContextSummary(BaseModel):
     reply_to_message_id: int | None = None
 
 
+class SummaryAndReply(BaseModel):
+    """
+    Single-call generation output: the context summary fields and the reply in one response.
+    """
+
+    language: str
+    tone: str
+    summary: str = Field(min_length=1)
+    reply_to_message_id: int | None = None
+    suggested_text: str = Field(min_length=1)
+    ru_translation: str = Field(min_length=1)
+    alternatives: list[ReplyCandidate] = Field(default_factory=list)
+
+
+class CascadeReplySuggestion(ReplySuggestion):
+    """Cheap-model first pass (see app/model_cascade.py): the reply plus the model's confidence in it."""
+
+    # 0..1 as asked in the prompt; clamped by the cascade, not validated (a stray 1.2 should not cost a retry).
+    confidence: float
+
+
+class CascadeSummaryAndReply(SummaryAndReply):
+    confidence: float
+
+
 class SuggestionRecord(BaseModel):
     id: int
     chat_id: int
@@ -71,6 +111,17 @@ class SuggestionView(BaseModel):
     ru_translation: str
     status: SuggestionStatus
     error: str | None = None
+    # Context size (estimated tokens of messages_json) before / after the token budget was applied.
+    context_tokens_raw: int | None = None
+    context_tokens: int | None = None
+    # Alternative candidates stored with the suggestion (the main text is not included).
+    alternatives: list[ReplyCandidate] = Field(default_factory=list)
+
+    def candidates(self) -> list[dict[str, str]]:
+        """Main text first, then the alternatives (the UI cycles through these by index)."""
+
+        main = ReplyCandidate(suggested_text=self.suggested_text, ru_translation=self.ru_translation)
+        return [c.model_dump() for c in [main, *self.alternatives]]
 
 
 class SettingsRecord(BaseModel):
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import json
+import logging
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Protocol
+
+from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+_CHAT_COMPLETIONS_URL = "/v1/chat/completions"
+
+
+@dataclass(frozen=True)
+class BatchResult:
+    """Outcome of one batch request line: the message content, or an error."""
+
+    content: str | None = None
+    error: str | None = None
+    # The response body's `usage` object, if any.
+    usage: dict[str, Any] | None = None
+
+
+class BatchBackend(Protocol):
+    """
+    Asynchronous (offline) chat completions in the OpenAI Batch API format.
+
+    `submit` takes request bodies keyed by custom_id; `poll` returns "pending", "completed" or
+    "failed"; `results` maps custom_id -> BatchResult once completed.
+    """
+
+    name: str
+
+    async def submit(self, requests: dict[str, dict[str, Any]]) -> str: ...
+
+    async def poll(self, batch_id: str) -> str: ...
+
+    async def results(self, batch_id: str) -> dict[str, BatchResult]: ...
+
+
+def batch_input_lines(requests: dict[str, dict[str, Any]]) -> str:
+    return "".join(
+        json.dumps({"custom_id": custom_id, "method": "POST", "url": _CHAT_COMPLETIONS_URL, "body": body}, ensure_ascii=False)
+        + "\n"
+        for custom_id, body in requests.items()
+    )
+
+
+def parse_batch_output(text: str) -> dict[str, BatchResult]:
+    """Parses Batch API output / error JSONL into custom_id -> BatchResult."""
+
+    out: dict[str, BatchResult] = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        custom_id = str(item.get("custom_id"))
+        response = item.get("response") or {}
+        error = item.get("error")
+        if error:
+            out[custom_id] = BatchResult(error=str(error.get("message") if isinstance(error, dict) else error))
+            continue
+        if int(response.get("status_code") or 0) != 200:
+            out[custom_id] = BatchResult(error=f"HTTP {response.get('status_code')}: {response.get('body')}")
+            continue
+        try:
+            content = response["body"]["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError):
+            out[custom_id] = BatchResult(error="Malformed batch response line")
+            continue
+        out[custom_id] = BatchResult(content=str(content or ""), usage=response["body"].get("usage"))
+    return out
+
+
+class OpenAIBatchBackend:
+    """Batch API: upload the JSONL input file, create the batch, download output/error files."""
+
+    name = "openai"
+
+    def __init__(self, client: AsyncOpenAI, *, completion_window: str = "24h"):
+        self._client = client
+        self._completion_window = completion_window
+
+    async def submit(self, requests: dict[str, dict[str, Any]]) -> str:
+        data = batch_input_lines(requests).encode("utf-8")
+        input_file = await self._client.files.create(file=("batch.jsonl", data), purpose="batch")
+        batch = await self._client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=_CHAT_COMPLETIONS_URL,
+            completion_window=self._completion_window,
+        )
+        logger.info("Submitted OpenAI batch %s (%s requests)", batch.id, len(requests))
+        return str(batch.id)
+
+    async def poll(self, batch_id: str) -> str:
+        batch = await self._client.batches.retrieve(batch_id)
+        if batch.status == "completed":
+            return "completed"
+        if batch.status in {"expired", "cancelled"}:
+            # Whatever finished before expiry is still in the output file; the rest is reported failed.
+            return "completed" if batch.output_file_id else "failed"
+        if batch.status == "failed":
+            return "failed"
+        return "pending"
+
+    async def results(self, batch_id: str) -> dict[str, BatchResult]:
+        batch = await self._client.batches.retrieve(batch_id)
+        out: dict[str, BatchResult] = {}
+        for file_id in (batch.error_file_id, batch.output_file_id):
+            if file_id:
+                content = await self._client.files.content(file_id)
+                out.update(parse_batch_output(content.text))
+        return out
+
+
+def stub_batch_response(body: dict[str, Any]) -> str:
+    """
+    Offline stand-in for a model: returns every key any of our response schemas asks for
+    (pydantic ignores the extra ones), so batches can be exercised without an API key.
+    """
+
+    return json.dumps(
+        {
+            "language": "en",
+            "tone": "casual",
+            "summary": "Local batch stub summary.",
+            "reply_to_message_id": None,
+            "suggested_text": "local batch stub reply",
+            "ru_translation": "ответ-заглушка локального батча",
+        },
+        ensure_ascii=False,
+    )
+
+
+class LocalBatchBackend:
+    """
+    File-based stand-in for the Batch API (for offline testing).
+
+    `submit` writes `<id>.input.jsonl` into `directory`; once `delay_seconds` have passed, `poll`
+    answers every line with `responder(body)` and writes `<id>.output.jsonl` in Batch API output
+    format. Everything lives on disk, so pending local batches survive restarts.
+    """
+
+    name = "local"
+
+    def __init__(
+        self,
+        directory: Path,
+        *,
+        delay_seconds: float = 0.0,
+        responder: Callable[[dict[str, Any]], str] = stub_batch_response,
+    ):
+        self._dir = directory
+        self._delay_seconds = max(0.0, float(delay_seconds))
+        self._responder = responder
+
+    async def submit(self, requests: dict[str, dict[str, Any]]) -> str:
+        self._dir.mkdir(parents=True, exist_ok=True)
+        batch_id = f"local_batch_{uuid.uuid4().hex}"
+        self._input_path(batch_id).write_text(batch_input_lines(requests), encoding="utf-8")
+        logger.info("Submitted local batch %s (%s requests)", batch_id, len(requests))
+        return batch_id
+
+    async def poll(self, batch_id: str) -> str:
+        if self._output_path(batch_id).exists():
+            return "completed"
+        input_path = self._input_path(batch_id)
+        if not input_path.exists():
+            return "failed"
+        if time.time() - input_path.stat().st_mtime < self._delay_seconds:
+            return "pending"
+        self._complete(batch_id)
+        return "completed"
+
+    async def results(self, batch_id: str) -> dict[str, BatchResult]:
+        return parse_batch_output(self._output_path(batch_id).read_text(encoding="utf-8"))
+
+    def _complete(self, batch_id: str) -> None:
+        lines = []
+        for line in self._input_path(batch_id).read_text(encoding="utf-8").splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            content = self._responder(item["body"])
+            lines.append(
+                json.dumps(
+                    {
+                        "custom_id": item["custom_id"],
+                        "response": {
+                            "status_code": 200,
+                            "body": {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]},
+                        },
+                        "error": None,
+                    },
+                    ensure_ascii=False,
+                )
+            )
+        self._output_path(batch_id).write_text("".join(line + "\n" for line in lines), encoding="utf-8")
+
+    def _input_path(self, batch_id: str) -> Path:
+        return self._dir / f"{batch_id}.input.jsonl"
+
+    def _output_path(self, batch_id: str) -> Path:
+        return self._dir / f"{batch_id}.output.jsonl"
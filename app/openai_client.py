@@ -3,12 +3,20 @@ from __future__ import annotations
 import asyncio
 import json
 import logging
+import time
 from typing import Any, TypeVar
 
-from openai import APIError, APITimeoutError, AsyncOpenAI, BadRequestError, RateLimitError
+import httpx
+from openai import AsyncOpenAI, BadRequestError, RateLimitError
 from pydantic import BaseModel
 
+from app.llm_cache import LLMResponseCache
+from app.llm_provider import LLMProvider, OpenAIProvider
+from app.llm_usage import CallUsage, LLMCallRecord, LLMUsageRecorder
 from app.models import ReplySuggestion
+from app.openai_rate_limit import OpenAIRateLimiter
+from app.retry_policy import RetryPolicy
+from app.tokens import count_tokens
 
 logger = logging.getLogger(__name__)
 
@@ -25,62 +33,179 @@ class OpenAIClient:
     def __init__(
         self,
         *,
-        api_key: str | None,
+        api_key: str | None = None,
         model: str,
         timeout_seconds: float,
         max_retries: int,
+        cache: LLMResponseCache | None = None,
+        structured_outputs: bool = True,
+        rate_limiter: OpenAIRateLimiter | None = None,
+        retry_policy: RetryPolicy | None = None,
+        http_client: httpx.AsyncClient | None = None,
+        usage_recorder: LLMUsageRecorder | None = None,
+        provider: LLMProvider | None = None,
     ):
-        self.enabled = bool(api_key and api_key.strip())
+        # `api_key` is only used for the default provider (api.openai.com).
+        self.provider = provider or OpenAIProvider(api_key)
         self.model = model
         self.max_retries = max(0, int(max_retries))
-        self._client: AsyncOpenAI | None = None
+        self._retry_policy = retry_policy or RetryPolicy(max_attempts=self.max_retries + 1)
+        self._cache = cache
+        # Strict json_schema response format; switched off automatically if the model rejects it.
+        self._structured_outputs = bool(structured_outputs)
+        self._rate_limiter = rate_limiter
+        self._usage_recorder = usage_recorder
 
-        if self.enabled:
-            self._client = AsyncOpenAI(api_key=api_key, timeout=timeout_seconds)
+        self._client: AsyncOpenAI | None = self.provider.create_client(
+            timeout_seconds=timeout_seconds, http_client=http_client
+        )
+        self.enabled = self._client is not None
 
     async def request_json(
-        self, *, system_prompt: str, user_prompt: str, schema_model: type[T]
+        self,
+        *,
+        system_prompt: str,
+        user_prompt: str,
+        schema_model: type[T],
+        deadline: float | None = None,
+        chat_id: int | None = None,
+        stage: str = "other",
     ) -> T:
+        """
+        Requests a JSON response validated as `schema_model`, retrying per the retry policy.
+
+        `deadline` is a time.monotonic() timestamp bounding the whole call: each attempt (including
+        rate-limiter waits) is cut off at it, and no retry is started that would begin after it.
+        `chat_id` and `stage` only label the call in the usage log (see app/llm_usage.py).
+        """
+
         if not self.enabled or self._client is None:
-            raise RuntimeError("OpenAI is not configured (missing OPENAI_API_KEY).")
+            raise RuntimeError(f"LLM provider {self.provider.name!r} is not configured (missing OPENAI_API_KEY?).")
+
+        started = time.monotonic()
+        usage = CallUsage()
 
-        last_err: Exception | None = None
-        for attempt in range(self.max_retries + 1):
+        def _record(outcome: str, attempts: int) -> None:
+            if self._usage_recorder is None:
+                return
+            self._usage_recorder.record(
+                LLMCallRecord(
+                    chat_id=chat_id,
+                    stage=stage,
+                    model=self.model,
+                    usage=usage,
+                    latency_ms=int((time.monotonic() - started) * 1000),
+                    attempts=attempts,
+                    outcome=outcome,
+                )
+            )
+
+        cache_key: str | None = None
+        if self._cache is not None:
+            cache_key = self._cache.make_key(
+                model=self.model,
+                system_prompt=system_prompt,
+                user_prompt=user_prompt,
+                schema=schema_model.model_json_schema(),
+            )
+            cached = await self._cache.get(cache_key)
+            if cached is not None:
+                try:
+                    result = schema_model.model_validate_json(cached)
+                    _record("cached", 0)
+                    return result
+                except ValueError:
+                    logger.warning("Discarding invalid cached LLM response (model=%s)", self.model)
+                    await self._cache.invalidate(cache_key)
+
+        policy = self._retry_policy
+        attempt = 0
+        while True:
             try:
-                return await self._request_once(
-                    system_prompt=system_prompt, user_prompt=user_prompt, schema_model=schema_model
+                result = await self._request_before_deadline(
+                    system_prompt=system_prompt,
+                    user_prompt=user_prompt,
+                    schema_model=schema_model,
+                    deadline=deadline,
+                    usage=usage,
                 )
-            except (RateLimitError, APITimeoutError, APIError, json.JSONDecodeError, ValueError) as e:
-                last_err = e
-                delay = min(8.0, 2.0**attempt)
+                _record("ok", attempt + 1)
+                if self._cache is not None and cache_key is not None:
+                    await self._cache.put(cache_key, model=self.model, content=result.model_dump_json())
+                return result
+            except Exception as e:
+                if not policy.is_retryable(e) or attempt + 1 >= policy.max_attempts:
+                    _record(type(e).__name__, attempt + 1)
+                    raise
+                delay = policy.delay_seconds(attempt, e)
+                if isinstance(e, RateLimitError) and self._rate_limiter is not None:
+                    # The limiter holds the next attempt until retry-after; no extra blind sleep.
+                    delay = 0.0
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    _record(type(e).__name__, attempt + 1)
+                    raise
                 logger.warning(
                     "OpenAI call failed (attempt %s/%s): %s. Retrying in %.1fs",
                     attempt + 1,
-                    self.max_retries + 1,
+                    policy.max_attempts,
                     type(e).__name__,
                     delay,
                 )
                 await asyncio.sleep(delay)
+                attempt += 1
 
-        assert last_err is not None
-        raise last_err
+    async def _request_before_deadline(
+        self,
+        *,
+        system_prompt: str,
+        user_prompt: str,
+        schema_model: type[T],
+        deadline: float | None,
+        usage: CallUsage | None = None,
+    ) -> T:
+        request = self._request_once(
+            system_prompt=system_prompt, user_prompt=user_prompt, schema_model=schema_model, usage=usage
+        )
+        if deadline is None:
+            return await request
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            request.close()
+            raise TimeoutError(f"OpenAI request deadline exceeded (model={self.model})")
+        try:
+            return await asyncio.wait_for(request, timeout=remaining)
+        except TimeoutError as e:
+            raise TimeoutError(f"OpenAI request deadline exceeded (model={self.model})") from e
 
     async def suggest_reply(self, *, system_prompt: str, user_prompt: str) -> ReplySuggestion:
         return await self.request_json(
             system_prompt=system_prompt, user_prompt=user_prompt, schema_model=ReplySuggestion
         )
 
-    async def _request_once(
-        self, *, system_prompt: str, user_prompt: str, schema_model: type[T]
-    ) -> T:
-        assert self._client is not None
+    @property
+    def raw_client(self) -> AsyncOpenAI | None:
+        return self._client
+
+    @property
+    def usage_recorder(self) -> LLMUsageRecorder | None:
+        return self._usage_recorder
+
+    def completion_request_body(
+        self, *, system_prompt: str, user_prompt: str, schema_model: type[BaseModel] | None = None
+    ) -> dict[str, Any]:
+        """
+        Chat completions request body (model, messages, response format, sampling and token
+        params), as sent by `request_json`. Also used for Batch API request lines (see
+        app/openai_batch.py).
+        """
+
         kwargs: dict[str, Any] = {
             "model": self.model,
             "messages": [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt},
             ],
-            "response_format": {"type": "json_object"},
+            "response_format": self._response_format(schema_model),
         }
 
         # Some newer model families restrict sampling params (e.g. GPT-5 only supports default temperature=1).
@@ -95,11 +220,54 @@ class OpenAIClient:
             token_param = "max_completion_tokens" if self.model.startswith("gpt-5") else "max_tokens"
             setattr(self, "_token_param", token_param)
 
-        max_out = _GPT5_MAX_OUTPUT_TOKENS if self.model.startswith("gpt-5") else _DEFAULT_MAX_OUTPUT_TOKENS
-        kwargs[token_param] = max_out
+        kwargs[token_param] = self._max_output_tokens()
+        return kwargs
+
+    def _response_format(self, schema_model: type[BaseModel] | None) -> dict[str, Any]:
+        if schema_model is None or not self._structured_outputs:
+            return {"type": "json_object"}
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": schema_model.__name__,
+                "strict": True,
+                "schema": strict_json_schema(schema_model),
+            },
+        }
+
+    def _max_output_tokens(self) -> int:
+        return _GPT5_MAX_OUTPUT_TOKENS if self.model.startswith("gpt-5") else _DEFAULT_MAX_OUTPUT_TOKENS
+
+    async def _create(self, kwargs: dict[str, Any]) -> Any:
+        """chat.completions.create, admitted by the shared rate limiter and feeding it the response headers."""
+
+        assert self._client is not None
+        if self._rate_limiter is None:
+            return await self._client.chat.completions.create(**kwargs)
+
+        estimated = count_tokens(
+            "".join(str(m.get("content", "")) for m in kwargs.get("messages", [])), model=self.model
+        ) + self._max_output_tokens()
+        await self._rate_limiter.acquire(self.model, estimated_tokens=estimated)
+        try:
+            raw = await self._client.chat.completions.with_raw_response.create(**kwargs)
+        except RateLimitError as e:
+            self._rate_limiter.on_rate_limited(self.model, e.response.headers)
+            raise
+        self._rate_limiter.update_from_headers(self.model, raw.headers)
+        return raw.parse()
+
+    async def _request_once(
+        self, *, system_prompt: str, user_prompt: str, schema_model: type[T], usage: CallUsage | None = None
+    ) -> T:
+        assert self._client is not None
+        kwargs = self.completion_request_body(
+            system_prompt=system_prompt, user_prompt=user_prompt, schema_model=schema_model
+        )
+        max_out = self._max_output_tokens()
 
         try:
-            resp = await self._client.chat.completions.create(**kwargs)
+            resp = await self._create(kwargs)
         except BadRequestError as e:
             msg = str(e)
             # Automatic fallback if the chosen token parameter is not supported.
@@ -108,21 +276,31 @@ class OpenAIClient:
                     setattr(self, "_token_param", "max_completion_tokens")
                     kwargs.pop("max_tokens", None)
                     kwargs["max_completion_tokens"] = max_out
-                    resp = await self._client.chat.completions.create(**kwargs)
+                    resp = await self._create(kwargs)
                 elif "max_completion_tokens' is not supported" in msg or "Use 'max_tokens' instead" in msg:
                     setattr(self, "_token_param", "max_tokens")
                     kwargs.pop("max_completion_tokens", None)
                     kwargs["max_tokens"] = max_out
-                    resp = await self._client.chat.completions.create(**kwargs)
+                    resp = await self._create(kwargs)
                 else:
                     raise
+            elif "response_format" in msg or "json_schema" in msg:
+                # Model without structured outputs (or a schema it rejects): plain JSON mode from now on.
+                logger.warning("Structured outputs rejected for model=%s; falling back to json_object", self.model)
+                self._structured_outputs = False
+                kwargs["response_format"] = {"type": "json_object"}
+                resp = await self._create(kwargs)
             elif "temperature" in msg and ("Only the default" in msg or "unsupported" in msg):
                 # Some models only support default temperature; omit it and retry once.
                 kwargs.pop("temperature", None)
-                resp = await self._client.chat.completions.create(**kwargs)
+                resp = await self._create(kwargs)
             else:
                 raise
 
+        if usage is not None:
+            # Billed even if the content below turns out empty or invalid.
+            usage.add(getattr(resp, "usage", None))
+
         choice0 = resp.choices[0]
         msg0 = choice0.message
         content = (msg0.content or "").strip()
@@ -133,7 +311,41 @@ class OpenAIClient:
                 raise ValueError(f"OpenAI refusal (finish_reason={finish_reason}): {refusal}")
             raise ValueError(f"Empty OpenAI response content (finish_reason={finish_reason})")
 
-        data: dict[str, Any] = json.loads(content)
-        return schema_model.model_validate(data)
+        return parse_json_content(content, schema_model)
+
+
+def parse_json_content(content: str, schema_model: type[T]) -> T:
+    data: dict[str, Any] = json.loads(content)
+    return schema_model.model_validate(data)
+
+
+# Validation keywords strict mode does not accept; they are still enforced by model_validate.
+_UNSUPPORTED_STRICT_KEYWORDS = ("default", "title", "minLength", "maxLength", "minItems", "maxItems")
+
+
+def strict_json_schema(schema_model: type[BaseModel]) -> dict[str, Any]:
+    """
+    JSON schema of `schema_model` in the shape strict structured outputs require: every object
+    closed (additionalProperties=false) with all properties required. Optional fields keep
+    their `null` alternative, so the model returns null instead of omitting them.
+    """
+
+    return _strictify(schema_model.model_json_schema())
+
+
+def _strictify(node: Any) -> Any:
+    if isinstance(node, list):
+        return [_strictify(x) for x in node]
+    if not isinstance(node, dict):
+        return node
+    out = {k: _strictify(v) for k, v in node.items() if k not in _UNSUPPORTED_STRICT_KEYWORDS}
+    # Property / definition names are not keywords: keep them even if they collide (e.g. "title").
+    for key in ("properties", "$defs"):
+        if isinstance(node.get(key), dict):
+            out[key] = {name: _strictify(sub) for name, sub in node[key].items()}
+    if out.get("type") == "object" and "properties" in out:
+        out["additionalProperties"] = False
+        out["required"] = list(out["properties"].keys())
+    return out
 
 
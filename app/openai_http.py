@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import logging
+
+import httpx
+from openai import DefaultAsyncHttpxClient
+
+logger = logging.getLogger(__name__)
+
+OPENAI_BASE_URL = "https://api.openai.com/v1"
+
+
+def build_openai_http_client(
+    *,
+    timeout_seconds: float,
+    max_connections: int = 20,
+    max_keepalive_connections: int = 10,
+    keepalive_expiry_seconds: float = 60.0,
+    http2: bool = False,
+    transport: httpx.AsyncBaseTransport | None = None,
+) -> httpx.AsyncClient:
+    """
+    One pooled HTTP client shared by every OpenAIClient (and the batch backend), so connections
+    and TLS sessions are reused across the summary and reply models.
+
+    HTTP/2 needs the optional `h2` package; without it the client falls back to HTTP/1.1.
+    `transport` replaces the network, e.g. with FakeLLM's in-process server.
+    """
+
+    if http2 and importlib.util.find_spec("h2") is None:
+        logger.warning("OPENAI_HTTP2 is enabled but the 'h2' package is not installed; using HTTP/1.1")
+        http2 = False
+
+    return DefaultAsyncHttpxClient(
+        timeout=httpx.Timeout(timeout_seconds, connect=min(10.0, timeout_seconds)),
+        limits=httpx.Limits(
+            max_connections=max(1, int(max_connections)),
+            max_keepalive_connections=max(0, int(max_keepalive_connections)),
+            keepalive_expiry=max(0.0, float(keepalive_expiry_seconds)),
+        ),
+        http2=http2,
+        transport=transport,
+    )
+
+
+async def warm_up_http_client(
+    client: httpx.AsyncClient, *, base_url: str = OPENAI_BASE_URL, connections: int = 2
+) -> None:
+    """
+    Opens `connections` pooled connections (TCP + TLS) to the API host ahead of the first real call.
+    The response itself is irrelevant (unauthenticated, so usually 401/404); failures are only logged.
+    """
+
+    async def _touch() -> None:
+        response = await client.head(base_url, timeout=10.0)
+        await response.aclose()
+
+    results = await asyncio.gather(*(_touch() for _ in range(max(1, connections))), return_exceptions=True)
+    errors = [r for r in results if isinstance(r, Exception)]
+    if errors:
+        logger.warning("OpenAI HTTP warm-up failed: %s", errors[0])
+    else:
+        logger.info("OpenAI HTTP pool warmed (%s connections)", len(results))
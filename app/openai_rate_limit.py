@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+import time
+from dataclasses import dataclass
+from typing import Mapping
+
+logger = logging.getLogger(__name__)
+
+_DURATION_PART_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNIT_SECONDS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset_duration(value: str | None) -> float | None:
+    """Parses OpenAI reset durations like "1s", "6m0s", "20ms" into seconds."""
+
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _DURATION_UNIT_SECONDS[unit] for n, unit in parts)
+
+
+def retry_after_seconds(headers: Mapping[str, str] | None) -> float | None:
+    """Seconds from `retry-after-ms` / `retry-after` (if present and numeric)."""
+
+    if not headers:
+        return None
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        raw = headers.get(name)
+        if raw is None:
+            continue
+        try:
+            return max(0.0, float(raw) * scale)
+        except ValueError:
+            continue
+    return None
+
+
+def _header_float(headers: Mapping[str, str], name: str) -> float | None:
+    raw = headers.get(name)
+    if raw is None:
+        return None
+    try:
+        return float(raw)
+    except ValueError:
+        return None
+
+
+@dataclass
+class _ModelBudget:
+    limit_requests: float | None = None
+    limit_tokens: float | None = None
+    remaining_requests: float | None = None
+    remaining_tokens: float | None = None
+    # time.monotonic() deadlines
+    requests_reset_at: float | None = None
+    tokens_reset_at: float | None = None
+    blocked_until: float = 0.0
+
+    calls: int = 0
+    waited_seconds: float = 0.0
+    rate_limited: int = 0
+
+
+class OpenAIRateLimiter:
+    """
+    Process-wide admission control for OpenAI calls, per model (requests and tokens per minute).
+
+    The budget comes from the `x-ratelimit-*` response headers: every response updates the
+    remaining requests/tokens and their reset times, and each admitted call is deducted locally
+    right away so concurrent callers see it before the next response arrives. When the budget
+    is exhausted, callers wait until the reported reset instead of provoking a 429. A 429's
+    `retry-after` blocks the model until then.
+    """
+
+    def __init__(self) -> None:
+        self._budgets: dict[str, _ModelBudget] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    def _budget(self, model: str) -> _ModelBudget:
+        if model not in self._budgets:
+            self._budgets[model] = _ModelBudget()
+            self._locks[model] = asyncio.Lock()
+        return self._budgets[model]
+
+    async def acquire(self, model: str, *, estimated_tokens: int) -> float:
+        """Waits until `model` has budget for one request of ~`estimated_tokens`; returns seconds waited."""
+
+        budget = self._budget(model)
+        start = time.monotonic()
+        async with self._locks[model]:
+            while True:
+                now = time.monotonic()
+                self._replenish(budget, now)
+                wait = max(0.0, budget.blocked_until - now)
+                if (
+                    budget.remaining_requests is not None
+                    and budget.remaining_requests < 1
+                    and budget.requests_reset_at is not None
+                ):
+                    wait = max(wait, budget.requests_reset_at - now)
+                needed = min(float(estimated_tokens), budget.limit_tokens or float(estimated_tokens))
+                if (
+                    budget.remaining_tokens is not None
+                    and budget.remaining_tokens < needed
+                    and budget.tokens_reset_at is not None
+                ):
+                    wait = max(wait, budget.tokens_reset_at - now)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            if budget.remaining_requests is not None:
+                budget.remaining_requests -= 1
+            if budget.remaining_tokens is not None:
+                budget.remaining_tokens -= estimated_tokens
+
+        waited = time.monotonic() - start
+        budget.calls += 1
+        budget.waited_seconds += waited
+        return waited
+
+    def update_from_headers(self, model: str, headers: Mapping[str, str]) -> None:
+        budget = self._budget(model)
+        now = time.monotonic()
+
+        limit_requests = _header_float(headers, "x-ratelimit-limit-requests")
+        limit_tokens = _header_float(headers, "x-ratelimit-limit-tokens")
+        remaining_requests = _header_float(headers, "x-ratelimit-remaining-requests")
+        remaining_tokens = _header_float(headers, "x-ratelimit-remaining-tokens")
+        reset_requests = parse_reset_duration(headers.get("x-ratelimit-reset-requests"))
+        reset_tokens = parse_reset_duration(headers.get("x-ratelimit-reset-tokens"))
+
+        if limit_requests is not None:
+            budget.limit_requests = limit_requests
+        if limit_tokens is not None:
+            budget.limit_tokens = limit_tokens
+        # Responses can arrive out of order; the server's view is authoritative, but local deductions
+        # for calls still in flight must not be undone, so keep the lower of the two.
+        if remaining_requests is not None:
+            budget.remaining_requests = (
+                remaining_requests if budget.remaining_requests is None else min(budget.remaining_requests, remaining_requests)
+            )
+            if reset_requests is not None:
+                budget.requests_reset_at = now + reset_requests
+        if remaining_tokens is not None:
+            budget.remaining_tokens = (
+                remaining_tokens if budget.remaining_tokens is None else min(budget.remaining_tokens, remaining_tokens)
+            )
+            if reset_tokens is not None:
+                budget.tokens_reset_at = now + reset_tokens
+
+    def on_rate_limited(self, model: str, headers: Mapping[str, str] | None) -> float:
+        """Records a 429; blocks the model for `retry-after` (or 1s). Returns the block duration."""
+
+        budget = self._budget(model)
+        budget.rate_limited += 1
+        if headers:
+            self.update_from_headers(model, headers)
+        delay = retry_after_seconds(headers)
+        if delay is None:
+            delay = 1.0
+        budget.blocked_until = max(budget.blocked_until, time.monotonic() + delay)
+        logger.warning("OpenAI rate limited (model=%s); holding new calls for %.1fs", model, delay)
+        return delay
+
+    def stats(self) -> dict[str, dict[str, float | None]]:
+        now = time.monotonic()
+        out: dict[str, dict[str, float | None]] = {}
+        for model, b in self._budgets.items():
+            out[model] = {
+                "limit_requests": b.limit_requests,
+                "limit_tokens": b.limit_tokens,
+                "remaining_requests": b.remaining_requests,
+                "remaining_tokens": b.remaining_tokens,
+                "calls": b.calls,
+                "avg_wait_seconds": (b.waited_seconds / b.calls) if b.calls else 0.0,
+                "rate_limited": b.rate_limited,
+                "blocked_for_seconds": max(0.0, b.blocked_until - now),
+            }
+        return out
+
+    @staticmethod
+    def _replenish(budget: _ModelBudget, now: float) -> None:
+        # Past the reported reset the window has refilled (until the next response says otherwise).
+        if budget.requests_reset_at is not None and now >= budget.requests_reset_at:
+            budget.remaining_requests = budget.limit_requests
+            budget.requests_reset_at = None
+        if budget.tokens_reset_at is not None and now >= budget.tokens_reset_at:
+            budget.remaining_tokens = budget.limit_tokens
+            budget.tokens_reset_at = None
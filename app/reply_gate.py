@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import math
+import re
+from dataclasses import dataclass
+from typing import Iterable
+
+from app.models import SourceMessage
+
+QUESTION_RE = re.compile(r"[?？¿]")
+# Questions without a question mark ("how was it", "как дела").
+_QUESTION_WORD_RE = re.compile(
+    r"^\s*(what|why|how|when|where|who|which|can|could|would|will|do|does|did|are|is|should|"
+    r"что|чем|почему|зачем|как|когда|где|куда|кто|какой|какая|какие|можешь|можно)\b",
+    re.IGNORECASE | re.UNICODE,
+)
+_WORD_CHAR_RE = re.compile(r"\w", re.UNICODE)
+# Whole-message acknowledgements that rarely need an answer.
+_ACKS = {
+    "ok", "okay", "k", "kk", "lol", "lmao", "haha", "hah", "hehe", "xd", "nice", "cool", "thanks", "thx",
+    "ty", "yes", "yep", "yeah", "sure", "np", "good", "great", "got it", "noted", "same",
+    "ок", "окей", "ага", "угу", "да", "ясно", "понял", "поняла", "спасибо", "спс", "хорошо", "класс", "ахах", "хах",
+}
+
+# Hand-tuned logistic weights over the features below (bias first).
+_BIAS = -0.5
+_W_QUESTION = 2.5
+_W_MENTION = 2.5
+_W_LENGTH = 0.8
+_W_EXTRA_MESSAGES = 0.3
+_W_ACK_ONLY = -2.5
+# Word characters at which the length feature reaches 1.0 (it is capped at 1.5).
+_LENGTH_SCALE = 80
+
+
+@dataclass(frozen=True)
+class ReplyGateDecision:
+    score: float
+    needs_reply: bool
+    reasons: list[str]
+
+
+def _is_ack(text: str) -> bool:
+    normalized = re.sub(r"[\s!.,)(]+", " ", text.lower()).strip()
+    return not _WORD_CHAR_RE.search(normalized) or normalized in _ACKS or len(normalized) < 2
+
+
+def _mentions(text: str, names: Iterable[str]) -> bool:
+    lowered = text.lower()
+    return any(re.search(rf"(?<!\w)@?{re.escape(name)}(?!\w)", lowered) for name in names if name)
+
+
+def score_needs_reply(
+    messages: list[SourceMessage], *, my_names: Iterable[str] = (), threshold: float = 0.35
+) -> ReplyGateDecision:
+    """
+    Local estimate (0..1) of whether the unanswered incoming messages warrant a reply.
+
+    Looks at the incoming messages after my last one: a question (mark or question word) or a
+    mention of one of `my_names` raises the score, substance (word characters) and several
+    unanswered messages add to it, and a tail of acknowledgements / emoji only ("ok", "lol", "👍")
+    pulls it down. The features go through a fixed logistic model; `needs_reply` is
+    `score >= threshold`.
+    """
+
+    tail: list[SourceMessage] = []
+    for m in reversed(messages):
+        if m.from_me:
+            break
+        tail.append(m)
+    if not tail:
+        return ReplyGateDecision(score=0.0, needs_reply=False, reasons=["no incoming messages"])
+
+    texts = [m.text for m in tail]
+    names = [n.lower().lstrip("@") for n in my_names]
+    has_question = any(QUESTION_RE.search(t) or _QUESTION_WORD_RE.search(t) for t in texts)
+    mentions_me = any(_mentions(t, names) for t in texts)
+    ack_only = all(_is_ack(t) for t in texts)
+    chars = sum(len(_WORD_CHAR_RE.findall(t)) for t in texts)
+
+    z = (
+        _BIAS
+        + _W_QUESTION * has_question
+        + _W_MENTION * mentions_me
+        + _W_LENGTH * min(chars / _LENGTH_SCALE, 1.5)
+        + _W_EXTRA_MESSAGES * min(len(tail) - 1, 3)
+        + _W_ACK_ONLY * ack_only
+    )
+    score = 1.0 / (1.0 + math.exp(-z))
+
+    reasons = [f"{len(tail)} msgs", f"{chars} chars"]
+    if has_question:
+        reasons.append("question")
+    if mentions_me:
+        reasons.append("mentions me")
+    if ack_only:
+        reasons.append("ack only")
+    return ReplyGateDecision(score=score, needs_reply=score >= threshold, reasons=reasons)
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import json
+import random
+from dataclasses import dataclass
+
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    AuthenticationError,
+    BadRequestError,
+    NotFoundError,
+    PermissionDeniedError,
+    RateLimitError,
+    UnprocessableEntityError,
+)
+
+from app.openai_rate_limit import retry_after_seconds
+
+# Status codes worth another attempt: request timeout, conflict/lock, rate limit, server errors.
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+# Client errors that will fail the same way again.
+_NON_RETRYABLE = (AuthenticationError, PermissionDeniedError, NotFoundError, BadRequestError, UnprocessableEntityError)
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    Decides whether an OpenAI call is retried and how long to wait before the next attempt.
+
+    Backoff is exponential with jitter (`base_seconds * 2**attempt`, capped at `max_seconds`, then
+    scaled by a random factor in [1 - jitter, 1]); a server-sent Retry-After wins over it.
+    """
+
+    max_attempts: int = 3
+    base_seconds: float = 1.0
+    max_seconds: float = 8.0
+    jitter: float = 0.5
+
+    def is_retryable(self, error: BaseException) -> bool:
+        if isinstance(error, _NON_RETRYABLE):
+            return False
+        if isinstance(error, (RateLimitError, APITimeoutError, APIConnectionError, TimeoutError)):
+            return True
+        if isinstance(error, APIStatusError):
+            return error.status_code in _RETRYABLE_STATUS
+        # Empty / refused / malformed responses (json.JSONDecodeError and pydantic errors are ValueErrors).
+        return isinstance(error, (json.JSONDecodeError, ValueError))
+
+    def delay_seconds(self, attempt: int, error: BaseException) -> float:
+        """Wait before attempt `attempt + 1` (attempt is 0-based)."""
+
+        if isinstance(error, APIStatusError):
+            retry_after = retry_after_seconds(error.response.headers)
+            if retry_after is not None:
+                return retry_after
+        backoff = min(self.max_seconds, self.base_seconds * (2.0**attempt))
+        return backoff * (1.0 - self.jitter * random.random())
@@ -5,7 +5,14 @@ import logging
 from fastapi import APIRouter, Form, Request
 from fastapi.responses import RedirectResponse
 
-from app.services.chats_service import list_chats, set_selected_chats, sync_chats_from_telegram
+from app.services.chats_service import (
+    get_chat,
+    list_chats,
+    set_low_priority_chats,
+    set_selected_chats,
+    sync_chats_from_telegram,
+)
+from app.services.messages_service import MESSAGE_WINDOW_SIZE, get_message_window
 from app.web import templates
 
 logger = logging.getLogger(__name__)
@@ -31,6 +38,35 @@ async def chats_page(request: Request) -> object:
             "telegram_authorized": tg.is_authorized,
             "openai_configured": openai.enabled,
             "dialogs_limit": settings.telegram_dialogs_limit,
+            "batch_enabled": settings.openai_batch_backend != "off",
+            "prompts_loaded": prompt_store.list(),
+        },
+    )
+
+
+@router.get("/chats/{chat_id}/messages")
+async def chat_messages_page(request: Request, chat_id: int) -> object:
+    """Recent context from the local message store (no Telegram call)."""
+
+    conn = request.app.state.db
+    tg = request.app.state.tg
+    openai = request.app.state.openai
+    prompt_store = request.app.state.prompt_store
+
+    chat = await get_chat(conn, chat_id)
+    if chat is None:
+        return RedirectResponse(url="/chats", status_code=303)
+
+    messages = await get_message_window(conn, chat.id, limit=MESSAGE_WINDOW_SIZE)
+
+    return templates.TemplateResponse(
+        "chat_messages.html",
+        {
+            "request": request,
+            "chat": chat,
+            "messages": [m for m in messages if m.text],
+            "telegram_authorized": tg.is_authorized,
+            "openai_configured": openai.enabled,
             "prompts_loaded": prompt_store.list(),
         },
     )
@@ -54,9 +90,17 @@ async def chats_sync(request: Request) -> RedirectResponse:
 async def chats_save(
     request: Request,
     selected_chat_ids: list[int] = Form(default=[]),
+    low_priority_chat_ids: list[int] = Form(default=[]),
 ) -> RedirectResponse:
     conn = request.app.state.db
     await set_selected_chats(conn, selected_chat_ids)
+    # The low-priority checkboxes are only rendered when a batch backend is configured.
+    if request.app.state.settings.openai_batch_backend != "off":
+        await set_low_priority_chats(conn, low_priority_chat_ids)
+    try:
+        await request.app.state.scheduler.refresh_watched_chats()
+    except Exception:
+        logger.exception("Failed to refresh watched chats")
     return RedirectResponse(url="/chats", status_code=303)
 
 
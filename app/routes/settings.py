@@ -32,6 +32,10 @@ async def settings_page(request: Request) -> object:
             "prompts": prompts,
             "openai_reply_model": app_settings.openai_model,
             "openai_summary_model": app_settings.openai_summary_model,
+            "openai_cheap_model": app_settings.openai_cheap_model,
+            "telegram_rate_limits": tg.rate_limit_stats(),
+            "openai_rate_limits": request.app.state.openai_rate_limiter.stats(),
+            "llm_cache": (request.app.state.llm_cache.stats() if request.app.state.llm_cache else None),
             "telegram_authorized": tg.is_authorized,
             "openai_configured": openai.enabled,
             "prompts_loaded": prompt_store.list(),
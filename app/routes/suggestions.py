@@ -5,20 +5,24 @@ import json
 import logging
 import re
 
-from fastapi import APIRouter, Query, Request
+from fastapi import APIRouter, Form, Query, Request
 from fastapi.responses import RedirectResponse
 
 from app.models import SuggestionStatus
-from app.services.chats_service import update_chat_last_seen_message_id
-from app.services.suggestions_service import get_suggestion, list_suggestions, update_suggestion_status
+from app.reply_gate import QUESTION_RE
+from app.services.suggestions_service import (
+    choose_suggestion_candidate,
+    enqueue_suggestion_send,
+    get_suggestion,
+    list_suggestions,
+    update_suggestion_status,
+)
 from app.web import templates
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-_QUESTION_RE = re.compile(r"[?？¿]")
-
 
 def _parse_status(value: str | None) -> SuggestionStatus | None:
     if not value:
@@ -63,14 +67,36 @@ async def run_now(request: Request) -> RedirectResponse:
 @router.post("/suggestions/{suggestion_id}/decline")
 async def decline_suggestion(request: Request, suggestion_id: int) -> RedirectResponse:
     conn = request.app.state.db
+    row = await get_suggestion(conn, suggestion_id)
     await update_suggestion_status(conn, suggestion_id=suggestion_id, status=SuggestionStatus.declined)
+    if row is not None:
+        # The chat may have been skipped for max pending suggestions meanwhile.
+        request.app.state.scheduler.recheck_chat(int(row["chat_id"]))
+    return RedirectResponse(url="/", status_code=303)
+
+
+async def _enqueue_send(request: Request, suggestion_id: int, *, reply_to_message_id: int | None) -> RedirectResponse:
+    """
+    Queues the suggestion for the background sender and returns immediately; the sender marks
+    it sent/failed once Telegram accepts (or rejects) it.
+    """
+
+    conn = request.app.state.db
+    queued = await enqueue_suggestion_send(
+        conn, suggestion_id=suggestion_id, reply_to_message_id=reply_to_message_id
+    )
+    if queued:
+        request.app.state.sender.wake()
     return RedirectResponse(url="/", status_code=303)
 
 
 @router.post("/suggestions/{suggestion_id}/send")
-async def send_suggestion(request: Request, suggestion_id: int) -> RedirectResponse:
+async def send_suggestion(request: Request, suggestion_id: int, candidate: int = Form(default=0)) -> RedirectResponse:
     conn = request.app.state.db
-    tg = request.app.state.tg
+
+    # The candidate picked in the UI (0 = main text) becomes the text that is sent.
+    if candidate:
+        await choose_suggestion_candidate(conn, suggestion_id=suggestion_id, index=candidate)
 
     row = await get_suggestion(conn, suggestion_id)
     if row is None:
@@ -79,7 +105,6 @@ async def send_suggestion(request: Request, suggestion_id: int) -> RedirectRespo
     if row["status"] != SuggestionStatus.pending.value:
         return RedirectResponse(url="/", status_code=303)
 
-    chat_id = int(row["chat_id"])
     text = str(row["suggested_text"] or "").strip()
     if not text:
         await update_suggestion_status(
@@ -90,29 +115,17 @@ async def send_suggestion(request: Request, suggestion_id: int) -> RedirectRespo
         )
         return RedirectResponse(url="/?status=failed", status_code=303)
 
-    try:
-        msg = await tg.send_message(chat_id, text)
-        msg_id = int(getattr(msg, "id", 0) or 0)
-        if msg_id:
-            await update_chat_last_seen_message_id(conn, chat_id=chat_id, last_seen_message_id=msg_id)
-        await update_suggestion_status(conn, suggestion_id=suggestion_id, status=SuggestionStatus.sent)
-    except Exception as e:
-        logger.exception("Failed to send suggestion_id=%s chat_id=%s", suggestion_id, chat_id)
-        await update_suggestion_status(
-            conn,
-            suggestion_id=suggestion_id,
-            status=SuggestionStatus.failed,
-            error=str(e),
-        )
-        return RedirectResponse(url="/?status=failed", status_code=303)
-
-    return RedirectResponse(url="/?status=sent", status_code=303)
+    return await _enqueue_send(request, suggestion_id, reply_to_message_id=None)
 
 
 @router.post("/suggestions/{suggestion_id}/send-reply")
-async def send_suggestion_as_reply(request: Request, suggestion_id: int) -> RedirectResponse:
+async def send_suggestion_as_reply(
+    request: Request, suggestion_id: int, candidate: int = Form(default=0)
+) -> RedirectResponse:
     conn = request.app.state.db
-    tg = request.app.state.tg
+
+    if candidate:
+        await choose_suggestion_candidate(conn, suggestion_id=suggestion_id, index=candidate)
 
     row = await get_suggestion(conn, suggestion_id)
     if row is None:
@@ -120,7 +133,6 @@ async def send_suggestion_as_reply(request: Request, suggestion_id: int) -> Redi
     if row["status"] != SuggestionStatus.pending.value:
         return RedirectResponse(url="/", status_code=303)
 
-    chat_id = int(row["chat_id"])
     text = str(row["suggested_text"] or "").strip()
     if not text:
         await update_suggestion_status(
@@ -160,7 +172,7 @@ async def send_suggestion_as_reply(request: Request, suggestion_id: int) -> Redi
 
                     # Heuristic scoring: recency + question-ness + substance.
                     score = idx  # more recent messages have higher idx
-                    if _QUESTION_RE.search(text_m):
+                    if QUESTION_RE.search(text_m):
                         score += 50
                     if len(text_m) < 3:
                         score -= 25
@@ -177,29 +189,6 @@ async def send_suggestion_as_reply(request: Request, suggestion_id: int) -> Redi
 
     if reply_to_id is None:
         # Fallback: just send as normal message.
-        return await send_suggestion(request, suggestion_id)
-
-    try:
-        msg = await tg.send_message(chat_id, text, reply_to_message_id=reply_to_id)
-        msg_id = int(getattr(msg, "id", 0) or 0)
-        if msg_id:
-            await update_chat_last_seen_message_id(conn, chat_id=chat_id, last_seen_message_id=msg_id)
-        await update_suggestion_status(conn, suggestion_id=suggestion_id, status=SuggestionStatus.sent)
-    except Exception as e:
-        logger.exception(
-            "Failed to send suggestion_id=%s as reply chat_id=%s reply_to=%s",
-            suggestion_id,
-            chat_id,
-            reply_to_id,
-        )
-        await update_suggestion_status(
-            conn,
-            suggestion_id=suggestion_id,
-            status=SuggestionStatus.failed,
-            error=str(e),
-        )
-        return RedirectResponse(url="/?status=failed", status_code=303)
-
-    return RedirectResponse(url="/?status=sent", status_code=303)
-
+        return await send_suggestion(request, suggestion_id, candidate=0)
 
+    return await _enqueue_send(request, suggestion_id, reply_to_message_id=reply_to_id)
@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import logging
+
+from fastapi import APIRouter, Request
+
+from app.services.usage_service import usage_breakdown
+from app.web import templates
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+_WINDOWS_HOURS = (1, 24, 24 * 7, 24 * 30)
+
+
+@router.get("/usage")
+async def usage_page(request: Request, hours: int = 24) -> object:
+    conn = request.app.state.db
+    tg = request.app.state.tg
+    openai = request.app.state.openai
+    prompt_store = request.app.state.prompt_store
+    app_settings = request.app.state.settings
+
+    recorder = request.app.state.llm_usage
+    # Include calls still waiting in the write buffer.
+    await recorder.flush()
+
+    prices = app_settings.llm_prices
+    return templates.TemplateResponse(
+        "usage.html",
+        {
+            "request": request,
+            "hours": hours,
+            "windows": _WINDOWS_HOURS,
+            "by_model": await usage_breakdown(conn, group_by="model", since_hours=hours, prices=prices),
+            "by_stage": await usage_breakdown(conn, group_by="stage", since_hours=hours, prices=prices),
+            "by_chat": await usage_breakdown(conn, group_by="chat", since_hours=hours, prices=prices),
+            "prices_configured": bool(prices),
+            "telegram_authorized": tg.is_authorized,
+            "openai_configured": openai.enabled,
+            "prompts_loaded": prompt_store.list(),
+        },
+    )
@@ -1,24 +1,66 @@
 from __future__ import annotations
 
 import asyncio
+import heapq
 import logging
+import math
+import random
+import time
+from typing import Iterable
 
 import aiosqlite
 
+from app.models import SettingsRecord
+from app.openai_batch import BatchBackend
 from app.openai_client import OpenAIClient
 from app.prompts import PromptStore
-from app.services.suggestions_service import generate_suggestions_cycle, get_settings
+from app.services.chats_service import get_selected_chats
+from app.services.suggestions_service import (
+    ChatGenerationState,
+    CycleOptions,
+    collect_finished_batches,
+    generate_suggestions_cycle,
+    get_chat_generation_states,
+    get_settings,
+)
 from app.telegram_client import TelegramClientManager
 
 logger = logging.getLogger(__name__)
 
+# Chats falling due within this window are processed together in one cycle.
+_DUE_BATCH_WINDOW_SECONDS = 1.0
+# Upper bound for a single sleep, so selection / settings changes are picked up reasonably soon.
+_MAX_IDLE_SECONDS = 300.0
+# Adaptive polling: most a chat's interval may grow per poll, so quiet chats back off gradually.
+_MAX_BACKOFF_STEP = 1.5
+# Floor for expected arrivals per base interval (keeps a zero rate off a division by zero).
+_MIN_EXPECTED_ARRIVALS = 1e-3
+
 
 class SuggestionScheduler:
     """
     Simple asyncio-based scheduler started from FastAPI lifespan.
 
+    Instead of sweeping every chat every N minutes, it keeps a heap of per-chat due times:
+    - each chat is due every N minutes (+/- jitter), so work trickles out across the interval
+    - a chat in cooldown is not due before its last suggestion + cooldown
+    - only chats that are due are processed
+
+    With adaptive polling the interval is per chat: chats with a high observed message rate are
+    polled more often (down to a floor), quiet chats back off by at most `_MAX_BACKOFF_STEP` per
+    poll (up to a ceiling).
+
     It re-reads Settings from SQLite each loop, so changing N minutes in the UI takes effect
     without restarting the server.
+
+    In push mode the scheduler does not poll: Telethon NewMessage events make a chat due after a
+    short debounce. All selected chats are due once at startup (and newly selected chats once
+    when the selection changes) to catch up on messages received meanwhile. A chat skipped for
+    cooldown is due again when the cooldown ends, and one skipped for max pending suggestions
+    when a pending suggestion is sent or declined (`recheck_chat`).
+
+    With a batch backend, submitted offline batches are polled by a separate task every
+    `batch_poll_seconds`, independent of chat due times.
     """
 
     def __init__(
@@ -29,44 +71,115 @@ class SuggestionScheduler:
         openai_summary: OpenAIClient,
         openai_reply: OpenAIClient,
         prompts: PromptStore,
+        options: CycleOptions | None = None,
+        push: bool = False,
+        push_debounce_seconds: float = 2.0,
+        jitter_ratio: float = 0.2,
+        adaptive: bool = False,
+        min_interval_seconds: float = 60.0,
+        max_interval_seconds: float = 7200.0,
+        batch: BatchBackend | None = None,
+        batch_poll_seconds: float = 60.0,
+        openai_cheap: OpenAIClient | None = None,
     ):
         self._conn = conn
         self._tg = tg
         self._openai_summary = openai_summary
         self._openai_reply = openai_reply
+        self._openai_cheap = openai_cheap
         self._prompts = prompts
+        self._options = options or CycleOptions()
+        self._batch = batch
+        self._batch_poll_seconds = max(5.0, float(batch_poll_seconds))
+        self._push = bool(push)
+        self._push_debounce_seconds = max(0.0, float(push_debounce_seconds))
+        self._jitter_ratio = min(0.9, max(0.0, float(jitter_ratio)))
+        self._adaptive = bool(adaptive)
+        self._min_interval_seconds = max(30.0, float(min_interval_seconds))
+        self._max_interval_seconds = max(self._min_interval_seconds, float(max_interval_seconds))
 
         self._task: asyncio.Task[None] | None = None
+        self._batch_task: asyncio.Task[None] | None = None
         self._stop = asyncio.Event()
         self._wakeup = asyncio.Event()
         self._lock = asyncio.Lock()
 
+        # Heap of (due_ts, chat_id). Entries are lazily invalidated: an entry is current only if
+        # it matches self._due_at[chat_id].
+        self._heap: list[tuple[float, int]] = []
+        self._due_at: dict[int, float] = {}
+        self._last_suggestion_at: dict[int, float] = {}
+        self._activity_rate: dict[int, float | None] = {}
+        # Adaptive polling: interval each chat was last rescheduled with.
+        self._interval: dict[int, float] = {}
+        self._selected: set[int] = set()
+        # Push mode: chats whose last run was skipped for max pending suggestions.
+        self._skipped_for_pending: set[int] = set()
+        self._cooldown_seconds = 0
+        self._needs_catch_up = True
+        self._respread = False
+
     async def start(self) -> None:
         if self._task is not None:
             return
         self._stop.clear()
-        self._wakeup.set()  # run quickly after startup
+        if self._push:
+            self._tg.watch_new_messages(self._on_new_message)
+            await self.refresh_watched_chats()
+        self._wakeup.set()
         self._task = asyncio.create_task(self._run_loop(), name="suggestion-scheduler")
-        logger.info("Scheduler started")
+        if self._batch is not None:
+            self._batch_task = asyncio.create_task(self._batch_loop(), name="offline-batch-collector")
+        logger.info("Scheduler started (mode=%s)", "push" if self._push else "poll")
 
     async def stop(self) -> None:
         if self._task is None:
             return
         self._stop.set()
         self._wakeup.set()
-        self._task.cancel()
-        try:
-            await self._task
-        except asyncio.CancelledError:
-            pass
-        finally:
-            self._task = None
+        for task in (self._task, self._batch_task):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self._batch_task = None
         logger.info("Scheduler stopped")
 
     def wake(self) -> None:
+        """
+        Called after settings / prompts changes: re-spreads due times over the (possibly new)
+        interval so changes take effect soon, without making every chat due at once.
+        """
+
+        self._respread = True
         self._wakeup.set()
 
-    async def run_once(self) -> None:
+    def recheck_chat(self, chat_id: int) -> None:
+        """
+        Called when a chat's pending suggestion is sent or declined. In push mode a chat skipped
+        for max pending suggestions gets another look soon, since messages may have arrived
+        meanwhile; polling picks such chats up on its own.
+        """
+
+        if not self._push or int(chat_id) not in self._skipped_for_pending:
+            return
+        self._skipped_for_pending.discard(int(chat_id))
+        self._on_new_message(chat_id)
+
+    async def refresh_watched_chats(self) -> None:
+        """Called after the chat selection changes; newly selected chats get a catch-up run."""
+
+        self._wakeup.set()
+        if not self._push:
+            return
+        chats = await get_selected_chats(self._conn)
+        self._tg.set_watched_chats(c.id for c in chats)
+
+    async def run_once(self, chat_ids: Iterable[int] | None = None) -> None:
         async with self._lock:
             await generate_suggestions_cycle(
                 self._conn,
@@ -74,27 +187,214 @@ class SuggestionScheduler:
                 openai_summary=self._openai_summary,
                 openai_reply=self._openai_reply,
                 prompts=self._prompts,
+                options=self._options,
+                chat_ids=chat_ids,
+                batch=self._batch,
+                openai_cheap=self._openai_cheap,
             )
 
+    def _on_new_message(self, chat_id: int) -> None:
+        chat_id = int(chat_id)
+        due = max(time.time() + self._push_debounce_seconds, self._cooldown_until(chat_id))
+        current = self._due_at.get(chat_id)
+        # Keep an earlier due time: a burst of messages coalesces into one generation.
+        if current is None or current > due:
+            self._schedule(chat_id, due)
+        self._wakeup.set()
+
     async def _run_loop(self) -> None:
         while not self._stop.is_set():
             try:
-                await self._maybe_wait()
-                if self._stop.is_set():
-                    break
-                await self.run_once()
+                self._wakeup.clear()
+                settings = await get_settings(self._conn)
+                await self._sync_schedule(settings)
+
+                due_chat_ids = self._pop_due(time.time() + _DUE_BATCH_WINDOW_SECONDS)
+                if due_chat_ids:
+                    await self.run_once(chat_ids=due_chat_ids)
+                    await self._reschedule(due_chat_ids, settings)
+                    continue
+
+                await self._sleep_until_next_due()
             except asyncio.CancelledError:
                 break
             except Exception:
                 logger.exception("Scheduler loop error")
+                # Avoid a hot loop if e.g. the DB is temporarily unavailable.
+                await asyncio.sleep(5)
+
+    async def _batch_loop(self) -> None:
+        assert self._batch is not None
+        while not self._stop.is_set():
+            try:
+                await collect_finished_batches(
+                    self._conn,
+                    batch=self._batch,
+                    usage=self._openai_reply.usage_recorder,
+                    max_alternatives=self._options.reply_alternatives,
+                )
+            except asyncio.CancelledError:
+                break
+            except Exception:
+                logger.exception("Failed to collect offline batches")
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=self._batch_poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _sync_schedule(self, settings: SettingsRecord) -> None:
+        states = await get_chat_generation_states(self._conn)
+        self._refresh_chat_states(states)
+        selected = {st.chat.id for st in states}
+        self._cooldown_seconds = int(settings.cooldown_minutes or 0) * 60
+
+        for chat_id in set(self._due_at) - selected:
+            del self._due_at[chat_id]
+        for chat_id in set(self._interval) - selected:
+            del self._interval[chat_id]
+        self._skipped_for_pending &= selected
+
+        now = time.time()
+        catch_up = self._needs_catch_up
+        respread = self._respread
+        self._needs_catch_up = False
+        self._respread = False
+
+        newly_selected = selected - self._selected
+        self._selected = selected
+
+        for chat_id in selected:
+            if self._push:
+                # A settings change may have raised the max pending limit for skipped chats.
+                if catch_up or chat_id in newly_selected or (respread and chat_id in self._skipped_for_pending):
+                    self._schedule(chat_id, max(now, self._cooldown_until(chat_id)))
+                continue
+            if chat_id not in self._due_at or respread:
+                # Newly selected chats (or chats whose cycle failed before being rescheduled):
+                # spread first runs over the interval instead of bursting all chats at once.
+                interval = self._chat_interval_seconds(chat_id, settings)
+                due = max(now + random.uniform(0.0, interval), self._cooldown_until(chat_id))
+                current = self._due_at.get(chat_id)
+                if current is None or due < current:
+                    self._schedule(chat_id, due)
+
+        if self._push:
+            self._tg.set_watched_chats(selected)
+
+    async def _reschedule(self, chat_ids: Iterable[int], settings: SettingsRecord) -> None:
+        # Pick up the suggestion times and activity rates written by the cycle that just ran.
+        states = await get_chat_generation_states(self._conn)
+        self._refresh_chat_states(states)
+        now = time.time()
+        if self._push:
+            # Push mode never polls: the next NewMessage event (or `recheck_chat`) makes the chat due
+            # again. Only a chat still in cooldown gets another look once the cooldown ends, since
+            # it may have been skipped for it. Chats left at max pending are remembered for
+            # `recheck_chat`.
+            at_max_pending = {st.chat.id for st in states if st.pending_count >= settings.max_suggestions_per_chat}
+            for chat_id in chat_ids:
+                if chat_id in at_max_pending:
+                    self._skipped_for_pending.add(chat_id)
+                else:
+                    self._skipped_for_pending.discard(chat_id)
+                until = self._cooldown_until(chat_id)
+                if until > now and chat_id not in self._due_at:
+                    self._schedule(chat_id, until)
+            return
+
+        for chat_id in chat_ids:
+            interval = self._chat_interval_seconds(chat_id, settings)
+            self._interval[chat_id] = interval
+            due = max(now + self._jittered(interval), self._cooldown_until(chat_id))
+            self._schedule(chat_id, due)
 
-    async def _maybe_wait(self) -> None:
-        settings = await get_settings(self._conn)
-        seconds = max(30, int(settings.n_minutes) * 60)
-        self._wakeup.clear()
+    def _refresh_chat_states(self, states: Iterable[ChatGenerationState]) -> None:
+        self._last_suggestion_at = {}
+        self._activity_rate = {}
+        for st in states:
+            if st.latest_suggestion_at is not None:
+                self._last_suggestion_at[st.chat.id] = st.latest_suggestion_at.timestamp()
+            self._activity_rate[st.chat.id] = st.chat.activity_rate
+
+    def _cooldown_until(self, chat_id: int) -> float:
+        last = self._last_suggestion_at.get(chat_id)
+        if not self._cooldown_seconds or last is None:
+            return 0.0
+        return last + self._cooldown_seconds
+
+    def _schedule(self, chat_id: int, due: float) -> None:
+        self._due_at[chat_id] = due
+        heapq.heappush(self._heap, (due, chat_id))
+
+    def _pop_due(self, until: float) -> list[int]:
+        out: list[int] = []
+        while self._heap and self._heap[0][0] <= until:
+            due, chat_id = heapq.heappop(self._heap)
+            if self._due_at.get(chat_id) != due:
+                continue  # stale entry
+            del self._due_at[chat_id]
+            out.append(chat_id)
+        return out
+
+    def _next_due(self) -> float | None:
+        while self._heap:
+            due, chat_id = self._heap[0]
+            if self._due_at.get(chat_id) == due:
+                return due
+            heapq.heappop(self._heap)
+        return None
+
+    async def _sleep_until_next_due(self) -> None:
+        next_due = self._next_due()
+        timeout = _MAX_IDLE_SECONDS if next_due is None else next_due - time.time()
+        timeout = min(_MAX_IDLE_SECONDS, max(0.0, timeout))
         try:
-            await asyncio.wait_for(self._wakeup.wait(), timeout=seconds)
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
         except asyncio.TimeoutError:
             return
 
+    @staticmethod
+    def _interval_seconds(settings: SettingsRecord) -> float:
+        return float(max(30, int(settings.n_minutes) * 60))
+
+    def _chat_interval_seconds(self, chat_id: int, settings: SettingsRecord) -> float:
+        base = self._interval_seconds(settings)
+        if not self._adaptive:
+            return base
+        return _adaptive_interval_seconds(
+            self._activity_rate.get(chat_id),
+            base_seconds=base,
+            min_seconds=self._min_interval_seconds,
+            max_seconds=self._max_interval_seconds,
+            previous_seconds=self._interval.get(chat_id),
+        )
+
+    def _jittered(self, seconds: float) -> float:
+        return seconds * (1.0 + random.uniform(-self._jitter_ratio, self._jitter_ratio))
+
+
+def _adaptive_interval_seconds(
+    rate_per_hour: float | None,
+    *,
+    base_seconds: float,
+    min_seconds: float,
+    max_seconds: float,
+    previous_seconds: float | None = None,
+) -> float:
+    """
+    Scales the base interval by the chat's activity: a chat expecting one message per base
+    interval keeps the base interval; 4x busier -> half the interval, 4x quieter -> double it
+    (square root damping avoids flapping between extremes). Unknown activity keeps the base.
+
+    Shrinking takes effect at once; growing is capped at `_MAX_BACKOFF_STEP` x `previous_seconds`
+    (or the base), so a chat that just went quiet backs off over several polls.
+    """
 
+    if rate_per_hour is None:
+        target = base_seconds
+    else:
+        expected = max(_MIN_EXPECTED_ARRIVALS, float(rate_per_hour) * base_seconds / 3600.0)
+        target = base_seconds / math.sqrt(expected)
+    step_from = previous_seconds if previous_seconds is not None else base_seconds
+    target = min(target, step_from * _MAX_BACKOFF_STEP)
+    return min(max_seconds, max(min_seconds, target))
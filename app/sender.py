@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+import aiosqlite
+from telethon.errors import FloodWaitError, ServerError, TimedOutError
+
+from app.models import SuggestionStatus
+from app.services.chats_service import update_chat_last_seen_message_id
+from app.services.suggestions_service import (
+    next_outbound_retry_at,
+    next_outbound_suggestion,
+    schedule_send_retry,
+    update_suggestion_status,
+)
+from app.telegram_client import TelegramClientManager
+
+logger = logging.getLogger(__name__)
+
+# Upper bound for a single idle sleep; wake() cuts it short when something is enqueued.
+_MAX_IDLE_SECONDS = 60.0
+
+_TRANSIENT_ERRORS = (FloodWaitError, ServerError, TimedOutError, ConnectionError, OSError, asyncio.TimeoutError)
+
+
+class OutboundSender:
+    """
+    Background task that drains the outbound queue (suggestions with status `sending`).
+
+    The queue lives in SQLite, so queued sends survive restarts. Sends go out one at a time and
+    are paced by the Telegram rate limiter's `send` bucket. Transient errors (FloodWait, network,
+    Telegram server errors) are retried with backoff; anything else marks the suggestion failed.
+
+    `on_settled(chat_id)` is called once a suggestion ends up sent or failed, i.e. stops counting
+    as pending for its chat.
+    """
+
+    def __init__(
+        self,
+        *,
+        conn: aiosqlite.Connection,
+        tg: TelegramClientManager,
+        max_attempts: int = 5,
+        retry_base_seconds: float = 5.0,
+        on_settled: Callable[[int], None] | None = None,
+    ):
+        self._conn = conn
+        self._tg = tg
+        self._on_settled = on_settled
+        self._max_attempts = max(1, int(max_attempts))
+        self._retry_base_seconds = max(0.0, float(retry_base_seconds))
+
+        self._task: asyncio.Task[None] | None = None
+        self._stop = asyncio.Event()
+        self._wakeup = asyncio.Event()
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._stop.clear()
+        self._wakeup.set()  # resume anything left queued before a restart
+        self._task = asyncio.create_task(self._run_loop(), name="outbound-sender")
+        logger.info("Outbound sender started")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stop.set()
+        self._wakeup.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._task = None
+        logger.info("Outbound sender stopped")
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    async def _run_loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self._wakeup.clear()
+                if self._tg.is_authorized:
+                    row = await next_outbound_suggestion(self._conn)
+                    if row is not None:
+                        await self._send(row)
+                        continue
+                    await self._sleep_until_next_retry()
+                else:
+                    # Nothing can be sent until login; due retries must not turn this into a busy loop.
+                    await self._sleep(_MAX_IDLE_SECONDS)
+            except asyncio.CancelledError:
+                break
+            except Exception:
+                logger.exception("Outbound sender loop error")
+                await asyncio.sleep(5)
+
+    async def _send(self, row: dict) -> None:
+        suggestion_id = int(row["id"])
+        chat_id = int(row["chat_id"])
+        text = str(row["suggested_text"] or "").strip()
+        reply_to = row.get("send_reply_to_message_id")
+        attempts = int(row.get("send_attempts") or 0) + 1
+
+        if not text:
+            await self._settle(
+                suggestion_id, chat_id, SuggestionStatus.failed, error="Empty suggested_text; nothing to send."
+            )
+            return
+
+        try:
+            msg = await self._tg.send_message(chat_id, text, reply_to_message_id=reply_to)
+        except _TRANSIENT_ERRORS as e:
+            if attempts >= self._max_attempts:
+                logger.exception("Send failed permanently suggestion_id=%s chat_id=%s", suggestion_id, chat_id)
+                await self._settle(suggestion_id, chat_id, SuggestionStatus.failed, error=str(e))
+                return
+            delay = self._retry_delay(attempts, e)
+            logger.warning(
+                "Send failed suggestion_id=%s chat_id=%s (attempt %s/%s): %s. Retrying in %.0fs",
+                suggestion_id,
+                chat_id,
+                attempts,
+                self._max_attempts,
+                type(e).__name__,
+                delay,
+            )
+            await schedule_send_retry(
+                self._conn,
+                suggestion_id=suggestion_id,
+                attempts=attempts,
+                send_after=datetime.now(timezone.utc) + timedelta(seconds=delay),
+                error=str(e),
+            )
+            return
+        except Exception as e:
+            logger.exception(
+                "Failed to send suggestion_id=%s chat_id=%s reply_to=%s", suggestion_id, chat_id, reply_to
+            )
+            await self._settle(suggestion_id, chat_id, SuggestionStatus.failed, error=str(e))
+            return
+
+        msg_id = int(getattr(msg, "id", 0) or 0)
+        if msg_id:
+            await update_chat_last_seen_message_id(self._conn, chat_id=chat_id, last_seen_message_id=msg_id)
+        await self._settle(suggestion_id, chat_id, SuggestionStatus.sent)
+
+    async def _settle(
+        self, suggestion_id: int, chat_id: int, status: SuggestionStatus, *, error: str | None = None
+    ) -> None:
+        await update_suggestion_status(self._conn, suggestion_id=suggestion_id, status=status, error=error)
+        if self._on_settled is not None:
+            self._on_settled(chat_id)
+
+    def _retry_delay(self, attempts: int, error: Exception) -> float:
+        if isinstance(error, FloodWaitError):
+            return float(error.seconds)
+        return min(300.0, self._retry_base_seconds * (2.0 ** (attempts - 1)))
+
+    async def _sleep_until_next_retry(self) -> None:
+        timeout = _MAX_IDLE_SECONDS
+        retry_at = await next_outbound_retry_at(self._conn)
+        if retry_at is not None:
+            if retry_at.tzinfo is None:
+                retry_at = retry_at.replace(tzinfo=timezone.utc)
+            timeout = min(timeout, max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds()))
+        await self._sleep(timeout)
+
+    async def _sleep(self, timeout: float) -> None:
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return
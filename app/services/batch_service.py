@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import json
+import logging
+from dataclasses import asdict, dataclass
+
+import aiosqlite
+
+from app.db import fetch_all, transaction, utcnow_iso
+from app.tokens import ContextBudgetStats
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class BatchItem:
+    """One chat's request in a submitted batch, with what is needed to store its suggestion."""
+
+    custom_id: str
+    chat_id: int
+    messages_json: str
+    latest_id: int
+    covers_message_id: int
+    incoming_ids: list[int]
+    context_stats: ContextBudgetStats | None = None
+
+
+@dataclass(frozen=True)
+class OpenBatch:
+    id: int
+    backend: str
+    remote_id: str
+    model: str
+    items: list[BatchItem]
+
+
+async def create_batch(
+    conn: aiosqlite.Connection,
+    *,
+    backend: str,
+    remote_id: str,
+    model: str,
+    items: list[BatchItem],
+) -> int:
+    now = utcnow_iso()
+    async with transaction(conn):
+        cur = await conn.execute(
+            """
+            INSERT INTO llm_batches (backend, remote_id, model, status, created_at, updated_at)
+            VALUES (?, ?, ?, 'submitted', ?, ?);
+            """,
+            (backend, remote_id, model, now, now),
+        )
+        batch_id = int(cur.lastrowid)
+        await conn.executemany(
+            """
+            INSERT INTO llm_batch_items (
+                batch_id, custom_id, chat_id, messages_json, latest_id, covers_message_id, incoming_ids,
+                context_stats_json, status
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'submitted');
+            """,
+            [
+                (
+                    batch_id,
+                    it.custom_id,
+                    it.chat_id,
+                    it.messages_json,
+                    it.latest_id,
+                    it.covers_message_id,
+                    ",".join(str(x) for x in it.incoming_ids),
+                    (json.dumps(asdict(it.context_stats)) if it.context_stats else None),
+                )
+                for it in items
+            ],
+        )
+    return batch_id
+
+
+async def list_open_batches(conn: aiosqlite.Connection, *, backend: str) -> list[OpenBatch]:
+    rows = await fetch_all(
+        conn,
+        """
+        SELECT b.id AS batch_id, b.backend, b.remote_id, b.model, i.custom_id, i.chat_id, i.messages_json,
+               i.latest_id, i.covers_message_id, i.incoming_ids, i.context_stats_json
+        FROM llm_batches b
+        JOIN llm_batch_items i ON i.batch_id = b.id
+        WHERE b.status = 'submitted' AND b.backend = ?
+        ORDER BY b.id ASC;
+        """,
+        (backend,),
+    )
+    batches: dict[int, OpenBatch] = {}
+    for r in rows:
+        batch_id = int(r["batch_id"])
+        if batch_id not in batches:
+            batches[batch_id] = OpenBatch(
+                id=batch_id,
+                backend=str(r["backend"]),
+                remote_id=str(r["remote_id"]),
+                model=str(r["model"]),
+                items=[],
+            )
+        batches[batch_id].items.append(
+            BatchItem(
+                custom_id=str(r["custom_id"]),
+                chat_id=int(r["chat_id"]),
+                messages_json=str(r["messages_json"]),
+                latest_id=int(r["latest_id"]),
+                covers_message_id=int(r["covers_message_id"]),
+                incoming_ids=[int(x) for x in str(r["incoming_ids"] or "").split(",") if x],
+                context_stats=(
+                    ContextBudgetStats(**json.loads(r["context_stats_json"])) if r["context_stats_json"] else None
+                ),
+            )
+        )
+    return list(batches.values())
+
+
+async def finish_batch(conn: aiosqlite.Connection, *, batch_id: int, status: str, error: str | None = None) -> None:
+    now = utcnow_iso()
+    async with transaction(conn):
+        await conn.execute(
+            "UPDATE llm_batches SET status = ?, error = ?, updated_at = ? WHERE id = ?;",
+            (status, error, now, int(batch_id)),
+        )
+        await conn.execute("UPDATE llm_batch_items SET status = ? WHERE batch_id = ?;", (status, int(batch_id)))
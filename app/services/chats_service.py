@@ -1,17 +1,24 @@
 from __future__ import annotations
 
 import logging
-from datetime import datetime
-from typing import Iterable
+from datetime import datetime, timezone
+from typing import Any, Iterable
 
 import aiosqlite
 
-from app.db import fetch_all, utcnow_iso
+from app.db import fetch_all, fetch_one, transaction, utcnow_iso
 from app.models import ChatRecord
+from app.services.peers_service import save_input_peers
 from app.telegram_client import DialogInfo, TelegramClientManager
 
 logger = logging.getLogger(__name__)
 
+# Weight of the newest observation in the per-chat message rate EWMA.
+_ACTIVITY_EWMA_ALPHA = 0.3
+# Shortest span the first observation's messages are spread over, so one or two fresh messages
+# do not read as a burst.
+_ACTIVITY_SEED_MIN_HOURS = 0.25
+
 
 def _parse_dt(value: str | None) -> datetime | None:
     if not value:
@@ -19,68 +26,81 @@ def _parse_dt(value: str | None) -> datetime | None:
     return datetime.fromisoformat(value)
 
 
+# Column list matching `chat_record_from_row`.
+CHAT_COLUMNS = (
+    "id, title, language_hint, is_selected, last_seen_message_id, "
+    "activity_rate, activity_checked_at, is_low_priority, created_at, updated_at"
+)
+
+
+def chat_record_from_row(r: Any) -> ChatRecord:
+    return ChatRecord(
+        id=int(r["id"]),
+        title=str(r["title"]),
+        language_hint=r["language_hint"],
+        is_selected=bool(r["is_selected"]),
+        last_seen_message_id=r["last_seen_message_id"],
+        activity_rate=r["activity_rate"],
+        activity_checked_at=_parse_dt(r["activity_checked_at"]),
+        is_low_priority=bool(r["is_low_priority"]),
+        created_at=_parse_dt(r["created_at"]),
+        updated_at=_parse_dt(r["updated_at"]),
+    )
+
+
 async def list_chats(conn: aiosqlite.Connection) -> list[ChatRecord]:
     rows = await fetch_all(
         conn,
-        """
-        SELECT id, title, language_hint, is_selected, last_seen_message_id, created_at, updated_at
+        f"""
+        SELECT {CHAT_COLUMNS}
         FROM chats
         ORDER BY lower(title) ASC;
         """
     )
-    out: list[ChatRecord] = []
-    for r in rows:
-        out.append(
-            ChatRecord(
-                id=int(r["id"]),
-                title=str(r["title"]),
-                language_hint=r["language_hint"],
-                is_selected=bool(r["is_selected"]),
-                last_seen_message_id=r["last_seen_message_id"],
-                created_at=_parse_dt(r["created_at"]),
-                updated_at=_parse_dt(r["updated_at"]),
-            )
-        )
-    return out
+    return [chat_record_from_row(r) for r in rows]
 
 
 async def get_selected_chats(conn: aiosqlite.Connection) -> list[ChatRecord]:
     rows = await fetch_all(
         conn,
-        """
-        SELECT id, title, language_hint, is_selected, last_seen_message_id, created_at, updated_at
+        f"""
+        SELECT {CHAT_COLUMNS}
         FROM chats
         WHERE is_selected = 1
         ORDER BY lower(title) ASC;
         """
     )
-    out: list[ChatRecord] = []
-    for r in rows:
-        out.append(
-            ChatRecord(
-                id=int(r["id"]),
-                title=str(r["title"]),
-                language_hint=r["language_hint"],
-                is_selected=True,
-                last_seen_message_id=r["last_seen_message_id"],
-                created_at=_parse_dt(r["created_at"]),
-                updated_at=_parse_dt(r["updated_at"]),
-            )
-        )
-    return out
+    return [chat_record_from_row(r) for r in rows]
+
+
+async def get_chat(conn: aiosqlite.Connection, chat_id: int) -> ChatRecord | None:
+    row = await fetch_one(conn, f"SELECT {CHAT_COLUMNS} FROM chats WHERE id = ?;", (int(chat_id),))
+    return chat_record_from_row(row) if row is not None else None
 
 
 async def set_selected_chats(conn: aiosqlite.Connection, selected_chat_ids: Iterable[int]) -> None:
     selected = {int(x) for x in selected_chat_ids}
     now = utcnow_iso()
 
-    await conn.execute("UPDATE chats SET is_selected = 0, updated_at = ?;", (now,))
-    if selected:
-        await conn.executemany(
-            "UPDATE chats SET is_selected = 1, updated_at = ? WHERE id = ?;",
-            [(now, chat_id) for chat_id in selected],
-        )
-    await conn.commit()
+    async with transaction(conn):
+        await conn.execute("UPDATE chats SET is_selected = 0, updated_at = ?;", (now,))
+        if selected:
+            await conn.executemany(
+                "UPDATE chats SET is_selected = 1, updated_at = ? WHERE id = ?;",
+                [(now, chat_id) for chat_id in selected],
+            )
+
+
+async def set_low_priority_chats(conn: aiosqlite.Connection, chat_ids: Iterable[int]) -> None:
+    low_priority = {int(x) for x in chat_ids}
+    now = utcnow_iso()
+    async with transaction(conn):
+        await conn.execute("UPDATE chats SET is_low_priority = 0, updated_at = ? WHERE is_low_priority = 1;", (now,))
+        if low_priority:
+            await conn.executemany(
+                "UPDATE chats SET is_low_priority = 1, updated_at = ? WHERE id = ?;",
+                [(now, chat_id) for chat_id in low_priority],
+            )
 
 
 async def sync_chats_from_telegram(
@@ -98,17 +118,20 @@ async def sync_chats_from_telegram(
     now = utcnow_iso()
     params = [(d.id, d.title, now, now) for d in dialogs]
 
-    await conn.executemany(
-        """
-        INSERT INTO chats (id, title, is_selected, created_at, updated_at)
-        VALUES (?, ?, 0, ?, ?)
-        ON CONFLICT(id) DO UPDATE SET
-            title = excluded.title,
-            updated_at = excluded.updated_at;
-        """,
-        params,
-    )
-    await conn.commit()
+    async with transaction(conn):
+        await conn.executemany(
+            """
+            INSERT INTO chats (id, title, is_selected, created_at, updated_at)
+            VALUES (?, ?, 0, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                title = excluded.title,
+                updated_at = excluded.updated_at;
+            """,
+            params,
+        )
+
+    # Warm the persistent peer cache so later fetches/sends skip entity resolution.
+    await save_input_peers(conn, {d.id: d.input_peer for d in dialogs if d.input_peer is not None})
 
     logger.info("Synced %s chats from Telegram", len(dialogs))
     return len(dialogs)
@@ -117,11 +140,90 @@ async def sync_chats_from_telegram(
 async def update_chat_last_seen_message_id(
     conn: aiosqlite.Connection, *, chat_id: int, last_seen_message_id: int
 ) -> None:
+    """Moves the chat's read marker forward; an older id (e.g. a late batch result) leaves it as is."""
+
     now = utcnow_iso()
-    await conn.execute(
-        "UPDATE chats SET last_seen_message_id = ?, updated_at = ? WHERE id = ?;",
-        (int(last_seen_message_id), now, int(chat_id)),
-    )
-    await conn.commit()
+    async with transaction(conn):
+        await conn.execute(
+            "UPDATE chats SET last_seen_message_id = MAX(COALESCE(last_seen_message_id, 0), ?), updated_at = ? "
+            "WHERE id = ?;",
+            (int(last_seen_message_id), now, int(chat_id)),
+        )
 
 
+async def record_chat_activity(
+    conn: aiosqlite.Connection,
+    chat: ChatRecord,
+    *,
+    message_dates: Iterable[datetime],
+    observed_at: datetime,
+) -> float | None:
+    """
+    Folds one poll's observation into the chat's incoming-message rate (messages/hour, EWMA).
+
+    `message_dates` are the dates of incoming messages fetched by this poll; only those newer
+    than the previous observation count as arrivals. The first observation seeds the rate from
+    the fetched messages themselves. Returns the updated rate (None while nothing is known).
+    """
+
+    rate = _next_activity_rate(chat, message_dates, observed_at)
+    async with transaction(conn):
+        await conn.execute(
+            "UPDATE chats SET activity_rate = ?, activity_checked_at = ? WHERE id = ?;",
+            (rate, observed_at.replace(microsecond=0).isoformat(), int(chat.id)),
+        )
+    return rate
+
+
+async def record_idle_chats(
+    conn: aiosqlite.Connection, chats: Iterable[ChatRecord], *, observed_at: datetime
+) -> None:
+    """
+    Records a poll with no arrivals for many chats known to be unchanged (dialog pre-pass).
+
+    A known rate decays by one EWMA step and an unknown one stays unknown (instead of becoming
+    0), so a chat that is quiet for one interval is not treated as dead.
+    """
+
+    observed_iso = observed_at.replace(microsecond=0).isoformat()
+    params = [(_decayed_activity_rate(c), observed_iso, int(c.id)) for c in chats]
+    if not params:
+        return
+    async with transaction(conn):
+        await conn.executemany(
+            "UPDATE chats SET activity_rate = ?, activity_checked_at = ? WHERE id = ?;",
+            params,
+        )
+
+
+def _next_activity_rate(chat: ChatRecord, message_dates: Iterable[datetime], observed_at: datetime) -> float | None:
+    rate = chat.activity_rate
+    previous = chat.activity_checked_at
+    if previous is None:
+        return _seed_activity_rate(message_dates, observed_at) if rate is None else rate
+    if previous.tzinfo is None:
+        previous = previous.replace(tzinfo=timezone.utc)
+    elapsed_hours = (observed_at - previous).total_seconds() / 3600.0
+    if elapsed_hours <= 0:
+        return rate
+    arrivals = sum(1 for d in message_dates if d > previous)
+    observed_rate = arrivals / elapsed_hours
+    if rate is None:
+        return observed_rate
+    return _ACTIVITY_EWMA_ALPHA * observed_rate + (1.0 - _ACTIVITY_EWMA_ALPHA) * rate
+
+
+def _decayed_activity_rate(chat: ChatRecord) -> float | None:
+    if chat.activity_rate is None:
+        return None
+    return (1.0 - _ACTIVITY_EWMA_ALPHA) * chat.activity_rate
+
+
+def _seed_activity_rate(message_dates: Iterable[datetime], observed_at: datetime) -> float | None:
+    """Messages/hour over the span of the first poll's messages (their oldest date -> now)."""
+
+    dates = list(message_dates)
+    if not dates:
+        return None
+    span_hours = (observed_at - min(dates)).total_seconds() / 3600.0
+    return len(dates) / max(_ACTIVITY_SEED_MIN_HOURS, span_hours)
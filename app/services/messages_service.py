@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import logging
+from datetime import datetime, timezone
+from typing import Any, Iterable
+
+import aiosqlite
+
+from app.db import fetch_all, fetch_one, transaction
+from app.models import SourceMessage
+
+logger = logging.getLogger(__name__)
+
+# Rolling window kept per chat in the local `messages` table (K is capped at 100 in Settings).
+MESSAGE_WINDOW_SIZE = 100
+
+
+def message_date(message: Any) -> datetime:
+    dt = getattr(message, "date", None)
+    if isinstance(dt, datetime):
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt
+    return datetime.now(timezone.utc)
+
+
+def message_from_me(message: Any) -> bool:
+    return bool(getattr(message, "out", False))
+
+
+def source_message_from_telegram(message: Any) -> SourceMessage:
+    """
+    Converts a Telethon Message. Media/service messages are kept with empty text so the local
+    store still knows their ids (high-water mark); context building skips them.
+    """
+
+    from_me = message_from_me(message)
+    return SourceMessage(
+        id=int(getattr(message, "id", 0) or 0),
+        date_iso=message_date(message).replace(microsecond=0).isoformat(),
+        from_me=from_me,
+        sender_name=("me" if from_me else "other"),
+        # Telethon stores text in .message
+        text=str(getattr(message, "message", "") or "").strip(),
+    )
+
+
+async def get_high_water_mark(conn: aiosqlite.Connection, chat_id: int) -> int | None:
+    """Highest stored message id for a chat (None if nothing is stored yet)."""
+
+    row = await fetch_one(conn, "SELECT MAX(id) AS max_id FROM messages WHERE chat_id = ?;", (int(chat_id),))
+    if row is None or row["max_id"] is None:
+        return None
+    return int(row["max_id"])
+
+
+async def store_messages(
+    conn: aiosqlite.Connection,
+    chat_id: int,
+    messages: Iterable[SourceMessage],
+    *,
+    keep_last: int = MESSAGE_WINDOW_SIZE,
+) -> None:
+    """
+    Upserts messages into the chat's rolling window and trims it to the newest `keep_last`.
+
+    Note: edits/deletions of already-stored messages are not tracked.
+    """
+
+    params = [
+        (int(chat_id), m.id, m.date_iso, 1 if m.from_me else 0, m.sender_name, m.text)
+        for m in messages
+        if m.id > 0
+    ]
+    if not params:
+        return
+    async with transaction(conn):
+        await conn.executemany(
+            """
+            INSERT INTO messages (chat_id, id, date_iso, from_me, sender_name, text)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(chat_id, id) DO UPDATE SET
+                date_iso = excluded.date_iso,
+                from_me = excluded.from_me,
+                sender_name = excluded.sender_name,
+                text = excluded.text;
+            """,
+            params,
+        )
+        await conn.execute(
+            """
+            DELETE FROM messages
+            WHERE chat_id = ?
+              AND id NOT IN (
+                  SELECT id FROM messages WHERE chat_id = ? ORDER BY id DESC LIMIT ?
+              );
+            """,
+            (int(chat_id), int(chat_id), int(keep_last)),
+        )
+
+
+async def get_message_window(conn: aiosqlite.Connection, chat_id: int, *, limit: int) -> list[SourceMessage]:
+    """Returns the newest `limit` stored messages of a chat, ordered oldest -> newest."""
+
+    rows = await fetch_all(
+        conn,
+        """
+        SELECT id, date_iso, from_me, sender_name, text
+        FROM messages
+        WHERE chat_id = ?
+        ORDER BY id DESC
+        LIMIT ?;
+        """,
+        (int(chat_id), int(limit)),
+    )
+    out = [
+        SourceMessage(
+            id=int(r["id"]),
+            date_iso=str(r["date_iso"]),
+            from_me=bool(r["from_me"]),
+            sender_name=r["sender_name"],
+            text=str(r["text"] or ""),
+        )
+        for r in rows
+    ]
+    out.reverse()
+    return out
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import logging
+from typing import Any, Iterable, Mapping
+
+import aiosqlite
+from telethon.tl.types import InputPeerChannel, InputPeerChat, InputPeerSelf, InputPeerUser
+
+from app.db import fetch_all, transaction, utcnow_iso
+
+logger = logging.getLogger(__name__)
+
+
+def _serialize(peer: Any) -> tuple[str, int, int | None] | None:
+    if isinstance(peer, InputPeerUser):
+        return ("user", int(peer.user_id), int(peer.access_hash))
+    if isinstance(peer, InputPeerChannel):
+        return ("channel", int(peer.channel_id), int(peer.access_hash))
+    if isinstance(peer, InputPeerChat):
+        return ("chat", int(peer.chat_id), None)
+    if isinstance(peer, InputPeerSelf):
+        return ("self", 0, None)
+    # Min peers (InputPeerUserFromMessage etc.) are not stable enough to persist.
+    return None
+
+
+def _deserialize(peer_type: str, peer_id: int, access_hash: int | None) -> Any | None:
+    if peer_type == "user" and access_hash is not None:
+        return InputPeerUser(user_id=peer_id, access_hash=access_hash)
+    if peer_type == "channel" and access_hash is not None:
+        return InputPeerChannel(channel_id=peer_id, access_hash=access_hash)
+    if peer_type == "chat":
+        return InputPeerChat(chat_id=peer_id)
+    if peer_type == "self":
+        return InputPeerSelf()
+    return None
+
+
+async def load_input_peers(conn: aiosqlite.Connection) -> dict[int, Any]:
+    rows = await fetch_all(conn, "SELECT chat_id, peer_type, peer_id, access_hash FROM peer_cache;")
+    out: dict[int, Any] = {}
+    for r in rows:
+        peer = _deserialize(
+            str(r["peer_type"]),
+            int(r["peer_id"]),
+            (int(r["access_hash"]) if r["access_hash"] is not None else None),
+        )
+        if peer is not None:
+            out[int(r["chat_id"])] = peer
+    return out
+
+
+async def save_input_peers(conn: aiosqlite.Connection, peers: Mapping[int, Any]) -> int:
+    """
+    Upserts resolved input peers (with access hashes) keyed by chat id.
+    Returns the number of peers persisted.
+    """
+
+    now = utcnow_iso()
+    params = []
+    for chat_id, peer in peers.items():
+        serialized = _serialize(peer)
+        if serialized is None:
+            continue
+        params.append((int(chat_id), *serialized, now))
+    if not params:
+        return 0
+
+    async with transaction(conn):
+        await conn.executemany(
+            """
+            INSERT INTO peer_cache (chat_id, peer_type, peer_id, access_hash, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET
+                peer_type = excluded.peer_type,
+                peer_id = excluded.peer_id,
+                access_hash = excluded.access_hash,
+                updated_at = excluded.updated_at;
+            """,
+            params,
+        )
+    logger.debug("Persisted %s input peers", len(params))
+    return len(params)
+
+
+async def delete_input_peers(conn: aiosqlite.Connection, chat_ids: Iterable[int]) -> None:
+    """Forgets persisted peers that turned out stale (they are re-resolved on next use)."""
+
+    params = [(int(x),) for x in chat_ids]
+    if not params:
+        return
+    async with transaction(conn):
+        await conn.executemany("DELETE FROM peer_cache WHERE chat_id = ?;", params)
+    logger.debug("Deleted %s stale input peers", len(params))
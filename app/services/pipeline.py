@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Iterable, Sequence
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    One pipeline stage.
+
+    `handler` receives an item from the previous stage and returns the item to forward to the
+    next one, or None to drop it (e.g. nothing to do for this chat).
+    """
+
+    name: str
+    handler: Callable[[Any], Awaitable[Any | None]]
+    workers: int = 1
+    # Bounded input queue; 0 means "2x workers" (enough to keep workers busy, small enough for backpressure).
+    queue_size: int = 0
+
+
+ErrorHandler = Callable[[str, Any, Exception], Awaitable[None]]
+
+
+async def run_pipeline(items: Iterable[Any], stages: Sequence[Stage], *, on_error: ErrorHandler) -> None:
+    """
+    Runs `items` through `stages`, each stage with its own worker pool, connected by bounded
+    asyncio queues. Stage N+1 starts working on an item as soon as stage N hands it over, so
+    e.g. chat B's summary overlaps chat A's reply.
+
+    An exception in a handler is passed to `on_error` and only drops that item.
+    """
+
+    if not stages:
+        return
+
+    queues: list[asyncio.Queue[Any]] = [
+        asyncio.Queue(maxsize=(s.queue_size or 2 * max(1, s.workers))) for s in stages
+    ]
+
+    async def _worker(index: int, stage: Stage) -> None:
+        in_q = queues[index]
+        out_q = queues[index + 1] if index + 1 < len(stages) else None
+        while True:
+            item = await in_q.get()
+            if item is _DONE:
+                return
+            try:
+                result = await stage.handler(item)
+            except Exception as e:
+                try:
+                    await on_error(stage.name, item, e)
+                except Exception:
+                    logger.exception("Pipeline error handler failed (stage=%s)", stage.name)
+                continue
+            if result is not None and out_q is not None:
+                await out_q.put(result)
+
+    pools: list[list[asyncio.Task[None]]] = [
+        [
+            asyncio.create_task(_worker(i, stage), name=f"pipeline-{stage.name}-{w}")
+            for w in range(max(1, stage.workers))
+        ]
+        for i, stage in enumerate(stages)
+    ]
+
+    try:
+        for item in items:
+            await queues[0].put(item)
+        # Drain stage by stage: once every worker of a stage exits, nothing more can reach the next one.
+        for i, pool in enumerate(pools):
+            for _ in pool:
+                await queues[i].put(_DONE)
+            await asyncio.gather(*pool)
+    finally:
+        for pool in pools:
+            for task in pool:
+                if not task.done():
+                    task.cancel()
@@ -2,20 +2,62 @@ from __future__ import annotations
 
 import json
 import logging
+import time
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta, timezone
-from typing import Any, Iterable
+from typing import Any, Iterable, TypeVar
 
 import aiosqlite
-
-from app.db import fetch_all, fetch_one, utcnow_iso
-from app.models import ChatContextSummary, ReplySuggestion, SettingsRecord, SourceMessage, SuggestionStatus, SuggestionView
-from app.openai_client import OpenAIClient
+from pydantic import BaseModel
+
+from app.db import fetch_all, fetch_one, transaction, utcnow_iso
+from app.llm_usage import CallUsage, LLMCallRecord, LLMUsageRecorder
+from app.model_cascade import CascadeOptions, request_with_cascade, use_cheap_first
+from app.models import (
+    CascadeReplySuggestion,
+    CascadeSummaryAndReply,
+    ChatContextSummary,
+    ChatRecord,
+    ReplyCandidate,
+    ReplySuggestion,
+    SettingsRecord,
+    SourceMessage,
+    SuggestionStatus,
+    SuggestionView,
+    SummaryAndReply,
+)
+from app.openai_batch import BatchBackend, BatchResult
+from app.openai_client import OpenAIClient, parse_json_content
 from app.prompts import PromptStore
-from app.services.chats_service import get_selected_chats, update_chat_last_seen_message_id
+from app.reply_gate import score_needs_reply
+from app.services.batch_service import BatchItem, create_batch, finish_batch, list_open_batches
+from app.services.chats_service import (
+    chat_record_from_row,
+    record_chat_activity,
+    record_idle_chats,
+    update_chat_last_seen_message_id,
+)
+from app.services.messages_service import (
+    get_high_water_mark,
+    get_message_window,
+    message_date,
+    message_from_me,
+    source_message_from_telegram,
+    store_messages,
+)
+from app.services.peers_service import delete_input_peers, save_input_peers
+from app.services.pipeline import Stage, run_pipeline
+from app.services.summaries_service import StoredChatSummary, get_chat_summary, save_chat_summary
 from app.telegram_client import TelegramClientManager
+from app.tokens import ContextBudgetStats, fit_messages_to_budget
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T", bound=BaseModel)
+
+# After this many incremental summary updates in a row, the next summary is rebuilt from the full window.
+_MAX_INCREMENTAL_SUMMARY_UPDATES = 10
+
 
 def _parse_dt(value: str | None) -> datetime | None:
     if not value:
@@ -45,25 +87,25 @@ async def get_settings(conn: aiosqlite.Connection) -> SettingsRecord:
 
 async def save_settings(conn: aiosqlite.Connection, settings: SettingsRecord) -> None:
     now = utcnow_iso()
-    await conn.execute(
-        """
-        UPDATE settings
-        SET k_messages = ?,
-            n_minutes = ?,
-            max_suggestions_per_chat = ?,
-            cooldown_minutes = ?,
-            updated_at = ?
-        WHERE id = 1;
-        """,
-        (
-            settings.k_messages,
-            settings.n_minutes,
-            settings.max_suggestions_per_chat,
-            int(settings.cooldown_minutes or 0),
-            now,
-        ),
-    )
-    await conn.commit()
+    async with transaction(conn):
+        await conn.execute(
+            """
+            UPDATE settings
+            SET k_messages = ?,
+                n_minutes = ?,
+                max_suggestions_per_chat = ?,
+                cooldown_minutes = ?,
+                updated_at = ?
+            WHERE id = 1;
+            """,
+            (
+                settings.k_messages,
+                settings.n_minutes,
+                settings.max_suggestions_per_chat,
+                int(settings.cooldown_minutes or 0),
+                now,
+            ),
+        )
 
 
 async def list_suggestions(
@@ -91,16 +133,20 @@ async def list_suggestions(
             s.suggested_text,
             s.ru_translation,
             s.status,
-            s.error
+            s.error,
+            s.context_tokens_raw,
+            s.context_tokens,
+            s.alternates_json
         FROM suggestions s
         JOIN chats c ON c.id = s.chat_id
         {where}
         ORDER BY
             CASE s.status
                 WHEN 'pending' THEN 0
-                WHEN 'failed' THEN 1
-                WHEN 'sent' THEN 2
-                WHEN 'declined' THEN 3
+                WHEN 'sending' THEN 1
+                WHEN 'failed' THEN 2
+                WHEN 'sent' THEN 3
+                WHEN 'declined' THEN 4
                 ELSE 9
             END,
             s.created_at DESC
@@ -121,16 +167,49 @@ async def list_suggestions(
                 ru_translation=str(r["ru_translation"] or ""),
                 status=SuggestionStatus(str(r["status"])),
                 error=r["error"],
+                context_tokens_raw=r["context_tokens_raw"],
+                context_tokens=r["context_tokens"],
+                alternatives=_parse_alternatives(r["alternates_json"]),
             )
         )
     return out
 
 
+def _parse_alternatives(value: str | None) -> list[ReplyCandidate]:
+    if not value:
+        return []
+    try:
+        return [ReplyCandidate.model_validate(x) for x in json.loads(value)]
+    except ValueError:
+        return []
+
+
+def _alternatives_json(
+    alternatives: list[ReplyCandidate] | None, *, primary: str, limit: int | None = None
+) -> str | None:
+    """Non-empty alternatives that differ from the main text (and each other), as stored JSON."""
+
+    seen = {primary.strip()}
+    kept: list[ReplyCandidate] = []
+    for alt in alternatives or []:
+        text = alt.suggested_text.strip()
+        if not text or text in seen:
+            continue
+        seen.add(text)
+        kept.append(alt)
+    if limit is not None:
+        kept = kept[: max(0, limit)]
+    if not kept:
+        return None
+    return json.dumps([a.model_dump() for a in kept], ensure_ascii=False)
+
+
 async def get_suggestion(conn: aiosqlite.Connection, suggestion_id: int) -> dict[str, Any] | None:
     row = await fetch_one(
         conn,
         """
-        SELECT id, chat_id, created_at, source_messages_json, suggested_text, ru_translation, reply_to_message_id, status, error, updated_at
+        SELECT id, chat_id, created_at, source_messages_json, suggested_text, ru_translation, reply_to_message_id, status, error,
+               alternates_json, updated_at
         FROM suggestions
         WHERE id = ?;
         """,
@@ -141,6 +220,43 @@ async def get_suggestion(conn: aiosqlite.Connection, suggestion_id: int) -> dict
     return dict(row)
 
 
+async def choose_suggestion_candidate(conn: aiosqlite.Connection, *, suggestion_id: int, index: int) -> bool:
+    """
+    Makes alternative `index` (1-based; 0 is the current main text) the suggestion's main text, so the
+    regular send path sends it. The previous main text takes its place among the alternatives.
+    Only pending suggestions change; returns whether anything changed.
+    """
+
+    row = await get_suggestion(conn, suggestion_id)
+    if row is None or row["status"] != SuggestionStatus.pending.value or index <= 0:
+        return False
+    alternatives = _parse_alternatives(row.get("alternates_json"))
+    if index > len(alternatives):
+        return False
+
+    chosen = alternatives[index - 1]
+    alternatives[index - 1] = ReplyCandidate(
+        suggested_text=str(row["suggested_text"] or ""), ru_translation=str(row["ru_translation"] or "")
+    )
+    async with transaction(conn):
+        await conn.execute(
+            """
+            UPDATE suggestions
+            SET suggested_text = ?, ru_translation = ?, alternates_json = ?, updated_at = ?
+            WHERE id = ? AND status = ?;
+            """,
+            (
+                chosen.suggested_text,
+                chosen.ru_translation,
+                json.dumps([a.model_dump() for a in alternatives], ensure_ascii=False),
+                utcnow_iso(),
+                int(suggestion_id),
+                SuggestionStatus.pending.value,
+            ),
+        )
+    return True
+
+
 async def update_suggestion_status(
     conn: aiosqlite.Connection,
     *,
@@ -149,11 +265,84 @@ async def update_suggestion_status(
     error: str | None = None,
 ) -> None:
     now = utcnow_iso()
-    await conn.execute(
-        "UPDATE suggestions SET status = ?, error = ?, updated_at = ? WHERE id = ?;",
-        (status.value, error, now, int(suggestion_id)),
+    async with transaction(conn):
+        await conn.execute(
+            "UPDATE suggestions SET status = ?, error = ?, updated_at = ? WHERE id = ?;",
+            (status.value, error, now, int(suggestion_id)),
+        )
+
+
+async def enqueue_suggestion_send(
+    conn: aiosqlite.Connection,
+    *,
+    suggestion_id: int,
+    reply_to_message_id: int | None = None,
+) -> bool:
+    """
+    Moves a pending suggestion to the outbound queue (status `sending`).
+    Returns False if it was not pending (e.g. double click).
+    """
+
+    now = utcnow_iso()
+    async with transaction(conn):
+        cur = await conn.execute(
+            """
+            UPDATE suggestions
+            SET status = ?, send_reply_to_message_id = ?, send_attempts = 0, send_after = NULL,
+                error = NULL, updated_at = ?
+            WHERE id = ? AND status = ?;
+            """,
+            (
+                SuggestionStatus.sending.value,
+                (int(reply_to_message_id) if reply_to_message_id else None),
+                now,
+                int(suggestion_id),
+                SuggestionStatus.pending.value,
+            ),
+        )
+    return cur.rowcount > 0
+
+
+async def next_outbound_suggestion(conn: aiosqlite.Connection) -> dict[str, Any] | None:
+    """Oldest queued suggestion whose next attempt is due."""
+
+    row = await fetch_one(
+        conn,
+        """
+        SELECT id, chat_id, suggested_text, send_reply_to_message_id, send_attempts
+        FROM suggestions
+        WHERE status = ? AND (send_after IS NULL OR send_after <= ?)
+        ORDER BY updated_at ASC, id ASC
+        LIMIT 1;
+        """,
+        (SuggestionStatus.sending.value, utcnow_iso()),
     )
-    await conn.commit()
+    return dict(row) if row is not None else None
+
+
+async def next_outbound_retry_at(conn: aiosqlite.Connection) -> datetime | None:
+    row = await fetch_one(
+        conn,
+        "SELECT MIN(send_after) AS send_after FROM suggestions WHERE status = ? AND send_after IS NOT NULL;",
+        (SuggestionStatus.sending.value,),
+    )
+    return _parse_dt(row["send_after"] if row else None)
+
+
+async def schedule_send_retry(
+    conn: aiosqlite.Connection,
+    *,
+    suggestion_id: int,
+    attempts: int,
+    send_after: datetime,
+    error: str,
+) -> None:
+    now = utcnow_iso()
+    async with transaction(conn):
+        await conn.execute(
+            "UPDATE suggestions SET send_attempts = ?, send_after = ?, error = ?, updated_at = ? WHERE id = ?;",
+            (int(attempts), send_after.replace(microsecond=0).isoformat(), error, now, int(suggestion_id)),
+        )
 
 
 async def create_suggestion(
@@ -166,70 +355,156 @@ async def create_suggestion(
     reply_to_message_id: int | None = None,
     status: SuggestionStatus,
     error: str | None = None,
+    context_stats: ContextBudgetStats | None = None,
+    alternatives: list[ReplyCandidate] | None = None,
+    max_alternatives: int | None = None,
 ) -> int:
     now = utcnow_iso()
-    cur = await conn.execute(
-        """
-        INSERT INTO suggestions
-            (chat_id, created_at, source_messages_json, suggested_text, ru_translation, reply_to_message_id, status, error, updated_at)
-        VALUES
-            (?, ?, ?, ?, ?, ?, ?, ?, ?);
-        """,
-        (
-            int(chat_id),
-            now,
-            source_messages_json,
-            suggested_text,
-            ru_translation,
-            (int(reply_to_message_id) if reply_to_message_id else None),
-            status.value,
-            error,
-            now,
-        ),
-    )
-    await conn.commit()
+    async with transaction(conn):
+        cur = await conn.execute(
+            """
+            INSERT INTO suggestions
+                (chat_id, created_at, source_messages_json, suggested_text, ru_translation, reply_to_message_id, status, error,
+                 context_tokens_raw, context_tokens, alternates_json, updated_at)
+            VALUES
+                (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+            """,
+            (
+                int(chat_id),
+                now,
+                source_messages_json,
+                suggested_text,
+                ru_translation,
+                (int(reply_to_message_id) if reply_to_message_id else None),
+                status.value,
+                error,
+                (context_stats.tokens_before if context_stats else None),
+                (context_stats.tokens_after if context_stats else None),
+                _alternatives_json(alternatives, primary=suggested_text, limit=max_alternatives),
+                now,
+            ),
+        )
     return int(cur.lastrowid)
 
 
-async def _count_pending_suggestions(conn: aiosqlite.Connection, chat_id: int) -> int:
-    row = await fetch_one(
-        conn,
-        "SELECT COUNT(*) AS cnt FROM suggestions WHERE chat_id = ? AND status = 'pending';",
-        (int(chat_id),),
-    )
-    return int(row["cnt"] if row else 0)
+@dataclass(frozen=True)
+class ChatGenerationState:
+    """A selected chat plus the suggestion stats needed to decide whether it may get a new one."""
 
+    chat: ChatRecord
+    pending_count: int
+    latest_suggestion_at: datetime | None
+    # A request for this chat is waiting in a submitted offline batch.
+    in_open_batch: bool = False
 
-async def _latest_suggestion_created_at(conn: aiosqlite.Connection, chat_id: int) -> datetime | None:
-    row = await fetch_one(
+
+async def get_chat_generation_states(conn: aiosqlite.Connection) -> list[ChatGenerationState]:
+    """
+    One query for all selected chats with their pending suggestion count and latest suggestion
+    time (instead of two round-trips per chat).
+    """
+
+    rows = await fetch_all(
         conn,
-        "SELECT created_at FROM suggestions WHERE chat_id = ? ORDER BY created_at DESC LIMIT 1;",
-        (int(chat_id),),
+        """
+        SELECT
+            c.*,
+            COALESCE(SUM(CASE WHEN s.status IN ('pending', 'sending') THEN 1 ELSE 0 END), 0) AS pending_count,
+            MAX(s.created_at) AS latest_created_at,
+            EXISTS (
+                SELECT 1 FROM llm_batch_items bi WHERE bi.chat_id = c.id AND bi.status = 'submitted'
+            ) AS in_open_batch
+        FROM chats c
+        LEFT JOIN suggestions s ON s.chat_id = c.id
+        WHERE c.is_selected = 1
+        GROUP BY c.id
+        ORDER BY lower(c.title) ASC;
+        """
     )
-    return _parse_dt(row["created_at"] if row else None)
-
+    out: list[ChatGenerationState] = []
+    for r in rows:
+        latest = _parse_dt(r["latest_created_at"])
+        # created_at is stored as ISO; may be naive if edited manually.
+        if latest is not None and latest.tzinfo is None:
+            latest = latest.replace(tzinfo=timezone.utc)
+        out.append(
+            ChatGenerationState(
+                chat=chat_record_from_row(r),
+                pending_count=int(r["pending_count"] or 0),
+                latest_suggestion_at=latest,
+                in_open_batch=bool(r["in_open_batch"]),
+            )
+        )
+    return out
 
-def _message_date_iso(message: Any) -> str:
-    dt = getattr(message, "date", None)
-    if isinstance(dt, datetime):
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
-        return dt.replace(microsecond=0).isoformat()
-    return utcnow_iso()
 
+def _gate_chats(
+    states: Iterable[ChatGenerationState], settings: SettingsRecord, *, now: datetime
+) -> list[ChatRecord]:
+    """
+    Drops chats that may not get a new suggestion right now (too many pending, in cooldown, or
+    waiting for an offline batch), before any network work is done for them.
+    """
 
-def _message_text(message: Any) -> str:
-    # Telethon stores text in .message
-    text = getattr(message, "message", "") or ""
-    return str(text).strip()
+    cooldown = timedelta(minutes=int(settings.cooldown_minutes or 0))
+    out: list[ChatRecord] = []
+    for st in states:
+        if st.in_open_batch:
+            continue
+        if st.pending_count >= settings.max_suggestions_per_chat:
+            continue
+        if cooldown and st.latest_suggestion_at is not None and now - st.latest_suggestion_at < cooldown:
+            continue
+        out.append(st.chat)
+    return out
 
 
-def _message_id(message: Any) -> int:
-    return int(getattr(message, "id", 0) or 0)
+@dataclass(frozen=True)
+class CycleOptions:
+    """
+    Process-level tuning knobs for a suggestion cycle (from env, see app/config.py).
 
+    Each pipeline stage has its own worker pool so the Telegram fetch, the summary model and the
+    reply model can each be sized to their own latency / rate limits.
+    """
 
-def _message_from_me(message: Any) -> bool:
-    return bool(getattr(message, "out", False))
+    fetch_concurrency: int = 1
+    summary_workers: int = 1
+    reply_workers: int = 1
+    # "auto" | "two_stage" | "single"; see `_use_single_call`.
+    generation_mode: str = "two_stage"
+    single_call_max_messages: int = 30
+    single_call_max_chars: int = 4000
+    # Per-chat context budget (tokens of messages_json); 0 disables. Single messages are capped first.
+    context_token_budget: int = 0
+    context_max_message_tokens: int = 0
+    # Upper bound for the model calls of one chat per stage (summary, reply; incl. retries), counted
+    # from when a stage worker picks the chat up, so time queued for a worker is not charged; 0 = none.
+    chat_deadline_seconds: float = 0.0
+    # Local "needs reply" score (app/reply_gate.py) a chat must reach before any LLM call; 0 disables.
+    reply_gate_threshold: float = 0.0
+    # Which chats try the cheap model first (only with an `openai_cheap` client).
+    cascade: CascadeOptions = CascadeOptions()
+    # N-best: extra candidate replies requested in the same reply call; 0 disables.
+    reply_alternatives: int = 0
+
+
+@dataclass
+class _ChatJob:
+    """Per-chat state handed from one pipeline stage to the next."""
+
+    chat: ChatRecord
+    source: list[SourceMessage] = field(default_factory=list)
+    messages_json: str = "[]"
+    latest_id: int = 0
+    incoming_ids: list[int] = field(default_factory=list)
+    summary: ChatContextSummary | None = None
+    reply_to_id: int | None = None
+    # Summary and reply come from one combined call in the reply stage.
+    single_call: bool = False
+    context_stats: ContextBudgetStats | None = None
+    # time.monotonic() deadline for the current stage's model calls.
+    deadline: float | None = None
 
 
 async def generate_suggestions_cycle(
@@ -239,12 +514,28 @@ async def generate_suggestions_cycle(
     openai_summary: OpenAIClient,
     openai_reply: OpenAIClient,
     prompts: PromptStore,
+    options: CycleOptions | None = None,
+    chat_ids: Iterable[int] | None = None,
+    batch: BatchBackend | None = None,
+    openai_cheap: OpenAIClient | None = None,
 ) -> None:
     """
     Periodic job:
     - for each selected chat: fetch last K messages
     - generate a reply suggestion (+ RU translation)
     - store Suggestion rows as pending/failed
+
+    Work runs as a pipeline (fetch -> summary -> reply) connected by bounded queues, each stage
+    with its own worker count. A failure in one chat never affects the others.
+
+    If `chat_ids` is given, only those selected chats are processed (push-based ingestion).
+
+    With a `batch` backend, low-priority chats are not generated in real time: their requests are
+    submitted as one offline batch per cycle (collected by `collect_finished_batches`, which the
+    scheduler runs on its own interval).
+
+    With `openai_cheap`, replies for short contexts and low-priority chats are tried on that model
+    first and escalated to `openai_reply` only on low confidence (see app/model_cascade.py).
     """
 
     if not tg.is_authorized:
@@ -255,145 +546,700 @@ async def generate_suggestions_cycle(
         logger.debug("Skipping suggestion cycle: OpenAI not configured")
         return
 
+    options = options or CycleOptions()
     settings = await get_settings(conn)
-    chats = await get_selected_chats(conn)
-    if not chats:
+    states = await get_chat_generation_states(conn)
+    if chat_ids is not None:
+        wanted = {int(x) for x in chat_ids}
+        states = [st for st in states if st.chat.id in wanted]
+    if not states:
         logger.debug("Skipping suggestion cycle: no selected chats")
         return
 
+    chats = _gate_chats(states, settings, now=datetime.now(timezone.utc))
+    chats = await _skip_unchanged_chats(conn, chats, tg=tg)
+    if not chats:
+        logger.debug("Skipping suggestion cycle: no eligible chat with new messages (of %s)", len(states))
+        return
+
     system_prompt = prompts.get("system").content
 
     logger.info(
-        "Suggestion cycle start: selected_chats=%s k=%s max_pending=%s cooldown=%s min",
+        "Suggestion cycle start: selected_chats=%s eligible=%s k=%s max_pending=%s cooldown=%s min workers=%s/%s/%s mode=%s",
+        len(states),
         len(chats),
         settings.k_messages,
         settings.max_suggestions_per_chat,
         settings.cooldown_minutes,
+        options.fetch_concurrency,
+        options.summary_workers,
+        options.reply_workers,
+        options.generation_mode,
     )
 
-    for chat in chats:
+    async def _fetch_stage(job: _ChatJob) -> _ChatJob | None:
+        return await _prepare_chat_job(
+            conn, job, settings=settings, options=options, tg=tg, token_model=openai_summary.model
+        )
+
+    batch_jobs: list[_ChatJob] = []
+
+    async def _summary_stage(job: _ChatJob) -> _ChatJob | None:
+        if batch is not None and job.chat.is_low_priority:
+            batch_jobs.append(job)
+            return None
+        if _use_single_call(job, options):
+            job.single_call = True
+            return job
+        job.deadline = _stage_deadline(options)
+        return await _summarize_chat_job(
+            conn,
+            job,
+            openai_summary=openai_summary,
+            prompts=prompts,
+            system_prompt=system_prompt,
+        )
+
+    async def _reply_stage(job: _ChatJob) -> None:
+        # A fresh budget: the summary call's time and the wait in the reply queue do not count.
+        job.deadline = _stage_deadline(options)
+        if job.single_call:
+            await _summarize_and_reply_chat_job(
+                conn,
+                job,
+                openai_reply=openai_reply,
+                openai_cheap=openai_cheap,
+                options=options,
+                prompts=prompts,
+                system_prompt=system_prompt,
+            )
+            return
+        await _reply_chat_job(
+            conn,
+            job,
+            openai_reply=openai_reply,
+            openai_cheap=openai_cheap,
+            options=options,
+            prompts=prompts,
+            system_prompt=system_prompt,
+        )
+
+    async def _on_error(stage: str, job: _ChatJob, e: Exception) -> None:
+        chat = job.chat
+        logger.exception(
+            "Suggestion generation failed for chat_id=%s (%s) at stage=%s", chat.id, chat.title, stage, exc_info=e
+        )
+        # Try to persist a failed suggestion for visibility (but don't crash the whole cycle).
         try:
-            pending_count = await _count_pending_suggestions(conn, chat.id)
-            if pending_count >= settings.max_suggestions_per_chat:
-                continue
+            await create_suggestion(
+                conn,
+                chat_id=chat.id,
+                source_messages_json="[]",
+                suggested_text="",
+                ru_translation="",
+                status=SuggestionStatus.failed,
+                error=str(e),
+            )
+        except Exception:
+            logger.exception("Failed to persist failed suggestion record for chat_id=%s", chat.id)
+
+    await run_pipeline(
+        (_ChatJob(chat=chat) for chat in chats),
+        [
+            Stage("fetch", _fetch_stage, workers=options.fetch_concurrency),
+            Stage("summary", _summary_stage, workers=options.summary_workers),
+            Stage("reply", _reply_stage, workers=options.reply_workers),
+        ],
+        on_error=_on_error,
+    )
 
-            cooldown_min = int(settings.cooldown_minutes or 0)
-            if cooldown_min > 0:
-                last_created = await _latest_suggestion_created_at(conn, chat.id)
-                if last_created is not None:
-                    now = datetime.now(timezone.utc)
-                    # last_created is stored as ISO; may be naive if edited manually.
-                    if last_created.tzinfo is None:
-                        last_created = last_created.replace(tzinfo=timezone.utc)
-                    if now - last_created < timedelta(minutes=cooldown_min):
-                        continue
-
-            messages = await tg.fetch_last_messages(chat.id, limit=settings.k_messages)
-            if not messages:
-                continue
+    if batch is not None and batch_jobs:
+        try:
+            await _submit_batch(
+                conn,
+                batch_jobs,
+                batch=batch,
+                openai_reply=openai_reply,
+                prompts=prompts,
+                system_prompt=system_prompt,
+                options=options,
+            )
+        except Exception:
+            # Nothing was recorded, so these chats are simply picked up again next cycle.
+            logger.exception("Failed to submit offline batch (%s chats)", len(batch_jobs))
 
-            # Keep only text messages
-            source: list[SourceMessage] = []
-            for m in messages:
-                text = _message_text(m)
-                if not text:
-                    continue
-                source.append(
-                    SourceMessage(
-                        id=_message_id(m),
-                        date_iso=_message_date_iso(m),
-                        from_me=_message_from_me(m),
-                        sender_name=("me" if _message_from_me(m) else "other"),
-                        text=text,
-                    )
-                )
+    # Persist peers Telethon had to resolve during this cycle (dropping cached ones found stale first).
+    try:
+        await delete_input_peers(conn, tg.pop_stale_input_peers())
+        await save_input_peers(conn, tg.pop_new_input_peers())
+    except Exception:
+        logger.exception("Failed to persist input peers")
 
-            if not source:
-                continue
+    logger.info("Suggestion cycle done")
 
-            latest_id = max((m.id for m in source), default=0)
-            if chat.last_seen_message_id is not None and latest_id <= chat.last_seen_message_id:
-                continue
 
-            # If the most recent message is ours, usually no reply is needed.
-            if source and source[-1].from_me:
-                await update_chat_last_seen_message_id(conn, chat_id=chat.id, last_seen_message_id=latest_id)
+async def _skip_unchanged_chats(
+    conn: aiosqlite.Connection, chats: list[ChatRecord], *, tg: TelegramClientManager
+) -> list[ChatRecord]:
+    """
+    Pre-pass: one batched dialogs request tells which chats have a top message past
+    `last_seen_message_id`; the others are dropped before any per-chat message fetch.
+
+    Chats without a known `last_seen_message_id` or without a dialog state are kept.
+    """
+
+    candidates = [c for c in chats if c.last_seen_message_id is not None]
+    if not candidates:
+        return chats
+    try:
+        dialog_states = await tg.fetch_dialog_states(c.id for c in candidates)
+    except Exception:
+        logger.warning("Dialog pre-pass failed; fetching messages for all chats", exc_info=True)
+        return chats
+
+    changed: list[ChatRecord] = []
+    unchanged: list[ChatRecord] = []
+    for chat in chats:
+        state = dialog_states.get(chat.id)
+        if state is not None and chat.last_seen_message_id is not None:
+            if state.top_message_id <= chat.last_seen_message_id:
+                unchanged.append(chat)
                 continue
+        changed.append(chat)
 
-            messages_json = json.dumps([m.model_dump() for m in source], ensure_ascii=False)
+    if unchanged:
+        await record_idle_chats(conn, unchanged, observed_at=datetime.now(timezone.utc))
+    logger.debug("Dialog pre-pass: changed=%s unchanged=%s", len(changed), len(unchanged))
+    return changed
 
-            incoming_ids = [m.id for m in source if not m.from_me]
-            fallback_reply_to = incoming_ids[-1] if incoming_ids else None
-            incoming_id_set = set(incoming_ids)
 
-            # Step 1: summarize with GPT-4 class model
+async def _prepare_chat_job(
+    conn: aiosqlite.Connection,
+    job: _ChatJob,
+    *,
+    settings: SettingsRecord,
+    options: CycleOptions,
+    tg: TelegramClientManager,
+    token_model: str,
+) -> _ChatJob | None:
+    chat = job.chat
+
+    # Incremental fetch: only ask Telegram for messages past the local store's high-water mark.
+    high_water_mark = await get_high_water_mark(conn, chat.id)
+    if high_water_mark is None:
+        messages = await tg.fetch_last_messages(chat.id, limit=settings.k_messages)
+    else:
+        messages = await tg.fetch_messages_since(chat.id, min_id=high_water_mark, limit=settings.k_messages)
+    fetched = [source_message_from_telegram(m) for m in messages]
+
+    async with transaction(conn):
+        await record_chat_activity(
+            conn,
+            chat,
+            message_dates=[message_date(m) for m in messages if not message_from_me(m)],
+            observed_at=datetime.now(timezone.utc),
+        )
+        if fetched:
+            await store_messages(conn, chat.id, fetched)
+
+    # Context is built from the local rolling window (stored + just fetched).
+    window = await get_message_window(conn, chat.id, limit=settings.k_messages)
+    if not window:
+        return None
+
+    # High-water mark over all messages (incl. media/service ones), so a non-text top
+    # message does not make the dialog pre-pass think the chat changed on every cycle.
+    window_max_id = max(m.id for m in window)
+
+    # Keep only text messages
+    source = [m for m in window if m.text]
+
+    latest_id = max((m.id for m in source), default=0)
+    no_new_text = not source or (
+        chat.last_seen_message_id is not None and latest_id <= chat.last_seen_message_id
+    )
+    # If the most recent message is ours, usually no reply is needed.
+    if no_new_text or source[-1].from_me:
+        if chat.last_seen_message_id is None or window_max_id > chat.last_seen_message_id:
+            await update_chat_last_seen_message_id(conn, chat_id=chat.id, last_seen_message_id=window_max_id)
+        return None
+
+    if options.reply_gate_threshold > 0:
+        decision = score_needs_reply(source, my_names=tg.my_names, threshold=options.reply_gate_threshold)
+        if not decision.needs_reply:
+            logger.info(
+                "Reply gate: skipping chat_id=%s (%s), score=%.2f < %.2f [%s]",
+                chat.id,
+                chat.title,
+                decision.score,
+                options.reply_gate_threshold,
+                ", ".join(decision.reasons),
+            )
+            # Not re-scored until a new message arrives.
+            await update_chat_last_seen_message_id(conn, chat_id=chat.id, last_seen_message_id=window_max_id)
+            return None
+        logger.debug(
+            "Reply gate: chat_id=%s score=%.2f [%s]", chat.id, decision.score, ", ".join(decision.reasons)
+        )
+
+    if options.context_token_budget > 0 or options.context_max_message_tokens > 0:
+        source, job.context_stats = fit_messages_to_budget(
+            source,
+            budget_tokens=options.context_token_budget,
+            max_message_tokens=options.context_max_message_tokens,
+            model=token_model,
+        )
+        st = job.context_stats
+        if st.messages_after < st.messages_before or st.truncated_messages:
+            logger.info(
+                "Context trimmed for chat_id=%s: %s -> %s messages, ~%s -> ~%s tokens (%s truncated)",
+                chat.id,
+                st.messages_before,
+                st.messages_after,
+                st.tokens_before,
+                st.tokens_after,
+                st.truncated_messages,
+            )
+
+    job.source = source
+    job.latest_id = window_max_id
+    job.messages_json = json.dumps([m.model_dump() for m in source], ensure_ascii=False)
+    job.incoming_ids = [m.id for m in source if not m.from_me]
+    return job
+
+
+async def _summarize_chat_job(
+    conn: aiosqlite.Connection,
+    job: _ChatJob,
+    *,
+    openai_summary: OpenAIClient,
+    prompts: PromptStore,
+    system_prompt: str,
+) -> _ChatJob | None:
+    chat = job.chat
+    covers_id = max(m.id for m in job.source)
+
+    # Step 1: summarize with GPT-4 class model. If the stored summary still connects to the
+    # current window, only the messages after it are sent along with the previous summary; if it
+    # already covers the whole window, it is reused as is.
+    previous = await get_chat_summary(conn, chat.id)
+    delta = _summary_delta(previous, job.source)
+    if previous is not None and delta == []:
+        summary = previous.summary
+    else:
+        if previous is not None and delta:
+            incremental_updates = previous.incremental_updates + 1
+            summary_prompt = prompts.render(
+                "summarize_incremental",
+                chat_title=chat.title,
+                language_hint=(chat.language_hint or ""),
+                previous_summary_json=previous.summary.model_dump_json(),
+                messages_json=json.dumps([m.model_dump() for m in delta], ensure_ascii=False),
+            ).content
+        else:
+            incremental_updates = 0
             summary_prompt = prompts.render(
                 "summarize_context",
                 chat_title=chat.title,
                 language_hint=(chat.language_hint or ""),
-                messages_json=messages_json,
+                messages_json=job.messages_json,
             ).content
 
-            summary: ChatContextSummary = await openai_summary.request_json(
-                system_prompt=system_prompt,
-                user_prompt=summary_prompt,
-                schema_model=ChatContextSummary,
-            )
+        summary = await openai_summary.request_json(
+            system_prompt=system_prompt,
+            user_prompt=summary_prompt,
+            schema_model=ChatContextSummary,
+            deadline=job.deadline,
+            chat_id=chat.id,
+            stage="summary",
+        )
 
-            reply_to_id = summary.reply_to_message_id
-            if reply_to_id not in incoming_id_set:
-                reply_to_id = fallback_reply_to
-            if reply_to_id is None:
-                # No incoming messages to reply to.
-                await update_chat_last_seen_message_id(conn, chat_id=chat.id, last_seen_message_id=latest_id)
-                continue
+        await save_chat_summary(
+            conn,
+            chat_id=chat.id,
+            summary=summary,
+            covers_message_id=covers_id,
+            incremental_updates=incremental_updates,
+        )
 
-            reply_to_text = next((m.text for m in source if m.id == reply_to_id), "")
+    reply_to_id = _pick_reply_to_id(summary.reply_to_message_id, job.incoming_ids)
+    if reply_to_id is None:
+        # No incoming messages to reply to.
+        await update_chat_last_seen_message_id(conn, chat_id=chat.id, last_seen_message_id=job.latest_id)
+        return None
 
-            # Step 2: craft reply with GPT-5 model from summary + the specific message to reply to
-            user_prompt = prompts.render(
-                "suggest_reply",
-                chat_title=chat.title,
-                language_hint=(chat.language_hint or ""),
-                summary_json=json.dumps(summary.model_dump(), ensure_ascii=False),
-                reply_to_message_id=str(reply_to_id),
-                reply_to_text=reply_to_text,
-            ).content
+    job.summary = summary
+    job.reply_to_id = reply_to_id
+    return job
 
-            reply: ReplySuggestion = await openai_reply.request_json(
-                system_prompt=system_prompt,
-                user_prompt=user_prompt,
-                schema_model=ReplySuggestion,
-            )
 
+def _stage_deadline(options: CycleOptions) -> float | None:
+    if options.chat_deadline_seconds <= 0:
+        return None
+    return time.monotonic() + options.chat_deadline_seconds
+
+
+def _pick_reply_to_id(candidate: int | None, incoming_ids: list[int]) -> int | None:
+    """The model's reply target if it is an incoming message in the window, else the latest incoming one."""
+
+    if candidate in set(incoming_ids):
+        return candidate
+    return incoming_ids[-1] if incoming_ids else None
+
+
+def _use_single_call(job: _ChatJob, options: CycleOptions) -> bool:
+    if options.generation_mode == "single":
+        return True
+    if options.generation_mode != "auto":
+        return False
+    return (
+        len(job.source) <= options.single_call_max_messages
+        and sum(len(m.text) for m in job.source) <= options.single_call_max_chars
+    )
+
+
+def _summary_delta(previous: StoredChatSummary | None, source: list[SourceMessage]) -> list[SourceMessage] | None:
+    """
+    Messages to fold into `previous` incrementally; None means "summarize the full window".
+
+    An empty list means the stored summary already covers every message in the window. Falls back
+    to a full summary when there is nothing stored, when the stored summary is older than the
+    window (messages in between were never summarized), or after `_MAX_INCREMENTAL_SUMMARY_UPDATES`
+    updates in a row (to limit drift).
+    """
+
+    if previous is None or not source or previous.covers_message_id < source[0].id:
+        return None
+    delta = [m for m in source if m.id > previous.covers_message_id]
+    if not delta:
+        return []
+    if previous.incremental_updates >= _MAX_INCREMENTAL_SUMMARY_UPDATES or len(delta) >= len(source):
+        return None
+    return delta
+
+
+def _alternatives_prompt(prompts: PromptStore, options: CycleOptions) -> str:
+    """Suffix asking the reply call for `options.reply_alternatives` extra candidates (empty when off)."""
+
+    if options.reply_alternatives <= 0:
+        return ""
+    return "\n\n" + prompts.render("reply_alternatives", count=str(options.reply_alternatives)).content
+
+
+def _check_alternatives(result: ReplySuggestion | SummaryAndReply, *, requested: int | None, chat_id: int) -> None:
+    """Logs when alternatives were requested but the answer has no `alternatives` key (json_object mode)."""
+
+    if requested and "alternatives" not in result.model_fields_set:
+        logger.warning(
+            "Reply for chat_id=%s has no alternatives key (%s requested); storing the main text only",
+            chat_id,
+            requested,
+        )
+
+
+async def _request_reply(
+    job: _ChatJob,
+    *,
+    openai_reply: OpenAIClient,
+    openai_cheap: OpenAIClient | None,
+    options: CycleOptions,
+    prompts: PromptStore,
+    system_prompt: str,
+    user_prompt: str,
+    schema_model: type[T],
+    cascade_schema: type[BaseModel],
+    stage: str,
+) -> T:
+    """Reply-stage call: through the cheap-model cascade when it applies to this chat, else the reply model."""
+
+    if openai_cheap is not None and openai_cheap.enabled and use_cheap_first(
+        job.source, is_low_priority=job.chat.is_low_priority, options=options.cascade
+    ):
+        return await request_with_cascade(
+            cheap=openai_cheap,
+            strong=openai_reply,
+            system_prompt=system_prompt,
+            user_prompt=user_prompt,
+            confidence_prompt=prompts.get("cascade_confidence").content,
+            schema_model=schema_model,
+            cascade_schema=cascade_schema,
+            options=options.cascade,
+            deadline=job.deadline,
+            chat_id=job.chat.id,
+            stage=stage,
+        )
+    return await openai_reply.request_json(
+        system_prompt=system_prompt,
+        user_prompt=user_prompt,
+        schema_model=schema_model,
+        deadline=job.deadline,
+        chat_id=job.chat.id,
+        stage=stage,
+    )
+
+
+async def _reply_chat_job(
+    conn: aiosqlite.Connection,
+    job: _ChatJob,
+    *,
+    openai_reply: OpenAIClient,
+    openai_cheap: OpenAIClient | None,
+    options: CycleOptions,
+    prompts: PromptStore,
+    system_prompt: str,
+) -> None:
+    chat = job.chat
+    assert job.summary is not None and job.reply_to_id is not None
+
+    reply_to_text = next((m.text for m in job.source if m.id == job.reply_to_id), "")
+
+    # Step 2: craft reply with GPT-5 model from summary + the specific message to reply to
+    user_prompt = prompts.render(
+        "suggest_reply",
+        chat_title=chat.title,
+        language_hint=(chat.language_hint or ""),
+        summary_json=json.dumps(job.summary.model_dump(), ensure_ascii=False),
+        reply_to_message_id=str(job.reply_to_id),
+        reply_to_text=reply_to_text,
+    ).content + _alternatives_prompt(prompts, options)
+
+    reply: ReplySuggestion = await _request_reply(
+        job,
+        openai_reply=openai_reply,
+        openai_cheap=openai_cheap,
+        options=options,
+        prompts=prompts,
+        system_prompt=system_prompt,
+        user_prompt=user_prompt,
+        schema_model=ReplySuggestion,
+        cascade_schema=CascadeReplySuggestion,
+        stage="reply",
+    )
+    _check_alternatives(reply, requested=options.reply_alternatives, chat_id=chat.id)
+
+    async with transaction(conn):
+        await create_suggestion(
+            conn,
+            chat_id=chat.id,
+            source_messages_json=job.messages_json,
+            suggested_text=reply.suggested_text,
+            ru_translation=reply.ru_translation,
+            reply_to_message_id=job.reply_to_id,
+            status=SuggestionStatus.pending,
+            context_stats=job.context_stats,
+            alternatives=reply.alternatives,
+            max_alternatives=options.reply_alternatives,
+        )
+        await update_chat_last_seen_message_id(conn, chat_id=chat.id, last_seen_message_id=job.latest_id)
+
+
+async def _summarize_and_reply_chat_job(
+    conn: aiosqlite.Connection,
+    job: _ChatJob,
+    *,
+    openai_reply: OpenAIClient,
+    openai_cheap: OpenAIClient | None,
+    options: CycleOptions,
+    prompts: PromptStore,
+    system_prompt: str,
+) -> None:
+    """Single-call generation: summary fields and reply from one request to the reply model."""
+
+    chat = job.chat
+
+    user_prompt = prompts.render(
+        "summarize_and_reply",
+        chat_title=chat.title,
+        language_hint=(chat.language_hint or ""),
+        messages_json=job.messages_json,
+    ).content + _alternatives_prompt(prompts, options)
+
+    result: SummaryAndReply = await _request_reply(
+        job,
+        openai_reply=openai_reply,
+        openai_cheap=openai_cheap,
+        options=options,
+        prompts=prompts,
+        system_prompt=system_prompt,
+        user_prompt=user_prompt,
+        schema_model=SummaryAndReply,
+        cascade_schema=CascadeSummaryAndReply,
+        stage="summary_reply",
+    )
+    _check_alternatives(result, requested=options.reply_alternatives, chat_id=chat.id)
+
+    reply_to_id = _pick_reply_to_id(result.reply_to_message_id, job.incoming_ids)
+    summary = ChatContextSummary(
+        language=result.language,
+        tone=result.tone,
+        summary=result.summary,
+        reply_to_message_id=reply_to_id,
+    )
+
+    async with transaction(conn):
+        # Keeps the rolling summary current, so a later two-stage run can continue incrementally.
+        await save_chat_summary(
+            conn,
+            chat_id=chat.id,
+            summary=summary,
+            covers_message_id=max(m.id for m in job.source),
+            incremental_updates=0,
+        )
+        if reply_to_id is not None:
             await create_suggestion(
                 conn,
                 chat_id=chat.id,
-                source_messages_json=messages_json,
-                suggested_text=reply.suggested_text,
-                ru_translation=reply.ru_translation,
+                source_messages_json=job.messages_json,
+                suggested_text=result.suggested_text,
+                ru_translation=result.ru_translation,
                 reply_to_message_id=reply_to_id,
                 status=SuggestionStatus.pending,
+                context_stats=job.context_stats,
+                alternatives=result.alternatives,
+                max_alternatives=options.reply_alternatives,
             )
-            await update_chat_last_seen_message_id(conn, chat_id=chat.id, last_seen_message_id=latest_id)
-
-        except Exception as e:
-            logger.exception("Suggestion generation failed for chat_id=%s (%s)", chat.id, chat.title)
-            # Try to persist a failed suggestion for visibility (but don't crash the whole cycle).
-            try:
-                await create_suggestion(
-                    conn,
-                    chat_id=chat.id,
-                    source_messages_json="[]",
-                    suggested_text="",
-                    ru_translation="",
-                    status=SuggestionStatus.failed,
-                    error=str(e),
+        await update_chat_last_seen_message_id(conn, chat_id=chat.id, last_seen_message_id=job.latest_id)
+
+
+async def _submit_batch(
+    conn: aiosqlite.Connection,
+    jobs: list[_ChatJob],
+    *,
+    batch: BatchBackend,
+    openai_reply: OpenAIClient,
+    prompts: PromptStore,
+    system_prompt: str,
+    options: CycleOptions,
+) -> None:
+    """Submits one single-call (summarize_and_reply) request per job as an offline batch."""
+
+    requests: dict[str, dict[str, Any]] = {}
+    items: list[BatchItem] = []
+    for job in jobs:
+        custom_id = f"chat-{job.chat.id}-{job.latest_id}"
+        user_prompt = prompts.render(
+            "summarize_and_reply",
+            chat_title=job.chat.title,
+            language_hint=(job.chat.language_hint or ""),
+            messages_json=job.messages_json,
+        ).content + _alternatives_prompt(prompts, options)
+        requests[custom_id] = openai_reply.completion_request_body(
+            system_prompt=system_prompt, user_prompt=user_prompt, schema_model=SummaryAndReply
+        )
+        items.append(
+            BatchItem(
+                custom_id=custom_id,
+                chat_id=job.chat.id,
+                messages_json=job.messages_json,
+                latest_id=job.latest_id,
+                covers_message_id=max(m.id for m in job.source),
+                incoming_ids=job.incoming_ids,
+                context_stats=job.context_stats,
+            )
+        )
+
+    remote_id = await batch.submit(requests)
+    await create_batch(conn, backend=batch.name, remote_id=remote_id, model=openai_reply.model, items=items)
+    logger.info("Queued %s low-priority chats in offline batch %s", len(items), remote_id)
+
+
+async def collect_finished_batches(
+    conn: aiosqlite.Connection,
+    *,
+    batch: BatchBackend,
+    usage: LLMUsageRecorder | None = None,
+    max_alternatives: int | None = None,
+) -> None:
+    """
+    Polls submitted batches of this backend and turns finished ones into suggestions
+    (pending on success, failed per item otherwise). Each item is logged to `usage` as one call.
+
+    A batch's suggestions and its finished status are written in one transaction, so a failure
+    part-way leaves the batch open to be collected again without duplicate suggestions.
+    """
+
+    for open_batch in await list_open_batches(conn, backend=batch.name):
+        state = await batch.poll(open_batch.remote_id)
+        if state == "pending":
+            continue
+
+        results: dict[str, BatchResult] = {}
+        if state == "completed":
+            results = await batch.results(open_batch.remote_id)
+
+        records: list[LLMCallRecord] = []
+        async with transaction(conn):
+            for item in open_batch.items:
+                result = results.get(item.custom_id) or BatchResult(error=f"Offline batch {state} without a result")
+                await _store_batch_result(conn, item, result, max_alternatives=max_alternatives)
+                call_usage = CallUsage()
+                call_usage.add(result.usage)
+                records.append(
+                    LLMCallRecord(
+                        chat_id=item.chat_id,
+                        stage="batch",
+                        model=open_batch.model,
+                        usage=call_usage,
+                        latency_ms=None,
+                        attempts=1,
+                        outcome="ok" if result.content is not None else "BatchError",
+                    )
                 )
-            except Exception:
-                logger.exception("Failed to persist failed suggestion record for chat_id=%s", chat.id)
+            await finish_batch(conn, batch_id=open_batch.id, status=state)
 
-    logger.info("Suggestion cycle done")
+        if usage is not None:
+            for record in records:
+                usage.record(record)
+        logger.info("Collected offline batch %s (%s, %s chats)", open_batch.remote_id, state, len(open_batch.items))
+
+
+async def _store_batch_result(
+    conn: aiosqlite.Connection, item: BatchItem, result: BatchResult, *, max_alternatives: int | None = None
+) -> None:
+    try:
+        if result.content is None:
+            raise ValueError(result.error or "Empty batch result")
+        parsed = parse_json_content(result.content, SummaryAndReply)
+    except ValueError as e:
+        await create_suggestion(
+            conn,
+            chat_id=item.chat_id,
+            source_messages_json=item.messages_json,
+            suggested_text="",
+            ru_translation="",
+            status=SuggestionStatus.failed,
+            error=str(e),
+        )
+        return
+
+    _check_alternatives(parsed, requested=max_alternatives, chat_id=item.chat_id)
+    reply_to_id = _pick_reply_to_id(parsed.reply_to_message_id, item.incoming_ids)
+    # The chat may have been summarized past this item while the batch was running.
+    previous = await get_chat_summary(conn, item.chat_id)
+    if previous is None or previous.covers_message_id <= item.covers_message_id:
+        await save_chat_summary(
+            conn,
+            chat_id=item.chat_id,
+            summary=ChatContextSummary(
+                language=parsed.language, tone=parsed.tone, summary=parsed.summary, reply_to_message_id=reply_to_id
+            ),
+            covers_message_id=item.covers_message_id,
+            incremental_updates=0,
+        )
+    if reply_to_id is not None:
+        await create_suggestion(
+            conn,
+            chat_id=item.chat_id,
+            source_messages_json=item.messages_json,
+            suggested_text=parsed.suggested_text,
+            ru_translation=parsed.ru_translation,
+            reply_to_message_id=reply_to_id,
+            status=SuggestionStatus.pending,
+            context_stats=item.context_stats,
+            alternatives=parsed.alternatives,
+            max_alternatives=max_alternatives,
+        )
+    await update_chat_last_seen_message_id(conn, chat_id=item.chat_id, last_seen_message_id=item.latest_id)
 
 
 async def cleanup_old_suggestions(
@@ -410,20 +1256,20 @@ async def cleanup_old_suggestions(
     # Keep it simple: delete suggestions beyond N per chat (by created_at desc).
     # Note: This is a best-effort cleanup; SQLite window functions could do this more neatly.
     rows = await fetch_all(conn, "SELECT DISTINCT chat_id FROM suggestions;")
-    for r in rows:
-        chat_id = int(r["chat_id"])
-        ids = await fetch_all(
-            conn,
-            """
-            SELECT id FROM suggestions
-            WHERE chat_id = ?
-            ORDER BY created_at DESC
-            LIMIT -1 OFFSET ?;
-            """,
-            (chat_id, keep_last_per_chat),
-        )
-        if ids:
-            await conn.executemany("DELETE FROM suggestions WHERE id = ?;", [(int(x["id"]),) for x in ids])
-    await conn.commit()
+    async with transaction(conn):
+        for r in rows:
+            chat_id = int(r["chat_id"])
+            ids = await fetch_all(
+                conn,
+                """
+                SELECT id FROM suggestions
+                WHERE chat_id = ?
+                ORDER BY created_at DESC
+                LIMIT -1 OFFSET ?;
+                """,
+                (chat_id, keep_last_per_chat),
+            )
+            if ids:
+                await conn.executemany("DELETE FROM suggestions WHERE id = ?;", [(int(x["id"]),) for x in ids])
 
 
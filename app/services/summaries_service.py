@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+
+import aiosqlite
+
+from app.db import fetch_one, transaction, utcnow_iso
+from app.models import ChatContextSummary
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class StoredChatSummary:
+    summary: ChatContextSummary
+    # Highest message id the summary was built from.
+    covers_message_id: int
+    # Incremental updates applied since the last full summary.
+    incremental_updates: int
+
+
+async def get_chat_summary(conn: aiosqlite.Connection, chat_id: int) -> StoredChatSummary | None:
+    row = await fetch_one(
+        conn,
+        "SELECT summary_json, covers_message_id, incremental_updates FROM chat_summaries WHERE chat_id = ?;",
+        (int(chat_id),),
+    )
+    if row is None:
+        return None
+    try:
+        summary = ChatContextSummary.model_validate_json(str(row["summary_json"]))
+    except ValueError:
+        logger.warning("Ignoring invalid stored summary for chat_id=%s", chat_id)
+        return None
+    return StoredChatSummary(
+        summary=summary,
+        covers_message_id=int(row["covers_message_id"]),
+        incremental_updates=int(row["incremental_updates"] or 0),
+    )
+
+
+async def save_chat_summary(
+    conn: aiosqlite.Connection,
+    *,
+    chat_id: int,
+    summary: ChatContextSummary,
+    covers_message_id: int,
+    incremental_updates: int,
+) -> None:
+    async with transaction(conn):
+        await conn.execute(
+            """
+            INSERT INTO chat_summaries (chat_id, summary_json, covers_message_id, incremental_updates, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET
+                summary_json = excluded.summary_json,
+                covers_message_id = excluded.covers_message_id,
+                incremental_updates = excluded.incremental_updates,
+                updated_at = excluded.updated_at;
+            """,
+            (int(chat_id), summary.model_dump_json(), int(covers_message_id), int(incremental_updates), utcnow_iso()),
+        )
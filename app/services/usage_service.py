@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+import aiosqlite
+
+from app.db import fetch_all
+
+# Grouping columns the usage views can break calls down by.
+_GROUP_COLUMNS = {"model": "c.model", "stage": "c.stage", "chat": "c.chat_id"}
+
+
+@dataclass(frozen=True)
+class UsageGroup:
+    key: str
+    # Chat title for the "chat" grouping.
+    label: str
+    calls: int
+    errors: int
+    cached_calls: int
+    prompt_tokens: int
+    completion_tokens: int
+    cached_tokens: int
+    p50_latency_ms: int | None
+    p95_latency_ms: int | None
+    # USD; None when a model in the group has no configured price.
+    cost: float | None
+
+
+def _percentile(sorted_values: list[int], q: float) -> int | None:
+    """Nearest-rank percentile of an ascending list."""
+
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def call_cost(
+    prices: dict[str, list[float]], *, model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int
+) -> float | None:
+    """USD for one model's tokens; prices are per 1M tokens: [input, output] or [input, output, cached input]."""
+
+    price = prices.get(model)
+    if not price or len(price) < 2:
+        return None
+    cached_price = price[2] if len(price) > 2 else price[0]
+    uncached = max(0, prompt_tokens - cached_tokens)
+    return (uncached * price[0] + cached_tokens * cached_price + completion_tokens * price[1]) / 1_000_000
+
+
+async def usage_breakdown(
+    conn: aiosqlite.Connection,
+    *,
+    group_by: str,
+    since_hours: float,
+    prices: dict[str, list[float]],
+    limit: int = 50,
+) -> list[UsageGroup]:
+    """
+    LLM calls of the last `since_hours`, aggregated per model, stage or chat, ordered by total tokens.
+
+    Latency percentiles only count calls that reached the API (not cache hits or offline batches).
+    """
+
+    column = _GROUP_COLUMNS[group_by]
+    since = (datetime.now(timezone.utc) - timedelta(hours=since_hours)).replace(microsecond=0).isoformat()
+    rows = await fetch_all(
+        conn,
+        f"""
+        SELECT {column} AS group_key, c.model, COALESCE(ch.title, '') AS chat_title,
+               COUNT(*) AS calls,
+               SUM(CASE WHEN c.outcome NOT IN ('ok', 'cached') THEN 1 ELSE 0 END) AS errors,
+               SUM(CASE WHEN c.outcome = 'cached' THEN 1 ELSE 0 END) AS cached_calls,
+               SUM(c.prompt_tokens) AS prompt_tokens,
+               SUM(c.completion_tokens) AS completion_tokens,
+               SUM(c.cached_tokens) AS cached_tokens
+        FROM llm_calls c
+        LEFT JOIN chats ch ON ch.id = c.chat_id
+        WHERE c.created_at >= ?
+        GROUP BY {column}, c.model;
+        """,
+        (since,),
+    )
+    latency_rows = await fetch_all(
+        conn,
+        f"""
+        SELECT {column} AS group_key, c.latency_ms
+        FROM llm_calls c
+        WHERE c.created_at >= ? AND c.latency_ms IS NOT NULL AND c.outcome != 'cached'
+        ORDER BY c.latency_ms ASC;
+        """,
+        (since,),
+    )
+
+    latencies: dict[str, list[int]] = {}
+    for r in latency_rows:
+        latencies.setdefault(str(r["group_key"]), []).append(int(r["latency_ms"]))
+
+    groups: dict[str, dict] = {}
+    for r in rows:
+        key = str(r["group_key"])
+        g = groups.setdefault(
+            key,
+            {
+                "label": str(r["chat_title"]) if group_by == "chat" else key,
+                "calls": 0,
+                "errors": 0,
+                "cached_calls": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "cached_tokens": 0,
+                "cost": 0.0,
+            },
+        )
+        for name in ("calls", "errors", "cached_calls", "prompt_tokens", "completion_tokens", "cached_tokens"):
+            g[name] += int(r[name] or 0)
+        cost = call_cost(
+            prices,
+            model=str(r["model"]),
+            prompt_tokens=int(r["prompt_tokens"] or 0),
+            completion_tokens=int(r["completion_tokens"] or 0),
+            cached_tokens=int(r["cached_tokens"] or 0),
+        )
+        g["cost"] = None if cost is None or g["cost"] is None else g["cost"] + cost
+
+    out = [
+        UsageGroup(
+            key=key,
+            p50_latency_ms=_percentile(latencies.get(key, []), 50),
+            p95_latency_ms=_percentile(latencies.get(key, []), 95),
+            **g,
+        )
+        for key, g in groups.items()
+    ]
+    out.sort(key=lambda g: g.prompt_tokens + g.completion_tokens, reverse=True)
+    return out[:limit]
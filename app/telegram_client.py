@@ -2,32 +2,78 @@ from __future__ import annotations
 
 import logging
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Awaitable, Callable, Iterable, Mapping, TypeVar
 
-from telethon import TelegramClient
-from telethon.errors import FloodWaitError
-from telethon.tl.types import User
+from telethon import TelegramClient, errors, events, utils
+from telethon.tl.functions.messages import GetPeerDialogsRequest
+from telethon.tl.types import InputDialogPeer, User
+
+from app.telegram_rate_limit import TelegramRateLimiter
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# messages.getPeerDialogs accepts up to 100 peers per request.
+_PEER_DIALOGS_BATCH_SIZE = 100
+
+# Errors meaning a cached InputPeer (its access hash) is no longer valid for this account:
+# another account logged in, or a channel was left / banned from.
+_STALE_PEER_ERRORS = (
+    errors.PeerIdInvalidError,
+    errors.ChannelInvalidError,
+    errors.ChannelPrivateError,
+    errors.ChatIdInvalidError,
+    errors.UserIdInvalidError,
+)
+
 
 @dataclass(frozen=True)
 class DialogInfo:
     id: int
     title: str
+    # Resolved InputPeer (with access hash), if Telethon provided one.
+    input_peer: Any | None = None
+
+
+@dataclass(frozen=True)
+class DialogState:
+    id: int
+    top_message_id: int
+    unread_count: int
 
 
 class TelegramClientManager:
     """
     Thin wrapper around Telethon client.
 
+    Every Telethon request goes through a per-method-class rate limiter (see
+    app/telegram_rate_limit.py), which also handles FloodWaitError centrally.
+
     This app intentionally does NOT try to do interactive login in the web UI.
     Run scripts/telegram_login.py once on the server to create ./data/telethon.session.
     """
 
-    def __init__(self, *, api_id: int, api_hash: str, session_name: str):
-        self._client = TelegramClient(session_name, api_id, api_hash)
+    def __init__(
+        self,
+        *,
+        api_id: int,
+        api_hash: str,
+        session_name: str,
+        rate_limiter: TelegramRateLimiter | None = None,
+    ):
+        # flood_sleep_threshold=0: FloodWaitError always surfaces so the limiter can pause the method class.
+        self._client = TelegramClient(session_name, api_id, api_hash, flood_sleep_threshold=0)
+        self._limiter = rate_limiter or TelegramRateLimiter()
         self._authorized: bool = False
+        # Lowercased username / first name of the logged-in user (for "mentions me" checks).
+        self._my_names: tuple[str, ...] = ()
+        self._watched_chat_ids: set[int] = set()
+        self._on_new_message: Callable[[int], None] | None = None
+        # chat_id -> InputPeer; primed from the persistent peer cache, consulted before Telethon.
+        self._input_peers: dict[int, Any] = {}
+        self._new_input_peers: dict[int, Any] = {}
+        self._stale_input_peers: set[int] = set()
 
     @property
     def client(self) -> TelegramClient:
@@ -37,6 +83,13 @@ class TelegramClientManager:
     def is_authorized(self) -> bool:
         return self._authorized
 
+    @property
+    def my_names(self) -> tuple[str, ...]:
+        return self._my_names
+
+    def rate_limit_stats(self) -> dict[str, dict[str, float]]:
+        return self._limiter.stats()
+
     async def start(self) -> None:
         await self._client.connect()
         self._authorized = await self._client.is_user_authorized()
@@ -48,6 +101,9 @@ class TelegramClientManager:
             return
 
         me = await self._client.get_me()
+        self._my_names = tuple(
+            n.lower() for n in (getattr(me, "username", None), getattr(me, "first_name", None)) if n
+        )
         logger.info("Telegram authorized as %s", _user_display(me))
 
     async def stop(self) -> None:
@@ -55,34 +111,167 @@ class TelegramClientManager:
 
     async def list_dialogs(self, *, limit: int = 1000) -> list[DialogInfo]:
         self._ensure_authorized()
-        dialogs = await self._client.get_dialogs(limit=limit)
+        dialogs = await self._limiter.call("dialogs", lambda: self._client.get_dialogs(limit=limit))
         out: list[DialogInfo] = []
         for d in dialogs:
             title = getattr(d, "name", None) or getattr(d, "title", None) or str(d.id)
-            out.append(DialogInfo(id=int(d.id), title=str(title)))
+            input_peer = getattr(d, "input_entity", None)
+            if input_peer is not None:
+                self._input_peers[int(d.id)] = input_peer
+            out.append(DialogInfo(id=int(d.id), title=str(title), input_peer=input_peer))
+        return out
+
+    def prime_input_peers(self, peers: Mapping[int, Any]) -> None:
+        """Seeds the in-memory input peer cache (e.g. from SQLite at startup)."""
+
+        self._input_peers.update({int(k): v for k, v in peers.items()})
+
+    def pop_new_input_peers(self) -> dict[int, Any]:
+        """Returns (and forgets) peers resolved via Telethon since the last call, for persisting."""
+
+        out, self._new_input_peers = self._new_input_peers, {}
+        return out
+
+    def pop_stale_input_peers(self) -> set[int]:
+        """Returns (and forgets) chat ids whose cached peer turned out stale, for deleting from SQLite."""
+
+        out, self._stale_input_peers = self._stale_input_peers, set()
+        return out
+
+    def _evict_input_peer(self, chat_id: int) -> None:
+        self._input_peers.pop(int(chat_id), None)
+        self._new_input_peers.pop(int(chat_id), None)
+        self._stale_input_peers.add(int(chat_id))
+
+    async def _call_with_peer(self, chat_id: int, method_class: str, fn: Callable[[Any], Awaitable[T]]) -> T:
+        """
+        Runs `fn(input_peer)` through the rate limiter. If a cached peer is rejected as stale, it is
+        evicted, re-resolved through Telethon once and the call retried.
+        """
+
+        cached = int(chat_id) in self._input_peers
+        peer = await self._input_peer(chat_id)
+        try:
+            return await self._limiter.call(method_class, lambda: fn(peer))
+        except _STALE_PEER_ERRORS as e:
+            if not cached:
+                raise
+            logger.warning("Cached input peer for chat_id=%s is stale (%s); re-resolving", chat_id, type(e).__name__)
+            self._evict_input_peer(chat_id)
+        peer = await self._input_peer(chat_id)
+        return await self._limiter.call(method_class, lambda: fn(peer))
+
+    async def _input_peer(self, chat_id: int) -> Any:
+        peer = self._input_peers.get(int(chat_id))
+        if peer is not None:
+            return peer
+        peer = await self._limiter.call("resolve", lambda: self._client.get_input_entity(chat_id))
+        self._input_peers[int(chat_id)] = peer
+        self._new_input_peers[int(chat_id)] = peer
+        return peer
+
+    async def fetch_dialog_states(self, chat_ids: Iterable[int]) -> dict[int, DialogState]:
+        """
+        Returns the top message id + unread count per chat, using one messages.getPeerDialogs
+        request per 100 chats. Chats whose entity cannot be resolved are omitted.
+        """
+
+        self._ensure_authorized()
+        ids = [int(x) for x in chat_ids]
+        out: dict[int, DialogState] = {}
+        for i in range(0, len(ids), _PEER_DIALOGS_BATCH_SIZE):
+            batch = ids[i : i + _PEER_DIALOGS_BATCH_SIZE]
+            cached = [chat_id for chat_id in batch if chat_id in self._input_peers]
+            try:
+                result = await self._peer_dialogs(batch)
+            except _STALE_PEER_ERRORS as e:
+                if not cached:
+                    raise
+                # The error does not say which peer is stale: re-resolve every cached one once.
+                logger.warning(
+                    "Dialog states rejected a cached input peer (%s); re-resolving %s peers",
+                    type(e).__name__,
+                    len(cached),
+                )
+                for chat_id in cached:
+                    self._evict_input_peer(chat_id)
+                result = await self._peer_dialogs(batch)
+            for d in getattr(result, "dialogs", []):
+                chat_id = int(utils.get_peer_id(d.peer))
+                out[chat_id] = DialogState(
+                    id=chat_id,
+                    top_message_id=int(getattr(d, "top_message", 0) or 0),
+                    unread_count=int(getattr(d, "unread_count", 0) or 0),
+                )
         return out
 
+    async def _peer_dialogs(self, chat_ids: list[int]) -> Any:
+        peers: list[InputDialogPeer] = []
+        for chat_id in chat_ids:
+            try:
+                peers.append(InputDialogPeer(peer=await self._input_peer(chat_id)))
+            except (ValueError, TypeError):
+                logger.warning("Cannot resolve chat_id=%s for dialog state", chat_id)
+        if not peers:
+            return None
+        request = GetPeerDialogsRequest(peers=peers)
+        return await self._limiter.call("dialogs", lambda: self._client(request))
+
     async def fetch_last_messages(self, chat_id: int, *, limit: int) -> list[Any]:
         """
         Returns Telethon Message objects, ordered oldest -> newest.
         """
 
         self._ensure_authorized()
-        entity = await self._client.get_input_entity(chat_id)
-        messages = await self._client.get_messages(entity, limit=limit)
+        messages = await self._call_with_peer(
+            chat_id, "history", lambda entity: self._client.get_messages(entity, limit=limit)
+        )
         # Telethon returns newest->oldest by default.
         return list(reversed(list(messages)))
 
+    async def fetch_messages_since(self, chat_id: int, *, min_id: int, limit: int) -> list[Any]:
+        """
+        Incremental fetch: only messages with id > min_id (at most the newest `limit`),
+        ordered oldest -> newest.
+        """
+
+        self._ensure_authorized()
+        messages = await self._call_with_peer(
+            chat_id, "history", lambda entity: self._client.get_messages(entity, limit=limit, min_id=int(min_id))
+        )
+        return list(reversed(list(messages)))
+
     async def send_message(self, chat_id: int, text: str, *, reply_to_message_id: int | None = None) -> Any:
         self._ensure_authorized()
-        entity = await self._client.get_input_entity(chat_id)
+        reply_to = int(reply_to_message_id) if reply_to_message_id else None
+        return await self._call_with_peer(
+            chat_id, "send", lambda entity: self._client.send_message(entity, text, reply_to=reply_to)
+        )
+
+    def watch_new_messages(self, on_new_message: Callable[[int], None]) -> None:
+        """
+        Push-based ingestion: calls `on_new_message(chat_id)` for every incoming message in a
+        watched chat (see `set_watched_chats`).
+
+        A single NewMessage handler filters against an in-memory set, so changing the selection
+        does not require re-registering handlers.
+        """
+
+        if self._on_new_message is None:
+            self._client.add_event_handler(self._handle_new_message, events.NewMessage(incoming=True))
+        self._on_new_message = on_new_message
+
+    def set_watched_chats(self, chat_ids: Iterable[int]) -> None:
+        self._watched_chat_ids = {int(x) for x in chat_ids}
+
+    async def _handle_new_message(self, event: Any) -> None:
+        chat_id = int(getattr(event, "chat_id", 0) or 0)
+        if chat_id not in self._watched_chat_ids or self._on_new_message is None:
+            return
         try:
-            if reply_to_message_id:
-                return await self._client.send_message(entity, text, reply_to=int(reply_to_message_id))
-            return await self._client.send_message(entity, text)
-        except FloodWaitError as e:
-            logger.warning("Telegram FloodWaitError: wait %ss", e.seconds)
-            raise
+            self._on_new_message(chat_id)
+        except Exception:
+            logger.exception("NewMessage handler failed for chat_id=%s", chat_id)
 
     def _ensure_authorized(self) -> None:
         if not self._authorized:
@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Mapping, TypeVar
+
+from telethon.errors import FloodWaitError
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Requests per second per method class. Conservative for a user account; FloodWait pauses the
+# affected class on top of this.
+DEFAULT_TELEGRAM_RATE_LIMITS: dict[str, float] = {
+    "dialogs": 0.5,
+    "history": 3.0,
+    "send": 1.0,
+    "resolve": 1.0,
+}
+
+
+class TokenBucket:
+    """
+    Async token bucket: `rate` tokens per second, bursts up to `capacity`.
+
+    Waiters are served FIFO. `pause()` blocks the bucket entirely (used for FloodWait).
+    """
+
+    def __init__(self, *, rate: float, capacity: float):
+        self.rate = max(0.01, float(rate))
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self.waiting = 0
+
+    @property
+    def paused_for(self) -> float:
+        return max(0.0, self._paused_until - time.monotonic())
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + max(0.0, float(seconds)))
+
+    async def acquire(self) -> float:
+        """Waits for a token; returns the number of seconds spent waiting."""
+
+        start = time.monotonic()
+        self.waiting += 1
+        try:
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    if now < self._paused_until:
+                        await asyncio.sleep(self._paused_until - now)
+                        continue
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1.0:
+                        self._tokens -= 1.0
+                        break
+                    await asyncio.sleep((1.0 - self._tokens) / self.rate)
+        finally:
+            self.waiting -= 1
+        return time.monotonic() - start
+
+
+@dataclass
+class _MethodStats:
+    calls: int = 0
+    waited_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+    flood_waits: int = 0
+
+
+class TelegramRateLimiter:
+    """
+    Per-method-class token buckets in front of every Telethon call.
+
+    On FloodWaitError the method class is paused for `e.seconds`; short waits (up to
+    `flood_retry_max_seconds`) are retried once after the pause, longer ones are re-raised.
+    """
+
+    def __init__(
+        self,
+        limits: Mapping[str, float] | None = None,
+        *,
+        burst_seconds: float = 2.0,
+        flood_retry_max_seconds: float = 60.0,
+    ):
+        limits = {**DEFAULT_TELEGRAM_RATE_LIMITS, **(limits or {})}
+        self._buckets = {
+            name: TokenBucket(rate=rate, capacity=max(1.0, rate * burst_seconds)) for name, rate in limits.items()
+        }
+        self._stats = {name: _MethodStats() for name in limits}
+        self._flood_retry_max_seconds = max(0.0, float(flood_retry_max_seconds))
+
+    async def call(self, method: str, fn: Callable[[], Awaitable[T]]) -> T:
+        bucket = self._buckets[method]
+        stats = self._stats[method]
+        for attempt in range(2):
+            waited = await bucket.acquire()
+            stats.calls += 1
+            stats.waited_seconds += waited
+            stats.max_wait_seconds = max(stats.max_wait_seconds, waited)
+            try:
+                return await fn()
+            except FloodWaitError as e:
+                stats.flood_waits += 1
+                bucket.pause(e.seconds)
+                retry = attempt == 0 and e.seconds <= self._flood_retry_max_seconds
+                logger.warning(
+                    "Telegram FloodWaitError on %s: pausing %ss%s",
+                    method,
+                    e.seconds,
+                    " (will retry)" if retry else "",
+                )
+                if not retry:
+                    raise
+        raise AssertionError("unreachable")
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        out: dict[str, dict[str, float]] = {}
+        for name, bucket in self._buckets.items():
+            st = self._stats[name]
+            out[name] = {
+                "rate_per_second": bucket.rate,
+                "queued": bucket.waiting,
+                "calls": st.calls,
+                "avg_wait_seconds": (st.waited_seconds / st.calls) if st.calls else 0.0,
+                "max_wait_seconds": st.max_wait_seconds,
+                "flood_waits": st.flood_waits,
+                "paused_for_seconds": bucket.paused_for,
+            }
+        return out
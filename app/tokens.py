@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import json
+import logging
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any
+
+from app.models import SourceMessage
+
+logger = logging.getLogger(__name__)
+
+try:  # Optional: exact counts when tiktoken is installed, otherwise a chars/4 estimate.
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+_CHARS_PER_TOKEN = 4
+_TRUNCATION_MARK = " …[truncated]"
+
+
+@lru_cache(maxsize=16)
+def _encoding(model: str) -> Any | None:
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        # Unknown / newer model names: the o200k encoding is used by the current OpenAI model families.
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str, *, model: str) -> int:
+    enc = _encoding(model)
+    if enc is None:
+        return -(-len(text) // _CHARS_PER_TOKEN)
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def truncate_text(text: str, *, max_tokens: int, model: str) -> str:
+    """Cuts `text` to about `max_tokens` tokens (keeping the beginning) and marks the cut."""
+
+    if count_tokens(text, model=model) <= max_tokens:
+        return text
+    enc = _encoding(model)
+    if enc is None:
+        return text[: max_tokens * _CHARS_PER_TOKEN].rstrip() + _TRUNCATION_MARK
+    return enc.decode(enc.encode(text, disallowed_special=())[:max_tokens]).rstrip() + _TRUNCATION_MARK
+
+
+def message_tokens(message: SourceMessage, *, model: str) -> int:
+    """Tokens one message contributes to `messages_json` (the serialized object, not just the text)."""
+
+    return count_tokens(json.dumps(message.model_dump(), ensure_ascii=False), model=model)
+
+
+@dataclass(frozen=True)
+class ContextBudgetStats:
+    messages_before: int
+    messages_after: int
+    tokens_before: int
+    tokens_after: int
+    truncated_messages: int
+
+
+def fit_messages_to_budget(
+    messages: list[SourceMessage],
+    *,
+    budget_tokens: int,
+    max_message_tokens: int,
+    model: str,
+) -> tuple[list[SourceMessage], ContextBudgetStats]:
+    """
+    Caps every message text at `max_message_tokens`, then drops the oldest messages until the
+    rest fits `budget_tokens`. The newest message is always kept. Input is oldest -> newest.
+    """
+
+    sizes_before = [message_tokens(m, model=model) for m in messages]
+
+    capped: list[SourceMessage] = []
+    truncated = 0
+    for m in messages:
+        text = truncate_text(m.text, max_tokens=max_message_tokens, model=model) if max_message_tokens > 0 else m.text
+        if text != m.text:
+            truncated += 1
+            m = m.model_copy(update={"text": text})
+        capped.append(m)
+
+    sizes = [message_tokens(m, model=model) for m in capped]
+    total = sum(sizes)
+    start = 0
+    while budget_tokens > 0 and total > budget_tokens and start < len(capped) - 1:
+        total -= sizes[start]
+        start += 1
+
+    kept = capped[start:]
+    return kept, ContextBudgetStats(
+        messages_before=len(messages),
+        messages_after=len(kept),
+        tokens_before=sum(sizes_before),
+        tokens_after=total,
+        truncated_messages=truncated,
+    )
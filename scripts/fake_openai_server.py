@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if PROJECT_ROOT.as_posix() not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT.as_posix())
+
+from app.fake_llm import FakeLLM
+
+# How long an injected timeout holds the request (longer than any sane client timeout).
+_HANG_SECONDS = 600
+
+
+def build_app(fake: FakeLLM) -> FastAPI:
+    app = FastAPI(title="Fake OpenAI-compatible server")
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request) -> JSONResponse:
+        reply = await fake.complete(await request.json())
+        if reply.hang:
+            await asyncio.sleep(_HANG_SECONDS)
+        return JSONResponse(reply.body, status_code=reply.status_code, headers=reply.headers)
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Deterministic OpenAI-compatible chat completions server for offline load tests. "
+            "Point the app at it with LLM_PROVIDER=compatible LLM_BASE_URL=http://127.0.0.1:8900/v1."
+        )
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", default="lognormal:800:0.5", help="fixed:MS | uniform:MIN:MAX | lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--errors", default="", help='kind:probability pairs, e.g. "429:0.05,500:0.02,timeout:0.01"')
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    fake = FakeLLM(latency=args.latency, errors=args.errors, seed=args.seed)
+    uvicorn.run(build_app(fake), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()